@@ -1,6 +1,6 @@
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain.agents import create_agent
-from langchain_core.messages import HumanMessage, AIMessage, BaseMessage
+from langchain_core.messages import HumanMessage, AIMessage, BaseMessage, ToolMessage
 from typing import AsyncGenerator, Optional, List, Dict, Any
 import json
 
@@ -43,10 +43,13 @@ class PigFarmAgent:
     async def chat(
         self,
         message: str,
-        session_id: str
+        session_id: str,
+        metadata: Optional[Dict[str, Any]] = None
     ) -> str:
         """
         Process a user message and return the response.
+        If `metadata` is given, the RAG tool artifacts of this turn (deadline,
+        degraded stages) are added to it under "rag".
         """
         # Get chat history
         memory = session_store.get_or_create_memory(session_id)
@@ -62,6 +65,10 @@ class PigFarmAgent:
         
         # Find the last AIMessage with content
         messages = result["messages"]
+        if metadata is not None:
+            for msg in messages[len(input_messages):]:
+                _collect_rag_artifact(metadata, msg)
+
         response = ""
         for msg in reversed(messages):
             if isinstance(msg, AIMessage) and msg.content:
@@ -79,10 +86,12 @@ class PigFarmAgent:
     async def chat_stream(
         self,
         message: str,
-        session_id: str
+        session_id: str,
+        metadata: Optional[Dict[str, Any]] = None
     ) -> AsyncGenerator[str, None]:
         """
         Process a user message and stream the response.
+        If `metadata` is given, RAG tool artifacts are added to it as the tool finishes.
         """
         import asyncio
         
@@ -107,6 +116,9 @@ class PigFarmAgent:
                 # This helps developers trace the process on console
                 if kind == "on_tool_start" and name not in ["QueryTransformer", "rerank_with_threshold"]:
                     print(f"⏳ [Agent] Đang thực thi công cụ: {name}...")
+                
+                if kind == "on_tool_end" and metadata is not None:
+                    _collect_rag_artifact(metadata, event.get("data", {}).get("output"))
 
                 # 2. Stream LLM tokens
                 if kind == "on_chat_model_stream":
@@ -160,6 +172,12 @@ class PigFarmAgent:
                 session_store.add_message(session_id, message, error_msg)
 
 
+def _collect_rag_artifact(metadata: Dict[str, Any], message: Any):
+    """Append the artifact of a RAG tool message to metadata["rag"]"""
+    if isinstance(message, ToolMessage) and message.name == rag_tool.name and message.artifact:
+        metadata.setdefault("rag", []).append(message.artifact)
+
+
 # Singleton
 _agent: Optional[PigFarmAgent] = None
 
@@ -209,4 +209,5 @@ Sử dụng khi cần tìm:
 
 Args:
     query: Câu hỏi hoặc từ khóa cần tìm kiếm
+    filename: (Tùy chọn) Tên file PDF khi người dùng muốn câu trả lời từ một tài liệu cụ thể
 """
@@ -1,12 +1,21 @@
 from langchain_core.tools import tool
+from typing import Optional
 
 from app.rag.hybrid_search import get_hybrid_search
+from app.rag.search_options import SearchOptions
 from app.rag.reranker import get_reranker
+from app.rag.rerank_policy import plan_rerank, without_rerank
+from app.rag.retrieval_cache import get_retrieval_cache
+from app.rag.corpus import corpus_version
+from app.rag.deadline import Deadline
 from app.agent.prompts import RAG_TOOL_DESCRIPTION
+from app.config import get_settings
 
+settings = get_settings()
 
-@tool
-async def search_knowledge_base(query: str) -> str:
+
+@tool(response_format="content_and_artifact")
+async def search_knowledge_base(query: str, filename: Optional[str] = None) -> tuple[str, dict]:
     """
     Tìm kiếm thông tin từ tài liệu kiến thức đã upload (PDF).
     
@@ -19,20 +28,40 @@ async def search_knowledge_base(query: str) -> str:
     
     Args:
         query: Câu hỏi hoặc từ khóa cần tìm (tiếng Việt)
+        filename: Tên file PDF để chỉ tìm trong tài liệu đó (tùy chọn)
     
     Returns:
-        str: Thông tin liên quan từ tài liệu
+        str: Thông tin liên quan từ tài liệu (artifact: deadline, các bước bị bỏ qua/thay thế)
     """
+    # Request deadline shared by every stage; degradations are returned as the tool artifact
+    deadline = Deadline(settings.rag_deadline_seconds)
     try:
         hybrid_search = get_hybrid_search()
         reranker = get_reranker()
+        retrieval_cache = get_retrieval_cache()
+        options = SearchOptions(filename=filename) if filename else None
+        
+        print(f"\n[RAG] Searching for: '{query}'" + (f" in '{filename}'" if filename else ""))
+        
+        # Corpus version at retrieval time, for the retrieval and rerank score caches
+        version = await corpus_version()
+        
+        # Same question on the same corpus version: reuse the reranked chunks
+        cache_key = None
+        if settings.retrieval_cache_enabled:
+            cache_key = await retrieval_cache.key(query, options, version)
+            cached_results = retrieval_cache.get(cache_key)
+            if cached_results is not None:
+                print(f"[RAG] Retrieval cache hit: {len(cached_results)} documents.")
+                return _format_results(cached_results), {**deadline.to_dict(), "retrieval_cache": "hit"}
         
         # Step 1: Hybrid search with query transformation
-        print(f"\n[RAG] Searching for: '{query}'")
         search_results = await hybrid_search.search(
             query=query,
             use_query_transformation=True,
-            top_k=20
+            top_k=20,
+            options=options,
+            deadline=deadline
         )
         
         print(f"[RAG] Hybrid Search found {len(search_results)} documents.")
@@ -40,40 +69,68 @@ async def search_knowledge_base(query: str) -> str:
         #     print(f"  - [{i+1}] {doc.get('filename', 'Unknown')} (RRF Score: {doc.get('rrf_score', 0):.4f})")
         
         if not search_results:
-            return "Không tìm thấy tài liệu nào liên quan. Có thể chưa có tài liệu được upload vào hệ thống."
+            return (
+                "Không tìm thấy tài liệu nào liên quan. Có thể chưa có tài liệu được upload vào hệ thống.",
+                deadline.to_dict()
+            )
         
-        # Step 2: Rerank with Cohere cross-encoder
-        print("[RAG] Reranking results with Cohere...")
-        reranked_results = await reranker.rerank_with_threshold(
-            query=query,
-            documents=search_results,
-            threshold=0.3,
-            top_k=5
-        )
+        # Step 2: Rerank with Cohere cross-encoder (budget adapted to fusion confidence)
+        plan = plan_rerank(search_results, top_k=5)
+        rerank_mode = "skipped" if plan.skip else plan.reason
+        if plan.skip:
+            print("[RAG] Top results are unambiguous, skipping rerank.")
+            reranked_results = without_rerank(search_results, 5, hybrid_search.rrf_k)
+        elif not deadline.allows(settings.rag_rerank_min_seconds):
+            # Out of time: answer from the fused order
+            deadline.degrade("rerank", "skipped", f"{deadline.remaining():.2f}s left")
+            rerank_mode = "deadline"
+            reranked_results = without_rerank(search_results, 5, hybrid_search.rrf_k)
+        else:
+            print(f"[RAG] Reranking {plan.candidates}/{len(search_results)} results with Cohere ({plan.reason})...")
+            reranked_results = await reranker.rerank_with_threshold(
+                query=query,
+                documents=search_results[:plan.candidates],
+                threshold=0.3,
+                top_k=5,
+                corpus_version=version,
+                deadline=deadline
+            )
         
         print(f"[RAG] After Reranking (Threshold 0.3): {len(reranked_results)} documents.")
         for i, doc in enumerate(reranked_results):
             print(f"  > [{i+1}] {doc.get('filename', 'Unknown')} | Score: {doc.get('rerank_score', 0):.4f}")
             # print(f"    Preview: {doc.get('content', '')[:100]}...")
         
-        if not reranked_results:
-            return "Không tìm thấy tài liệu đủ liên quan đến câu hỏi của bạn."
+        # Degraded results are not cached: the next request may have the time for the full pipeline
+        if cache_key is not None and not deadline.degradations:
+            retrieval_cache.set(cache_key, reranked_results)
         
-        # Format results for LLM
-        formatted_results = []
-        for i, doc in enumerate(reranked_results, 1):
-            formatted_results.append(
-                f"[Tài liệu {i}] (Nguồn: {doc['filename']}, Độ liên quan: {doc['rerank_score']:.2f})\n"
-                f"{doc['content']}\n"
-            )
-        
-        return "\n---\n".join(formatted_results)
+        return _format_results(reranked_results), {
+            **deadline.to_dict(),
+            "retrieval_cache": "miss" if cache_key is not None else "disabled",
+            "rerank": rerank_mode
+        }
         
     except Exception as e:
         import traceback
         print(f"\n❌ [RAG Tool Error]: {str(e)}")
         print(traceback.format_exc())
-        return f"Lỗi khi tìm kiếm tài liệu: {str(e)}"
+        return f"Lỗi khi tìm kiếm tài liệu: {str(e)}", {**deadline.to_dict(), "error": str(e)}
+
+
+def _format_results(reranked_results: list[dict]) -> str:
+    """Format reranked chunks for the LLM"""
+    if not reranked_results:
+        return "Không tìm thấy tài liệu đủ liên quan đến câu hỏi của bạn."
+    
+    formatted_results = []
+    for i, doc in enumerate(reranked_results, 1):
+        formatted_results.append(
+            f"[Tài liệu {i}] (Nguồn: {doc['filename']}, Độ liên quan: {doc['rerank_score']:.2f})\n"
+            f"{doc['content']}\n"
+        )
+    
+    return "\n---\n".join(formatted_results)
 
 
 # Export the tool
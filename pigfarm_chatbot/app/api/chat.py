@@ -21,6 +21,7 @@ class ChatRequest(BaseModel):
 class ChatResponse(BaseModel):
     response: str
     session_id: str
+    metadata: dict = {}  # "rag": per tool call deadline, elapsed time and degraded stages
 
 
 @router.post("/message", response_model=ChatResponse)
@@ -32,11 +33,13 @@ async def send_message(request: ChatRequest):
     
     try:
         agent = get_agent()
-        response = await agent.chat(request.message, session_id)
+        metadata = {}
+        response = await agent.chat(request.message, session_id, metadata)
         
         return ChatResponse(
             response=response,
-            session_id=session_id
+            session_id=session_id,
+            metadata=metadata
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -52,6 +55,7 @@ async def send_message_stream(request: ChatRequest):
     async def event_generator():
         try:
             agent = get_agent()
+            metadata = {}
             
             # Send session_id first
             yield {
@@ -60,7 +64,7 @@ async def send_message_stream(request: ChatRequest):
             }
             
             # Stream response
-            async for chunk in agent.chat_stream(request.message, session_id):
+            async for chunk in agent.chat_stream(request.message, session_id, metadata):
                 yield {
                     "event": "message",
                     "data": json.dumps({"content": chunk})
@@ -69,7 +73,7 @@ async def send_message_stream(request: ChatRequest):
             # Send done signal
             yield {
                 "event": "done",
-                "data": json.dumps({"status": "complete"})
+                "data": json.dumps({"status": "complete", "metadata": metadata}, ensure_ascii=False)
             }
             
         except Exception as e:
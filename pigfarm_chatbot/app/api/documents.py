@@ -1,157 +1,121 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, Depends
+from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Query
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
 from pydantic import BaseModel
-from typing import Optional, List
-import json
+from typing import Optional, List, Literal
+import uuid
 
 from app.db.database import get_db, async_session_maker
-from app.documents.pdf_parser import PDFParser
-from app.documents.chunker import SemanticChunker
 from app.documents.embedder import get_embedder
+from app.documents.jobs import get_job_manager
+from app.rag.corpus import notify_document_deleted, bump_corpus_version
 from app.config import get_settings
 
 settings = get_settings()
 router = APIRouter()
 
 
-class BatchUploadResponse(BaseModel):
+class UploadJobFile(BaseModel):
+    filename: str
+    mode: str = "create"
+    status: str
+    stage: Optional[str] = None
+    total_chunks: Optional[int] = None
+    processed_chunks: int = 0
+    reason: Optional[str] = None
+    updated_at: str
+
+
+class UploadJobResponse(BaseModel):
+    job_id: str
+    status: str
     total_files: int
     processed_files: int
     skipped_files: int
-    details: List[dict]
+    created_at: str
+    updated_at: str
+    files: List[UploadJobFile]
 
 
 class DocumentListItem(BaseModel):
     id: int
+    document_id: int
     filename: str
     chunk_index: int
     created_at: str
 
 
-@router.post("/upload", response_model=BatchUploadResponse)
-async def upload_documents(files: List[UploadFile] = File(...)):
-    print(f"📥 API Batch Upload: Nhận {len(files)} files")
-    
-    results = []
-    processed_count = 0
-    skipped_count = 0
-    
-    embedder = get_embedder()
-    chunker = SemanticChunker(
-        chunk_size=settings.chunk_size,
-        chunk_overlap=settings.chunk_overlap
-    )
-    
-    for file in files:
-        try:
-            print(f"--- Đang xử lý file: {file.filename} ---")
-            
-            # Validate file type
-            if not file.filename.lower().endswith('.pdf'):
-                results.append({
-                    "filename": file.filename,
-                    "status": "skipped",
-                    "reason": "Chỉ hỗ trợ file PDF"
-                })
-                skipped_count += 1
-                continue
-            
-            # Read and Parse
-            content = await file.read()
-            pdf_text = PDFParser.extract_text(content)
-            metadata = PDFParser.get_metadata(content)
-            
-            if not pdf_text.strip():
-                results.append({
-                    "filename": file.filename,
-                    "status": "skipped",
-                    "reason": "Không thể trích xuất văn bản (File rỗng hoặc ảnh scan)"
-                })
-                skipped_count += 1
-                continue
-            
-            # Chunking
-            chunks = chunker.chunk_text(pdf_text, metadata)
-            
-            # Check chunk limit (Max 100 chunks per file)
-            if len(chunks) > 100:
-                print(f"⚠️ Bỏ qua file {file.filename}: {len(chunks)} chunks (> 100)")
-                results.append({
-                    "filename": file.filename,
-                    "status": "skipped",
-                    "reason": f"File quá lớn ({len(chunks)} chunks > 100). Vui lòng chia nhỏ file."
-                })
-                skipped_count += 1
-                continue
-            
-            # Embedding (Sequential & Safe)
-            chunks_with_embeddings = await embedder.embed_chunks(chunks)
-            
-            # Store in DB
-            async with async_session_maker() as session:
-                for chunk in chunks_with_embeddings:
-                    embedding_str = "[" + ",".join(map(str, chunk["embedding"])) + "]"
-                    
-                    await session.execute(
-                        text("""
-                            INSERT INTO chat_documents 
-                            (filename, content, chunk_index, embedding, metadata)
-                            VALUES (:filename, :content, :chunk_index, :embedding, :metadata)
-                        """),
-                        {
-                            "filename": file.filename,
-                            "content": chunk["content"],
-                            "chunk_index": chunk["chunk_index"],
-                            "embedding": embedding_str,
-                            "metadata": json.dumps(chunk["metadata"])
-                        }
-                    )
-                await session.commit()
-            
-            print(f"✅ Đã xử lý xong: {file.filename} ({len(chunks)} chunks)")
-            results.append({
-                "filename": file.filename,
-                "status": "success",
-                "chunks": len(chunks)
-            })
-            processed_count += 1
-            
-        except Exception as e:
-            print(f"❌ Lỗi xử lý file {file.filename}: {str(e)}")
-            results.append({
-                "filename": file.filename,
-                "status": "error",
-                "reason": str(e)
-            })
-            skipped_count += 1
+@router.post("/upload", response_model=UploadJobResponse, status_code=202)
+async def upload_documents(
+    files: List[UploadFile] = File(...),
+    mode: Literal["create", "update"] = "create"
+):
+    """
+    Queue PDF files for background ingestion and return the job right away.
+    Poll GET /documents/jobs/{job_id} for progress.
     
-    return BatchUploadResponse(
-        total_files=len(files),
-        processed_files=processed_count,
-        skipped_files=skipped_count,
-        details=results
-    )
+    mode=update replaces the stored document with the same filename: only new or
+    changed chunks are embedded, and the swap is atomic for readers.
+    """
+    print(f"📥 API Batch Upload: Nhận {len(files)} files (mode={mode})")
+    return await get_job_manager().create_job(files, mode)
+
+
+@router.get("/jobs/{job_id}", response_model=UploadJobResponse)
+async def get_upload_job(job_id: uuid.UUID):
+    """
+    Get ingestion progress of an upload job (per file and per chunk).
+    """
+    job = await get_job_manager().get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found")
+    return job
+
+
+@router.post("/jobs/{job_id}/cancel", response_model=UploadJobResponse)
+async def cancel_upload_job(job_id: uuid.UUID):
+    """
+    Cancel the queued and running files of an upload job.
+    Files that already finished stay in the knowledge base.
+    """
+    job = await get_job_manager().cancel_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found")
+    return job
 
 
 @router.get("/", response_model=list[DocumentListItem])
-async def list_documents():
+async def list_documents(
+    after_document_id: int = 0,
+    after_chunk_index: int = -1,
+    limit: int = Query(100, ge=1, le=1000)
+):
     """
-    List all uploaded documents.
+    List uploaded chunks, ordered by (document_id, chunk_index).
+    Keyset pagination: pass the document_id / chunk_index of the last item
+    to get the next page.
     """
     async with async_session_maker() as session:
         result = await session.execute(
             text("""
-                SELECT id, filename, chunk_index, created_at
+                SELECT id, document_id, filename, chunk_index, created_at
                 FROM chat_documents
-                ORDER BY filename, chunk_index
-            """)
+                WHERE (document_id, chunk_index) > (:after_document_id, :after_chunk_index)
+                ORDER BY document_id, chunk_index
+                LIMIT :limit
+            """),
+            {
+                "after_document_id": after_document_id,
+                "after_chunk_index": after_chunk_index,
+                "limit": limit
+            }
         )
         rows = result.fetchall()
         
         return [
             DocumentListItem(
                 id=row.id,
+                document_id=row.document_id,
                 filename=row.filename,
                 chunk_index=row.chunk_index,
                 created_at=str(row.created_at)
@@ -161,55 +125,85 @@ async def list_documents():
 
 
 @router.get("/summary")
-async def get_documents_summary():
+async def get_documents_summary(
+    before_document_id: Optional[int] = None,
+    limit: int = Query(100, ge=1, le=1000)
+):
     """
-    Get summary of all documents (grouped by filename).
+    Get summary of all documents from the document catalog, newest first.
+    Keyset pagination: pass the document_id of the last item to get the next page.
     """
     async with async_session_maker() as session:
+        total = await session.execute(text("SELECT COUNT(*) FROM chat_document_catalog"))
+        keyset = ""
+        params = {"limit": limit}
+        if before_document_id is not None:
+            keyset = "WHERE id < :before_document_id"
+            params["before_document_id"] = before_document_id
         result = await session.execute(
-            text("""
-                SELECT 
-                    filename,
-                    COUNT(*) as chunk_count,
-                    MIN(created_at) as uploaded_at
-                FROM chat_documents
-                GROUP BY filename
-                ORDER BY uploaded_at DESC
-            """)
+            text(f"""
+                SELECT id, filename, chunk_count, content_bytes, file_size, uploaded_at, updated_at
+                FROM chat_document_catalog
+                {keyset}
+                ORDER BY id DESC
+                LIMIT :limit
+            """),
+            params
         )
         rows = result.fetchall()
         
         return {
-            "total_documents": len(rows),
+            "total_documents": total.scalar(),
             "documents": [
                 {
+                    "document_id": row.id,
                     "filename": row.filename,
                     "chunk_count": row.chunk_count,
-                    "uploaded_at": str(row.uploaded_at)
+                    "content_bytes": row.content_bytes,
+                    "file_size": row.file_size,
+                    "uploaded_at": str(row.uploaded_at),
+                    "updated_at": str(row.updated_at)
                 }
                 for row in rows
             ]
         }
 
 
+@router.get("/embedding-cache")
+async def get_embedding_cache_stats():
+    """
+    Get embedding cache size and hit/miss counts (since process start).
+    """
+    return await get_embedder().cache.stats()
+
+
 @router.delete("/{filename}")
 async def delete_document(filename: str):
     """
-    Delete a document and all its chunks.
+    Delete a document and all its chunks (cascades from the catalog row).
     """
     async with async_session_maker() as session:
         result = await session.execute(
-            text("DELETE FROM chat_documents WHERE filename = :filename"),
+            text("""
+                DELETE FROM chat_document_catalog
+                WHERE filename = :filename
+                RETURNING id, chunk_count
+            """),
             {"filename": filename}
         )
+        deleted = result.fetchone()
+        if deleted is not None:
+            await bump_corpus_version(session)
         await session.commit()
         
-        if result.rowcount == 0:
+        if deleted is None:
             raise HTTPException(
                 status_code=404,
                 detail=f"Document '{filename}' not found"
             )
+        chunk_count = deleted.chunk_count
+        await notify_document_deleted(deleted.id)
         
         return {
-            "message": f"Deleted document '{filename}' ({result.rowcount} chunks removed)"
+            "message": f"Deleted document '{filename}' ({chunk_count} chunks removed)"
         }
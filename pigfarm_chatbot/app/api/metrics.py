@@ -0,0 +1,25 @@
+from fastapi import APIRouter
+
+from app.rag.retrieval_cache import get_retrieval_cache
+from app.rag.query_transformer import get_query_transformer
+from app.rag.hybrid_search import get_hybrid_search
+from app.rag.reranker import get_reranker
+
+router = APIRouter()
+
+
+@router.get("/")
+async def get_metrics():
+    """
+    In-process metrics of this worker (since process start): retrieval cache
+    size, hit ratio and approximate memory use; query rewrite outcomes
+    (LLM / cached / skipped) with their latency; speculative retrieval outcomes
+    (rewrite merged / deadline missed) with end-to-end search latency; rerank
+    outcomes (cached / Cohere / local fallback) and the rerank score cache.
+    """
+    return {
+        "retrieval_cache": get_retrieval_cache().stats(),
+        "query_rewrite": get_query_transformer().stats(),
+        "speculative_retrieval": get_hybrid_search().speculative_metrics.stats(),
+        "rerank": get_reranker().stats()
+    }
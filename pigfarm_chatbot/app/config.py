@@ -10,6 +10,8 @@ ENV_PATH = PROJECT_ROOT / ".env"
 class Settings(BaseSettings):
     # Database
     database_url: str
+    db_pool_size: int = 5  # Connections per process, shared by all requests
+    db_max_overflow: int = 10
     
     # API Keys
     google_api_key: str
@@ -30,9 +32,94 @@ class Settings(BaseSettings):
     # RAG Settings
     chunk_size: int = 500
     chunk_overlap: int = 50
+    chunker_mode: str = "offsets"  # "legacy" | "offsets" (encode once, same chunks)
+    chunker_threads: int = 4  # tiktoken batch encoding threads
     vector_search_k: int = 10
     bm25_search_k: int = 10
     rerank_top_k: int = 5
+    rerank_timeout_seconds: float = 3.0  # Cohere latency budget before the local fallback ranker takes over
+    rerank_fallback: str = "lexical"  # Local fallback ranker: "lexical" | "none" (raise on Cohere errors)
+    rerank_fallback_threshold: float = 0.3  # Min fallback score (weighted share of query terms in the chunk)
+    rerank_cache_size: int = 20000  # (normalized query, chunk id, corpus version) -> relevance score
+    rerank_cache_ttl_seconds: int = 86400
+    rerank_policy: str = "adaptive"  # "adaptive" (budget from fusion confidence) | "all" (rerank every candidate)
+    rerank_budget_ratio: float = 0.8  # Candidates with RRF >= ratio x the top-k boundary score are reranked
+    rerank_skip_enabled: bool = True
+    rerank_skip_margin: float = 0.6  # Skip if the top k agree and the next RRF score < margin x boundary
+    retrieval_concurrency: int = 6  # Concurrent retrieval queries within one search (the DB pool bounds all searches)
+    vector_search_timeout_seconds: float = 5.0
+    bm25_search_timeout_seconds: float = 3.0
+    lexical_similarity_threshold: float = 0.1  # pg_trgm.similarity_threshold (% operator)
+    lexical_word_similarity_threshold: float = 0.6  # pg_trgm.word_similarity_threshold (<% operator)
+    lexical_search_backend: str = "sql"  # "sql" (Postgres trigram/FTS) | "memory" (in-process BM25)
+    bm25_k1: float = 1.2
+    bm25_b: float = 0.75
+    corpus_reconcile_interval_seconds: int = 300  # In-process indexes re-check the corpus this often
+    hybrid_search_mode: str = "sql"  # "sql" (search + RRF in one statement) | "python" (fusion in Python)
+    
+    # Vector search backend: "pgvector" (HNSW in Postgres) or "memory" (exact search over a
+    # memory-mapped snapshot shared by all workers; for corpora up to ~100k chunks)
+    vector_search_backend: str = "pgvector"
+    vector_snapshot_dir: str = "/tmp/pigfarm_vectors"
+    vector_snapshot_dtype: str = "float32"  # "float32" | "float16" (half the memory, slower scoring)
+    
+    # Vector storage: "full" (vector HNSW), "halfvec" or "binary" (compact HNSW + exact re-scoring)
+    vector_storage_mode: str = "full"
+    vector_rescore_oversample: int = 4
+    # Filtered vector searches: HNSW returns at most ef_search rows before the filter runs
+    filtered_iterative_scan: str = "relaxed_order"  # "relaxed_order" | "strict_order" | "off" (pgvector >= 0.8)
+    filtered_ef_search: int = 200  # ef_search floor for filtered searches without an iterative scan
+    
+    # Embedding quota (Gemini embedding API)
+    embedding_rpm: int = 100
+    embedding_tpm: int = 30000
+    embedding_batch_size: int = 100  # Max texts per batch request (API limit)
+    embedding_batch_max_tokens: int = 8000
+    embedding_concurrency: int = 4
+    embedding_max_retries: int = 5
+    
+    # Persistent embedding cache (chat_embedding_cache)
+    embedding_cache_enabled: bool = True
+    embedding_cache_max_age_days: int = 90
+    embedding_cache_max_entries: int = 100000
+    embedding_cache_evict_interval_seconds: int = 3600  # Periodic eviction (never on the upload path)
+    embedding_cache_touch_interval_hours: int = 24  # last_used_at is refreshed at most this often
+    
+    # In-memory query embedding cache (normalized query -> vector)
+    query_embedding_cache_size: int = 1024
+    query_embedding_cache_ttl_seconds: int = 3600
+    
+    # Query rewrite: in-memory cache (normalized query -> rewrite) and skip heuristic
+    rewrite_cache_size: int = 2048
+    rewrite_cache_ttl_seconds: int = 86400
+    query_variations: int = 3  # Extra variations generated with the rewrite in one call (0: rewrite only)
+    rewrite_skip_enabled: bool = True
+    rewrite_skip_max_keyword_words: int = 4  # Keyword queries up to this long are searched as-is
+    rewrite_skip_min_long_words: int = 25  # Queries longer than this are already specific
+    # Speculative retrieval: search the original query while the rewrite runs
+    speculative_retrieval_enabled: bool = True
+    rewrite_deadline_seconds: float = 2.0  # Answer from the original query if the rewrite takes longer
+    
+    # Request deadline of one RAG tool call; stage timeouts above are capped by the time left
+    rag_deadline_seconds: float = 10.0
+    rag_retrieval_reserve_seconds: float = 3.0  # Kept for retrieval + fusion when budgeting the rewrite
+    rag_min_stage_seconds: float = 0.3  # Optional stages (rewrite) are skipped with less budget than this
+    rag_rerank_min_seconds: float = 0.5  # Rerank is skipped (fused order kept) with less time left
+    
+    # In-memory retrieval cache (normalized query, options, corpus version -> reranked chunks)
+    retrieval_cache_enabled: bool = True
+    retrieval_cache_size: int = 512
+    retrieval_cache_ttl_seconds: int = 1800
+    
+    # Background ingestion jobs
+    ingest_workers: int = 2
+    pdf_parse_workers: int = 2  # Processes in the PDF parsing pool
+    ingest_spool_dir: str = "/tmp/pigfarm_ingest"
+    ingest_poll_interval_seconds: int = 5
+    ingest_lease_seconds: int = 60
+    ingest_max_attempts: int = 3
+    ingest_batch_chunks: int = 64  # Chunks embedded and stored per streaming batch
+    pdf_page_window: int = 20  # Pages parsed per process-pool task
     
     # Session
     session_timeout_minutes: int = 30
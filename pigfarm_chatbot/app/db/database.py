@@ -1,6 +1,7 @@
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import declarative_base
-from sqlalchemy import text
+from sqlalchemy import text, event
+from pgvector.asyncpg import register_vector
 from typing import AsyncGenerator
 
 from app.config import get_settings
@@ -11,10 +12,38 @@ settings = get_settings()
 engine = create_async_engine(
     settings.database_url,
     echo=False,
-    pool_size=5,
-    max_overflow=10
+    pool_size=settings.db_pool_size,
+    max_overflow=settings.db_max_overflow
 )
 
+
+
+async def _register_vector_codec(conn):
+    """Register pgvector's binary codecs in whatever schema the extension lives in"""
+    schema = await conn.fetchval(
+        "SELECT n.nspname FROM pg_type t JOIN pg_namespace n ON n.oid = t.typnamespace "
+        "WHERE t.typname = 'vector'"
+    )
+    if schema is not None:
+        await register_vector(conn, schema=schema)
+
+
+async def _set_trigram_thresholds(conn):
+    """Thresholds of the index-backed trigram operators (% and <%) used by lexical search"""
+    await conn.execute(
+        f"SET pg_trgm.similarity_threshold = {float(settings.lexical_similarity_threshold)}; "
+        f"SET pg_trgm.word_similarity_threshold = {float(settings.lexical_word_similarity_threshold)}"
+    )
+
+
+@event.listens_for(engine.sync_engine, "connect")
+def _on_connect(dbapi_connection, connection_record):
+    # Embeddings travel as binary float arrays (lists / numpy arrays), never as "[...]" strings.
+    # Before the extension exists (first start) no codec is registered; init_db resets the pool.
+    dbapi_connection.run_async(_register_vector_codec)
+    dbapi_connection.run_async(_set_trigram_thresholds)
+
+
 # Session factory
 async_session_maker = async_sessionmaker(
     engine,
@@ -24,6 +53,22 @@ async_session_maker = async_sessionmaker(
 
 Base = declarative_base()
 
+# HNSW index per vector storage mode: (index name, access method + expression)
+VECTOR_INDEXES = {
+    "full": (
+        "idx_chat_documents_embedding",
+        "USING hnsw (embedding vector_cosine_ops)"
+    ),
+    "halfvec": (
+        "idx_chat_documents_embedding_halfvec",
+        "USING hnsw ((embedding::halfvec(1536)) halfvec_cosine_ops)"
+    ),
+    "binary": (
+        "idx_chat_documents_embedding_binary",
+        "USING hnsw ((binary_quantize(embedding)::bit(1536)) bit_hamming_ops)"
+    ),
+}
+
 
 async def init_db():
     """Initialize database extensions and tables for chatbot"""
@@ -32,6 +77,20 @@ async def init_db():
         await conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
         # Enable pg_trgm for BM25/trigram search
         await conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        # Enable unaccent for accent-insensitive Vietnamese lexical search
+        await conn.execute(text("CREATE EXTENSION IF NOT EXISTS unaccent"))
+        
+        # unaccent() is only STABLE (it depends on search_path), so generated columns and
+        # indexes go through an IMMUTABLE wrapper that names the dictionary's schema explicitly
+        unaccent_schema = (await conn.execute(text("""
+            SELECT n.nspname FROM pg_extension e JOIN pg_namespace n ON n.oid = e.extnamespace
+            WHERE e.extname = 'unaccent'
+        """))).scalar_one()
+        await conn.execute(text(f"""
+            CREATE OR REPLACE FUNCTION chat_normalize(input TEXT) RETURNS TEXT
+            LANGUAGE sql IMMUTABLE STRICT PARALLEL SAFE
+            AS $$ SELECT lower({unaccent_schema}.unaccent('{unaccent_schema}.unaccent'::regdictionary, input)) $$
+        """))
         
         # Create chat_documents table if not exists
         await conn.execute(text("""
@@ -46,30 +105,182 @@ async def init_db():
             )
         """))
         
+        # Chunk content hash (sha256 hex), used to diff re-ingested versions of a file
+        await conn.execute(text("""
+            ALTER TABLE chat_documents ADD COLUMN IF NOT EXISTS content_hash CHAR(64)
+        """))
+        await conn.execute(text("""
+            UPDATE chat_documents
+            SET content_hash = encode(sha256(convert_to(content, 'UTF8')), 'hex')
+            WHERE content_hash IS NULL
+        """))
+        
+        # Normalized (lowercase, unaccented) content for lexical search: trigram matching on
+        # content_norm and word matching on content_tsv ('simple' config, no Vietnamese stemmer)
+        await conn.execute(text("""
+            ALTER TABLE chat_documents ADD COLUMN IF NOT EXISTS content_norm TEXT
+            GENERATED ALWAYS AS (chat_normalize(content)) STORED
+        """))
+        await conn.execute(text("""
+            ALTER TABLE chat_documents ADD COLUMN IF NOT EXISTS content_tsv tsvector
+            GENERATED ALWAYS AS (to_tsvector('simple', chat_normalize(content))) STORED
+        """))
+        
+        # Document catalog: one row per file, chunks reference it (deleting a file cascades)
+        await conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS chat_document_catalog (
+                id SERIAL PRIMARY KEY,
+                filename VARCHAR(255) NOT NULL UNIQUE,
+                chunk_count INTEGER NOT NULL DEFAULT 0,
+                content_bytes BIGINT NOT NULL DEFAULT 0,
+                file_size BIGINT,
+                uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """))
+        await conn.execute(text("""
+            ALTER TABLE chat_documents ADD COLUMN IF NOT EXISTS document_id INTEGER
+            REFERENCES chat_document_catalog(id) ON DELETE CASCADE
+        """))
+        # Catalog files stored before the catalog existed (ids in upload order)
+        await conn.execute(text("""
+            INSERT INTO chat_document_catalog (filename, chunk_count, content_bytes, uploaded_at)
+            SELECT filename, COUNT(*), SUM(octet_length(content)), MIN(created_at)
+            FROM chat_documents
+            WHERE document_id IS NULL
+            GROUP BY filename
+            ORDER BY MIN(created_at)
+            ON CONFLICT (filename) DO NOTHING
+        """))
+        await conn.execute(text("""
+            UPDATE chat_documents d
+            SET document_id = c.id
+            FROM chat_document_catalog c
+            WHERE d.document_id IS NULL AND d.filename = c.filename
+        """))
+        await conn.execute(text("""
+            CREATE INDEX IF NOT EXISTS idx_chat_documents_document
+            ON chat_documents (document_id, chunk_index)
+        """))
+        await conn.execute(text("DROP INDEX IF EXISTS idx_chat_documents_filename"))
+        
+        # Corpus version: bumped in every transaction that changes chat_documents
+        await conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS chat_corpus_version (
+                id INTEGER PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+                version BIGINT NOT NULL DEFAULT 0
+            )
+        """))
+        await conn.execute(text("""
+            INSERT INTO chat_corpus_version (id, version) VALUES (1, 0)
+            ON CONFLICT (id) DO NOTHING
+        """))
+        
+        # Content-addressed embedding cache (key = sha256(model, output_dim, chunk text))
+        await conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS chat_embedding_cache (
+                content_hash CHAR(64) PRIMARY KEY,
+                model VARCHAR(255) NOT NULL,
+                output_dim INTEGER NOT NULL,
+                embedding vector(1536) NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                last_used_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """))
+        await conn.execute(text("""
+            CREATE INDEX IF NOT EXISTS idx_chat_embedding_cache_last_used
+            ON chat_embedding_cache (last_used_at)
+        """))
+        
+        # Background ingestion jobs (one row per upload request, one per file)
+        await conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS chat_ingest_jobs (
+                id UUID PRIMARY KEY,
+                status VARCHAR(20) NOT NULL DEFAULT 'queued',
+                total_files INTEGER NOT NULL DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """))
+        await conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS chat_ingest_job_files (
+                id SERIAL PRIMARY KEY,
+                job_id UUID NOT NULL REFERENCES chat_ingest_jobs(id) ON DELETE CASCADE,
+                filename VARCHAR(255) NOT NULL,
+                spool_path TEXT,
+                status VARCHAR(20) NOT NULL DEFAULT 'queued',
+                stage VARCHAR(20),
+                total_chunks INTEGER,
+                processed_chunks INTEGER NOT NULL DEFAULT 0,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                reason TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """))
+        # 'create' appends the file's chunks, 'update' diffs them against the stored version
+        await conn.execute(text("""
+            ALTER TABLE chat_ingest_job_files
+            ADD COLUMN IF NOT EXISTS mode VARCHAR(10) NOT NULL DEFAULT 'create'
+        """))
+        await conn.execute(text("""
+            CREATE INDEX IF NOT EXISTS idx_chat_ingest_job_files_job
+            ON chat_ingest_job_files (job_id)
+        """))
+        await conn.execute(text("""
+            CREATE INDEX IF NOT EXISTS idx_chat_ingest_job_files_pending
+            ON chat_ingest_job_files (id)
+            WHERE status IN ('queued', 'running')
+        """))
+        
         # Create HNSW index for vector similarity search
         # 1536 dims is compatible with standard pgvector HNSW limits (<2000)
         # Tuned with m=32, ef_construction=128 for better recall (accuracy)
+        # Only the index of the configured storage mode is kept. Compact modes index a
+        # halfvec / binary-quantized expression of the same column, so existing rows are
+        # migrated simply by building the new index; full vectors stay for re-scoring.
+        storage_mode = settings.vector_storage_mode
+        if storage_mode not in VECTOR_INDEXES:
+            raise ValueError(f"Unknown vector_storage_mode: {storage_mode}")
+        
+        for mode, (index_name, index_def) in VECTOR_INDEXES.items():
+            if mode == storage_mode:
+                await conn.execute(text(f"""
+                    CREATE INDEX IF NOT EXISTS {index_name}
+                    ON chat_documents
+                    {index_def}
+                    WITH (m = 32, ef_construction = 128)
+                """))
+            else:
+                await conn.execute(text(f"DROP INDEX IF EXISTS {index_name}"))
+        
+        # Create GIN index for full-text search (normalized words)
         await conn.execute(text("""
-            CREATE INDEX IF NOT EXISTS idx_chat_documents_embedding 
-            ON chat_documents 
-            USING hnsw (embedding vector_cosine_ops)
-            WITH (m = 32, ef_construction = 128)
+            CREATE INDEX IF NOT EXISTS idx_chat_documents_content_tsv
+            ON chat_documents
+            USING gin(content_tsv)
         """))
         
-        # Create GIN index for full-text search
+        # Create trigram index for fuzzy matching (backs the % and <% operators)
         await conn.execute(text("""
-            CREATE INDEX IF NOT EXISTS idx_chat_documents_content_fts 
-            ON chat_documents 
-            USING gin(to_tsvector('english', content))
+            CREATE INDEX IF NOT EXISTS idx_chat_documents_content_norm_trgm
+            ON chat_documents
+            USING gin(content_norm gin_trgm_ops)
         """))
         
-        # Create trigram index for fuzzy matching
+        # JSONB containment filters (metadata @> ...) on searches
         await conn.execute(text("""
-            CREATE INDEX IF NOT EXISTS idx_chat_documents_content_trgm 
-            ON chat_documents 
-            USING gin(content gin_trgm_ops)
+            CREATE INDEX IF NOT EXISTS idx_chat_documents_metadata
+            ON chat_documents
+            USING gin(metadata jsonb_path_ops)
         """))
         
+        # Superseded by the normalized indexes above (the English FTS index served no query path)
+        await conn.execute(text("DROP INDEX IF EXISTS idx_chat_documents_content_fts"))
+        await conn.execute(text("DROP INDEX IF EXISTS idx_chat_documents_content_trgm"))
+        
+    # Reconnect so every pooled connection has the vector codec registered
+    await engine.dispose()
     print("✅ Database initialized with pgvector and FTS extensions")
 
 
@@ -1,23 +1,43 @@
 import re
-from typing import Optional
+from bisect import bisect_left
+from typing import Optional, Union
+import numpy as np
 import tiktoken
 
+PARAGRAPH_SEPARATOR = re.compile(r'\n\s*\n')
+SENTENCE_SEPARATOR = re.compile(r'(?<=[.!?])\s+')
+# Newline followed by a non-space character: no tiktoken pre-token crosses it
+HARD_BOUNDARY = re.compile(r'\n(?=\S)')
+
+CHUNKER_MODES = ("legacy", "offsets")
+
 
 class SemanticChunker:
     """
     Semantic text chunker that splits by paragraphs and sentences
-    while respecting token limits
+    while respecting token limits.
+    
+    Both modes give identical chunks:
+    - "legacy": every paragraph, sentence and chunk is encoded on its own
+    - "offsets": each fed text is encoded once and counts are read from
+      token offsets (see EncodedText)
     """
     
     def __init__(
         self,
         chunk_size: int = 500,
         chunk_overlap: int = 50,
-        encoding_name: str = "cl100k_base"
+        encoding_name: str = "cl100k_base",
+        mode: str = "offsets",
+        num_threads: int = 4
     ):
+        if mode not in CHUNKER_MODES:
+            raise ValueError(f"Unknown chunker mode: {mode}")
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
         self.tokenizer = tiktoken.get_encoding(encoding_name)
+        self.mode = mode
+        self.num_threads = num_threads
     
     def count_tokens(self, text: str) -> int:
         """Count tokens in text"""
@@ -26,96 +46,171 @@ class SemanticChunker:
     def split_into_paragraphs(self, text: str) -> list[str]:
         """Split text into paragraphs"""
         # Split by double newlines or multiple newlines
-        paragraphs = re.split(r'\n\s*\n', text)
+        paragraphs = PARAGRAPH_SEPARATOR.split(text)
         # Clean up and filter empty paragraphs
         return [p.strip() for p in paragraphs if p.strip()]
     
     def split_into_sentences(self, text: str) -> list[str]:
         """Split text into sentences"""
         # Vietnamese and English sentence splitting
-        sentences = re.split(r'(?<=[.!?])\s+', text)
+        sentences = SENTENCE_SEPARATOR.split(text)
         return [s.strip() for s in sentences if s.strip()]
     
+    def encode_batch(self, texts: list[str]) -> list[list[int]]:
+        """Encode several texts in parallel (tiktoken releases the GIL while encoding)"""
+        return self.tokenizer.encode_batch(texts, num_threads=self.num_threads)
+    
     def chunk_text(self, text: str, metadata: Optional[dict] = None) -> list[dict]:
         """
         Split text into semantic chunks with overlap.
         Returns list of chunks with metadata.
         """
-        paragraphs = self.split_into_paragraphs(text)
+        stream = self.start_stream(metadata)
+        return stream.feed(text) + stream.close()
+    
+    def chunk_texts(
+        self,
+        texts: list[str],
+        metadatas: Optional[list[Optional[dict]]] = None
+    ) -> list[list[dict]]:
+        """Chunk several documents at once; in offsets mode they are encoded as one threaded batch"""
+        metadatas = metadatas or [None] * len(texts)
+        token_lists = self.encode_batch(texts) if self.mode == "offsets" else [None] * len(texts)
+        
+        results = []
+        for text, tokens, metadata in zip(texts, token_lists, metadatas):
+            stream = self.start_stream(metadata)
+            results.append(stream.feed(text, tokens) + stream.close())
+        return results
+    
+    def start_stream(self, metadata: Optional[dict] = None) -> "ChunkStream":
+        """Incremental chunking: feed text piece by piece (e.g. page by page)"""
+        if self.mode == "offsets":
+            return OffsetChunkStream(self, metadata)
+        return ChunkStream(self, metadata)
+    
+    def _create_chunk(
+        self,
+        content: str,
+        index: int,
+        metadata: Optional[dict],
+        token_count: Optional[int] = None
+    ) -> dict:
+        """Create a chunk dictionary with metadata"""
+        return {
+            "content": content,
+            "chunk_index": index,
+            "token_count": self.count_tokens(content) if token_count is None else token_count,
+            "metadata": metadata or {}
+        }
+
+
+class ChunkStream:
+    """
+    Incremental form of SemanticChunker.chunk_text.
+    
+    Text is fed in pieces that end on paragraph boundaries (e.g. PDF pages);
+    each feed returns the chunks completed so far and close() flushes the rest.
+    Feeding the pieces of a text gives the same chunks as chunking the pieces
+    joined with blank lines in one call.
+    
+    Paragraphs, sentences and their joins go through the _paragraphs /
+    _sentences / _join / _count / _text hooks; here they are plain strings.
+    """
+    
+    def __init__(self, chunker: SemanticChunker, metadata: Optional[dict] = None):
+        self.chunker = chunker
+        self.metadata = metadata
+        self.chunk_count = 0
+        self.current_chunk: list = []
+        self.current_tokens = 0
+    
+    def feed(self, text: str, tokens: Optional[list[int]] = None) -> list[dict]:
+        """Feed one piece; `tokens` is its encoding if already known (offsets mode)"""
         chunks = []
-        current_chunk = []
-        current_tokens = 0
+        for para in self._paragraphs(text, tokens):
+            chunks.extend(self._add_paragraph(para))
+        return chunks
+    
+    def feed_many(self, texts: list[str]) -> list[dict]:
+        """Feed several pieces (e.g. a window of pages) in order"""
+        chunks = []
+        for text in texts:
+            chunks.extend(self.feed(text))
+        return chunks
+    
+    def close(self) -> list[dict]:
+        # Don't forget the last chunk
+        chunks = []
+        if self.current_chunk:
+            chunks.append(self._emit(self._join("\n\n", self.current_chunk)))
+            self.current_chunk = []
+            self.current_tokens = 0
+        return chunks
+    
+    # Text hooks
+    
+    def _paragraphs(self, text: str, tokens: Optional[list[int]] = None) -> list:
+        return self.chunker.split_into_paragraphs(text)
+    
+    def _sentences(self, para) -> list:
+        return self.chunker.split_into_sentences(para)
+    
+    def _join(self, separator: str, parts: list):
+        return separator.join(parts)
+    
+    def _count(self, part) -> int:
+        return self.chunker.count_tokens(part)
+    
+    def _text(self, part) -> str:
+        return part
+    
+    # Chunking
+    
+    def _add_paragraph(self, para) -> list[dict]:
+        chunk_size = self.chunker.chunk_size
+        chunks = []
+        para_tokens = self._count(para)
         
-        for para in paragraphs:
-            para_tokens = self.count_tokens(para)
-            
-            # If single paragraph exceeds chunk size, split by sentences
-            if para_tokens > self.chunk_size:
-                # Save current chunk if exists
-                if current_chunk:
-                    chunks.append(self._create_chunk(
-                        "\n\n".join(current_chunk),
-                        len(chunks),
-                        metadata
-                    ))
-                    current_chunk = []
-                    current_tokens = 0
-                
-                # Split large paragraph by sentences
-                sentence_chunks = self._chunk_by_sentences(para, metadata, len(chunks))
-                chunks.extend(sentence_chunks)
-                continue
-            
-            # Check if adding paragraph exceeds limit
-            if current_tokens + para_tokens > self.chunk_size:
-                # Save current chunk
-                if current_chunk:
-                    chunks.append(self._create_chunk(
-                        "\n\n".join(current_chunk),
-                        len(chunks),
-                        metadata
-                    ))
-                
-                # Start new chunk with overlap from previous
-                overlap_text = self._get_overlap_text(current_chunk)
-                current_chunk = [overlap_text] if overlap_text else []
-                current_tokens = self.count_tokens(overlap_text) if overlap_text else 0
+        # If single paragraph exceeds chunk size, split by sentences
+        if para_tokens > chunk_size:
+            # Save current chunk if exists
+            if self.current_chunk:
+                chunks.append(self._emit(self._join("\n\n", self.current_chunk)))
+                self.current_chunk = []
+                self.current_tokens = 0
             
-            current_chunk.append(para)
-            current_tokens += para_tokens
+            # Split large paragraph by sentences
+            chunks.extend(self._chunk_by_sentences(para))
+            return chunks
         
-        # Don't forget the last chunk
-        if current_chunk:
-            chunks.append(self._create_chunk(
-                "\n\n".join(current_chunk),
-                len(chunks),
-                metadata
-            ))
+        # Check if adding paragraph exceeds limit
+        if self.current_tokens + para_tokens > chunk_size:
+            # Save current chunk
+            if self.current_chunk:
+                chunks.append(self._emit(self._join("\n\n", self.current_chunk)))
+            
+            # Start new chunk with overlap from previous
+            overlap = self._get_overlap(self.current_chunk)
+            self.current_chunk = [overlap] if overlap is not None else []
+            self.current_tokens = self._count(overlap) if overlap is not None else 0
         
+        self.current_chunk.append(para)
+        self.current_tokens += para_tokens
         return chunks
     
-    def _chunk_by_sentences(
-        self, 
-        text: str, 
-        metadata: Optional[dict],
-        start_index: int
-    ) -> list[dict]:
+    def _chunk_by_sentences(self, para) -> list[dict]:
         """Split a large paragraph into sentence-based chunks"""
-        sentences = self.split_into_sentences(text)
         chunks = []
         current_chunk = []
         current_tokens = 0
         
-        for sentence in sentences:
-            sentence_tokens = self.count_tokens(sentence)
+        for sentence in self._sentences(para):
+            sentence_tokens = self._count(sentence)
             
-            if current_tokens + sentence_tokens > self.chunk_size:
+            if current_tokens + sentence_tokens > self.chunker.chunk_size:
                 if current_chunk:
-                    chunks.append(self._create_chunk(
-                        " ".join(current_chunk),
-                        start_index + len(chunks),
-                        metadata
-                    ))
+                    chunks.append(self._emit(self._join(" ", current_chunk)))
                 current_chunk = []
                 current_tokens = 0
             
@@ -123,50 +218,209 @@ class SemanticChunker:
             current_tokens += sentence_tokens
         
         if current_chunk:
-            chunks.append(self._create_chunk(
-                " ".join(current_chunk),
-                start_index + len(chunks),
-                metadata
-            ))
+            chunks.append(self._emit(self._join(" ", current_chunk)))
         
         return chunks
     
-    def _get_overlap_text(self, chunk_parts: list[str]) -> str:
-        """Get overlap text from the end of previous chunk"""
+    def _get_overlap(self, chunk_parts: list):
+        """Get overlap text from the end of previous chunk (None if there is none)"""
         if not chunk_parts:
-            return ""
+            return None
         
         # Take last paragraph or part of it
         last_part = chunk_parts[-1]
-        tokens = self.count_tokens(last_part)
         
-        if tokens <= self.chunk_overlap:
+        if self._count(last_part) <= self.chunker.chunk_overlap:
             return last_part
         
         # Take last sentences up to overlap limit
-        sentences = self.split_into_sentences(last_part)
         overlap_parts = []
         overlap_tokens = 0
         
-        for sentence in reversed(sentences):
-            sentence_tokens = self.count_tokens(sentence)
-            if overlap_tokens + sentence_tokens > self.chunk_overlap:
+        for sentence in reversed(self._sentences(last_part)):
+            sentence_tokens = self._count(sentence)
+            if overlap_tokens + sentence_tokens > self.chunker.chunk_overlap:
                 break
             overlap_parts.insert(0, sentence)
             overlap_tokens += sentence_tokens
         
-        return " ".join(overlap_parts)
+        return self._join(" ", overlap_parts) if overlap_parts else None
     
-    def _create_chunk(
-        self, 
-        content: str, 
-        index: int, 
-        metadata: Optional[dict]
-    ) -> dict:
-        """Create a chunk dictionary with metadata"""
-        return {
-            "content": content,
-            "chunk_index": index,
-            "token_count": self.count_tokens(content),
-            "metadata": metadata or {}
-        }
+    def _emit(self, part) -> dict:
+        chunk = self.chunker._create_chunk(
+            self._text(part), self.chunk_count, self.metadata, self._count(part)
+        )
+        self.chunk_count += 1
+        return chunk
+
+
+# Piece of a joined text: a span (encoded text, start, end) or a literal separator
+Segment = Union[tuple["EncodedText", int, int], str]
+
+
+class EncodedText:
+    """
+    A fed text encoded once, with token counts of its substrings read from offsets.
+    
+    A newline followed by a non-space character is a hard boundary: tiktoken's
+    pre-tokenizer never merges across it, so the tokens between two hard
+    boundaries are the same in the text and in any substring or join containing
+    them. A letter or digit followed by whitespace ends a token in both as well.
+    """
+    
+    def __init__(self, text: str, tokens: list[int], tokenizer: tiktoken.Encoding):
+        self.text = text
+        
+        # Character offset of every token (as decode_with_offsets, vectorized)
+        token_lengths = np.fromiter(
+            (len(b) for b in tokenizer.decode_tokens_bytes(tokens)),
+            dtype=np.int64,
+            count=len(tokens)
+        )
+        data = np.frombuffer(text.encode("utf-8"), dtype=np.uint8)
+        char_index = np.cumsum((data & 0xC0) != 0x80) - 1
+        self.offsets = char_index[np.cumsum(token_lengths) - token_lengths]
+        
+        self.boundaries = [0] + [m.end() for m in HARD_BOUNDARY.finditer(text)]
+        # Number of tokens before each hard boundary
+        self.prefix = np.searchsorted(self.offsets, self.boundaries).tolist()
+    
+    def tokens_before(self, position: int) -> int:
+        return int(np.searchsorted(self.offsets, position))
+    
+    def first_boundary(self, start: int, end: int, include_start: bool) -> Optional[int]:
+        """Index of the first hard boundary in [start, end) ((start, end) if not include_start)"""
+        i = bisect_left(self.boundaries, start if include_start else start + 1)
+        return i if i < len(self.boundaries) and self.boundaries[i] < end else None
+    
+    def last_boundary(self, end: int) -> int:
+        """Index of the last hard boundary before end"""
+        return bisect_left(self.boundaries, end) - 1
+    
+    def is_clean_end(self, end: int) -> bool:
+        """Does a token end at `end` in the text and in a substring ending there?"""
+        return self.text[end - 1].isalnum() and (end == len(self.text) or self.text[end].isspace())
+    
+    def spans(self, separator: re.Pattern, start: int, end: int) -> list[tuple[int, int]]:
+        """(start, end) of the stripped, non-empty pieces of text[start:end] split by separator"""
+        pieces = []
+        piece_start = start
+        for match in separator.finditer(self.text, start, end):
+            pieces.append((piece_start, match.start()))
+            piece_start = match.end()
+        pieces.append((piece_start, end))
+        
+        spans = []
+        for s, e in pieces:
+            piece = self.text[s:e]
+            content = piece.strip()
+            if content:
+                s += len(piece) - len(piece.lstrip())
+                spans.append((s, s + len(content)))
+        return spans
+
+
+class TextSpan:
+    """Paragraph, sentence or a join of them in offsets mode"""
+    
+    __slots__ = ("text", "segments", "token_count")
+    
+    def __init__(self, text: str, segments: tuple[Segment, ...]):
+        self.text = text
+        self.segments = segments
+        self.token_count: Optional[int] = None
+
+
+class OffsetChunkStream(ChunkStream):
+    """
+    ChunkStream that encodes each fed text once.
+    
+    Token counts of paragraphs, sentences and chunks come from the token offsets
+    of the fed text; only the fragments before the first and after the last hard
+    boundary of a piece are encoded again. Chunks are identical to ChunkStream's.
+    """
+    
+    def feed_many(self, texts: list[str]) -> list[dict]:
+        chunks = []
+        for text, tokens in zip(texts, self.chunker.encode_batch(texts)):
+            chunks.extend(self.feed(text, tokens))
+        return chunks
+    
+    def _paragraphs(self, text: str, tokens: Optional[list[int]] = None) -> list[TextSpan]:
+        if tokens is None:
+            tokens = self.chunker.tokenizer.encode(text)
+        encoded = EncodedText(text, tokens, self.chunker.tokenizer)
+        return [
+            TextSpan(text[s:e], ((encoded, s, e),))
+            for s, e in encoded.spans(PARAGRAPH_SEPARATOR, 0, len(text))
+        ]
+    
+    def _sentences(self, para: TextSpan) -> list[TextSpan]:
+        # Paragraphs are single spans of a fed text
+        (encoded, start, end), = para.segments
+        return [
+            TextSpan(encoded.text[s:e], ((encoded, s, e),))
+            for s, e in encoded.spans(SENTENCE_SEPARATOR, start, end)
+        ]
+    
+    def _join(self, separator: str, parts: list[TextSpan]) -> TextSpan:
+        segments = []
+        for i, part in enumerate(parts):
+            if i:
+                segments.append(separator)
+            segments.extend(part.segments)
+        return TextSpan(separator.join(part.text for part in parts), tuple(segments))
+    
+    def _count(self, part: TextSpan) -> int:
+        if part.token_count is None:
+            part.token_count = self._count_segments(part.segments)
+        return part.token_count
+    
+    def _text(self, part: TextSpan) -> str:
+        return part.text
+    
+    def _count_segments(self, segments: tuple[Segment, ...]) -> int:
+        """Exact token count of the concatenation of segments"""
+        total = 0
+        # Text since the last hard boundary, still to be encoded
+        pending: list[str] = []
+        # The start of the joined text is a hard boundary too
+        after_newline = True
+        
+        for i, segment in enumerate(segments):
+            if isinstance(segment, str):
+                pending.append(segment)
+                if segment:
+                    after_newline = segment.endswith("\n")
+                continue
+            
+            encoded, start, end = segment
+            first = encoded.first_boundary(start, end, include_start=after_newline)
+            if first is None:
+                pending.append(encoded.text[start:end])
+            else:
+                # Head fragment up to the first hard boundary
+                pending.append(encoded.text[start:encoded.boundaries[first]])
+                total += self._encode_pending(pending)
+                pending = []
+                
+                # Everything between the first and last hard boundary, from offsets
+                last = encoded.last_boundary(end)
+                total += encoded.prefix[last] - encoded.prefix[first]
+                
+                # Tail fragment: from offsets too if it ends on a token boundary here
+                next_segment = segments[i + 1] if i + 1 < len(segments) else None
+                followed_by_space = next_segment is None or (
+                    isinstance(next_segment, str) and next_segment[:1].isspace()
+                )
+                if followed_by_space and encoded.is_clean_end(end):
+                    total += encoded.tokens_before(end) - encoded.prefix[last]
+                else:
+                    pending.append(encoded.text[encoded.boundaries[last]:end])
+            after_newline = encoded.text[end - 1] == "\n"
+        
+        return total + self._encode_pending(pending)
+    
+    def _encode_pending(self, pending: list[str]) -> int:
+        text = "".join(pending)
+        return self.chunker.count_tokens(text) if text else 0
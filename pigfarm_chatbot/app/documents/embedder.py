@@ -1,11 +1,21 @@
 import google.generativeai as genai
-from typing import Optional, List
+from typing import Optional, List, Callable, Awaitable
 import asyncio
+import random
 
 from app.config import get_settings
+from app.documents.rate_limiter import get_embedding_rate_limiter
+from app.documents.embedding_cache import EmbeddingCache
+from app.rag.cache import LRUTTLCache, normalize_query
 
 settings = get_settings()
 
+# Progress callback: (processed, total) -> awaitable
+ProgressCallback = Callable[[int, int], Awaitable[None]]
+
+# Query embeddings are on the chat critical path: retry 429s briefly, then fail
+QUERY_MAX_RETRIES = 2
+
 
 class DocumentEmbedder:
     """
@@ -18,88 +28,256 @@ class DocumentEmbedder:
         self.model = settings.gemini_embedding_model
         # Use 1536 dimensions (Matryoshka)
         self.output_dim = 1536
-        # Global lock to prevent concurrent uploads from exceeding rate limits
-        self._lock = asyncio.Lock()
+        # Batch requests share the quota-aware limiter; the semaphore bounds in-flight batches
+        self.limiter = get_embedding_rate_limiter()
+        self._semaphore = asyncio.Semaphore(settings.embedding_concurrency)
+        self.cache = EmbeddingCache(self.model, self.output_dim)
+        self.query_cache = LRUTTLCache(
+            max_size=settings.query_embedding_cache_size,
+            ttl_seconds=settings.query_embedding_cache_ttl_seconds
+        )
     
     async def embed_text(self, text: str) -> List[float]:
-        """Generate embedding for a single text"""
-        loop = asyncio.get_running_loop()
+        """Generate a document embedding for a single text"""
+        embeddings = await self.embed_texts([text])
+        return embeddings[0]
+    
+    async def embed_query(self, query: str) -> List[float]:
+        """Generate a retrieval query embedding for a single query"""
+        embeddings = await self.embed_queries([query])
+        return embeddings[0]
+    
+    async def embed_queries(self, queries: List[str]) -> List[List[float]]:
+        """
+        Embed search queries (task type `retrieval_query`) in one batched call.
         
-        async with self._lock: # Wait for lock
-            def _call_api():
+        This path is latency-sensitive: it never waits behind ingestion. Calls are
+        charged to the shared limiter without queueing, and vectors are kept in an
+        in-memory LRU+TTL cache keyed by the normalized query.
+        """
+        if not queries:
+            return []
+        
+        keys = [normalize_query(q) for q in queries]
+        results: dict[str, List[float]] = {}
+        for key in keys:
+            cached = self.query_cache.get(key)
+            if cached is not None:
+                results[key] = cached
+        
+        # Deduplicate variations that normalize to the same key (embed the first original text)
+        missing_texts = {}
+        for key, query in zip(keys, queries):
+            if key not in results and key not in missing_texts:
+                missing_texts[key] = query
+        missing = list(missing_texts)
+        if missing:
+            loop = asyncio.get_running_loop()
+            
+            def _call_queries():
                 result = genai.embed_content(
                     model=self.model,
-                    content=text,
-                    task_type="retrieval_document",
+                    content=list(missing_texts.values()),
+                    task_type="retrieval_query",
                     output_dimensionality=self.output_dim
                 )
                 return result['embedding']
             
-            # Sleep a bit before call to be safe
-            await asyncio.sleep(1)
-            return await loop.run_in_executor(None, _call_api)
+            tokens = sum(self._estimate_tokens(q) for q in missing_texts.values())
+            for attempt in range(QUERY_MAX_RETRIES):
+                self.limiter.record(tokens)
+                try:
+                    embeddings = await loop.run_in_executor(None, _call_queries)
+                    self.limiter.on_success()
+                    break
+                except Exception as e:
+                    if not self._is_rate_limit_error(e) or attempt == QUERY_MAX_RETRIES - 1:
+                        raise e
+                    backoff = 1.0 + random.uniform(0, 0.5)
+                    self.limiter.on_rate_limited(backoff)
+                    await asyncio.sleep(backoff)
+            
+            for key, embedding in zip(missing, embeddings):
+                self.query_cache.set(key, embedding)
+                results[key] = embedding
+        
+        return [results[key] for key in keys]
     
-    async def embed_texts(self, texts: List[str]) -> List[List[float]]:
+    async def embed_texts(
+        self,
+        texts: List[str],
+        token_counts: Optional[List[int]] = None,
+        on_progress: Optional[ProgressCallback] = None
+    ) -> List[List[float]]:
         """
-        Generate embeddings for multiple texts (Sequential processing with Retry).
-        Safe mode for Free Tier limits.
+        Generate embeddings for multiple texts.
+        
+        Cached embeddings are served from the persistent embedding cache; only
+        the remaining texts are sent to the API and written back in bulk.
+        Results are returned in the same order as `texts`; `on_progress` is
+        awaited with (processed, total) after the cache lookup and each batch.
         """
         if not texts:
             return []
+        
+        if token_counts is None:
+            token_counts = [self._estimate_tokens(t) for t in texts]
+        
+        if not settings.embedding_cache_enabled:
+            return await self._embed_uncached(texts, token_counts, on_progress)
+        
+        hashes = [self.cache.content_hash(t) for t in texts]
+        try:
+            cached = await self.cache.get_many(hashes)
+        except Exception as e:
+            print(f"[EmbeddingCache] Lookup failed, embedding everything: {e}")
+            cached = {}
+        
+        missing = [i for i, h in enumerate(hashes) if h not in cached]
+        hit_count = len(texts) - len(missing)
+        print(f"[EmbeddingCache] {hit_count} hits, {len(missing)} misses")
+        if on_progress:
+            await on_progress(hit_count, len(texts))
+        
+        if missing:
+            async def _offset_progress(done: int, total: int):
+                await on_progress(hit_count + done, len(texts))
             
+            new_embeddings = await self._embed_uncached(
+                [texts[i] for i in missing],
+                [token_counts[i] for i in missing],
+                _offset_progress if on_progress else None
+            )
+            new_items = {hashes[i]: emb for i, emb in zip(missing, new_embeddings)}
+            try:
+                await self.cache.put_many(new_items)
+            except Exception as e:
+                print(f"[EmbeddingCache] Write-back failed: {e}")
+            cached.update(new_items)
+        
+        return [cached[h] for h in hashes]
+    
+    async def _embed_uncached(
+        self,
+        texts: List[str],
+        token_counts: List[int],
+        on_progress: Optional[ProgressCallback] = None
+    ) -> List[List[float]]:
+        """
+        Embed texts through the API.
+        
+        Texts are packed into batch requests sized by token count, paced by the
+        shared RPM/TPM token-bucket limiter and sent with bounded concurrency.
+        """
+        batches = self._make_batches(token_counts)
+        all_embeddings: List[Optional[List[float]]] = [None] * len(texts)
+        done = 0
+        
+        print(f"[Embedder] Embedding {len(texts)} chunks in {len(batches)} batches...")
+        
+        async def _run_batch(indices: List[int]):
+            nonlocal done
+            async with self._semaphore:
+                embeddings = await self._embed_batch(
+                    [texts[i] for i in indices],
+                    sum(token_counts[i] for i in indices)
+                )
+            for i, embedding in zip(indices, embeddings):
+                all_embeddings[i] = embedding
+            done += len(indices)
+            print(f"[Embedder] Processed {done}/{len(texts)} chunks")
+            if on_progress:
+                await on_progress(done, len(texts))
+        
+        tasks = [asyncio.create_task(_run_batch(indices)) for indices in batches]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            # Stop spending quota on the remaining batches (error or cancellation)
+            for task in tasks:
+                task.cancel()
+            raise
+        
+        return all_embeddings
+    
+    async def _embed_batch(self, texts: List[str], tokens: int) -> List[List[float]]:
+        """Send one batch request, backing off adaptively on rate limit errors"""
         loop = asyncio.get_running_loop()
-        all_embeddings = []
-        
-        print(f"[Embedder] Starting sequential embedding for {len(texts)} chunks...")
-        
-        # Acquire global lock - Only one document can be processed at a time system-wide
-        async with self._lock:
-            for i, text in enumerate(texts):
-                retries = 3
-                while retries > 0:
-                    try:
-                        def _call_single():
-                            result = genai.embed_content(
-                                model=self.model,
-                                content=text,
-                                task_type="retrieval_document",
-                                output_dimensionality=self.output_dim
-                            )
-                            return result['embedding']
-                        
-                        # Call API for single chunk
-                        embedding = await loop.run_in_executor(None, _call_single)
-                        all_embeddings.append(embedding)
-                        
-                        # Log progress
-                        if (i + 1) % 5 == 0:
-                            print(f"[Embedder] Processed {i + 1}/{len(texts)} chunks")
-                        
-                        # Sleep 2s -> Max 30 RPM (Safe for 100 RPM limit)
-                        await asyncio.sleep(2) 
-                        break # Success, exit retry loop
-                        
-                    except Exception as e:
-                        error_msg = str(e)
-                        if "429" in error_msg or "quota" in error_msg.lower() or "resource exhausted" in error_msg.lower():
-                            print(f"[Embedder] Rate limit hit at chunk {i+1}. Retrying in 10s... (Left: {retries})")
-                            await asyncio.sleep(15) # Wait longer if hit rate limit
-                            retries -= 1
-                        else:
-                            print(f"[Embedder Error] Chunk {i+1} failed: {error_msg}")
-                            raise e # Fatal error if not rate limit
+        
+        def _call_batch():
+            result = genai.embed_content(
+                model=self.model,
+                content=texts,
+                task_type="retrieval_document",
+                output_dimensionality=self.output_dim
+            )
+            return result['embedding']
+        
+        for attempt in range(settings.embedding_max_retries):
+            await self.limiter.acquire(tokens)
+            try:
+                embeddings = await loop.run_in_executor(None, _call_batch)
+                self.limiter.on_success()
+                return embeddings
+            except Exception as e:
+                if not self._is_rate_limit_error(e):
+                    print(f"[Embedder Error] Batch of {len(texts)} chunks failed: {e}")
+                    raise e
                 
-                if retries == 0:
-                    raise Exception(f"Failed to embed chunk {i+1} after retries")
-            
-        return all_embeddings
+                # Exponential backoff with jitter, shared with every other caller via the limiter
+                backoff = min(60.0, 2 ** attempt * 2) + random.uniform(0, 1)
+                print(f"[Embedder] Rate limit hit. Backing off {backoff:.1f}s "
+                      f"(attempt {attempt + 1}/{settings.embedding_max_retries})")
+                self.limiter.on_rate_limited(backoff)
+        
+        raise Exception(f"Failed to embed batch of {len(texts)} chunks after retries")
+    
+    def _make_batches(self, token_counts: List[int]) -> List[List[int]]:
+        """Greedily pack text indices into batches bounded by size and token count"""
+        batches = []
+        current: List[int] = []
+        current_tokens = 0
+        
+        for i, tokens in enumerate(token_counts):
+            if current and (
+                len(current) >= settings.embedding_batch_size
+                or current_tokens + tokens > settings.embedding_batch_max_tokens
+            ):
+                batches.append(current)
+                current = []
+                current_tokens = 0
+            current.append(i)
+            current_tokens += tokens
+        
+        if current:
+            batches.append(current)
+        
+        return batches
+    
+    @staticmethod
+    def _estimate_tokens(text: str) -> int:
+        """Rough token estimate when the caller has no tokenizer counts"""
+        return max(1, len(text) // 3)
+    
+    @staticmethod
+    def _is_rate_limit_error(error: Exception) -> bool:
+        error_msg = str(error).lower()
+        return "429" in error_msg or "quota" in error_msg or "resource exhausted" in error_msg
     
-    async def embed_chunks(self, chunks: List[dict]) -> List[dict]:
+    async def embed_chunks(
+        self,
+        chunks: List[dict],
+        on_progress: Optional[ProgressCallback] = None
+    ) -> List[dict]:
         """Add embeddings to chunk dictionaries"""
         contents = [chunk["content"] for chunk in chunks]
+        token_counts = [
+            chunk.get("token_count") or self._estimate_tokens(chunk["content"])
+            for chunk in chunks
+        ]
         
         try:
-            embeddings = await self.embed_texts(contents)
+            embeddings = await self.embed_texts(contents, token_counts, on_progress)
             
             for chunk, embedding in zip(chunks, embeddings):
                 chunk["embedding"] = embedding
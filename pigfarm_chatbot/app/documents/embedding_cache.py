@@ -0,0 +1,188 @@
+from sqlalchemy import text
+from typing import Optional, List
+import asyncio
+import hashlib
+
+from app.db.database import async_session_maker
+from app.config import get_settings
+
+settings = get_settings()
+
+
+class EmbeddingCache:
+    """
+    Persistent content-addressed embedding cache (chat_embedding_cache table).
+
+    Keys are sha256(model, output_dim, chunk text), so the same chunk text is only
+    ever embedded once per model/dimension, no matter which file it came from.
+    Entries are evicted by last use (age) and by total entry count, from a
+    periodic task (start / stop), never on the upload path.
+
+    Lookups are plain reads. last_used_at is refreshed afterwards, only for hits
+    not touched within `embedding_cache_touch_interval_hours`, in hash order and
+    skipping rows another transaction holds: concurrent ingests of overlapping
+    content never wait on (or deadlock over) each other's cache rows.
+    """
+
+    def __init__(self, model: str, output_dim: int):
+        self.model = model
+        self.output_dim = output_dim
+        self.hits = 0
+        self.misses = 0
+        self._evict_task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self._evict_task = asyncio.create_task(self._evict_loop())
+
+    async def stop(self):
+        if self._evict_task is not None:
+            self._evict_task.cancel()
+            await asyncio.gather(self._evict_task, return_exceptions=True)
+            self._evict_task = None
+
+    def content_hash(self, content: str) -> str:
+        key = f"{self.model}\x00{self.output_dim}\x00{content}"
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    async def get_many(self, hashes: List[str]) -> dict[str, List[float]]:
+        """Fetch cached embeddings for the given hashes and refresh their last use"""
+        if not hashes:
+            return {}
+
+        async with async_session_maker() as session:
+            result = await session.execute(
+                text("""
+                    SELECT content_hash, embedding
+                    FROM chat_embedding_cache
+                    WHERE content_hash = ANY(:hashes)
+                """),
+                {"hashes": list(set(hashes))}
+            )
+            rows = result.fetchall()
+
+        found = {row.content_hash: row.embedding for row in rows}
+        hit_count = sum(1 for h in hashes if h in found)
+        self.hits += hit_count
+        self.misses += len(hashes) - hit_count
+
+        if found:
+            try:
+                await self.touch(list(found))
+            except Exception as e:
+                print(f"[EmbeddingCache] Touch failed: {e}")
+        return found
+
+    async def touch(self, hashes: List[str]) -> int:
+        """
+        Refresh last_used_at of entries not touched within the touch interval.
+        Rows are locked in hash order and rows locked elsewhere are skipped.
+        """
+        async with async_session_maker() as session:
+            result = await session.execute(
+                text("""
+                    UPDATE chat_embedding_cache c
+                    SET last_used_at = CURRENT_TIMESTAMP
+                    FROM (
+                        SELECT content_hash
+                        FROM chat_embedding_cache
+                        WHERE content_hash = ANY(:hashes)
+                          AND last_used_at < CURRENT_TIMESTAMP - make_interval(hours => :hours)
+                        ORDER BY content_hash
+                        FOR UPDATE SKIP LOCKED
+                    ) t
+                    WHERE c.content_hash = t.content_hash
+                """),
+                {"hashes": sorted(hashes), "hours": settings.embedding_cache_touch_interval_hours}
+            )
+            await session.commit()
+        return result.rowcount
+
+    async def put_many(self, items: dict[str, List[float]]):
+        """Bulk-insert new embeddings (existing keys are left untouched)"""
+        if not items:
+            return
+
+        async with async_session_maker() as session:
+            await session.execute(
+                text("""
+                    INSERT INTO chat_embedding_cache (content_hash, model, output_dim, embedding)
+                    VALUES (:content_hash, :model, :output_dim, :embedding)
+                    ON CONFLICT (content_hash) DO NOTHING
+                """),
+                [
+                    {
+                        "content_hash": content_hash,
+                        "model": self.model,
+                        "output_dim": self.output_dim,
+                        "embedding": embedding
+                    }
+                    for content_hash, embedding in items.items()
+                ]
+            )
+            await session.commit()
+
+    async def evict(
+        self,
+        max_age_days: Optional[int] = None,
+        max_entries: Optional[int] = None
+    ) -> int:
+        """Delete entries unused for `max_age_days` and trim to the `max_entries` most recently used"""
+        max_age_days = max_age_days or settings.embedding_cache_max_age_days
+        max_entries = max_entries or settings.embedding_cache_max_entries
+
+        async with async_session_maker() as session:
+            by_age = await session.execute(
+                text("""
+                    DELETE FROM chat_embedding_cache
+                    WHERE last_used_at < CURRENT_TIMESTAMP - make_interval(days => :days)
+                """),
+                {"days": max_age_days}
+            )
+            by_size = await session.execute(
+                text("""
+                    DELETE FROM chat_embedding_cache
+                    WHERE content_hash IN (
+                        SELECT content_hash FROM chat_embedding_cache
+                        ORDER BY last_used_at DESC
+                        OFFSET :max_entries
+                    )
+                """),
+                {"max_entries": max_entries}
+            )
+            await session.commit()
+
+        evicted = by_age.rowcount + by_size.rowcount
+        if evicted:
+            print(f"[EmbeddingCache] Evicted {evicted} entries")
+        return evicted
+
+    async def _evict_loop(self):
+        while True:
+            await asyncio.sleep(settings.embedding_cache_evict_interval_seconds)
+            try:
+                await self.evict()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[EmbeddingCache] Eviction failed: {e}")
+
+    async def stats(self) -> dict:
+        async with async_session_maker() as session:
+            result = await session.execute(
+                text("""
+                    SELECT
+                        COUNT(*) AS entries,
+                        pg_total_relation_size('chat_embedding_cache') AS size_bytes
+                    FROM chat_embedding_cache
+                """)
+            )
+            row = result.fetchone()
+
+        lookups = self.hits + self.misses
+        return {
+            "entries": row.entries,
+            "size_bytes": row.size_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0
+        }
@@ -0,0 +1,223 @@
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Optional, Callable, Awaitable
+import asyncio
+import os
+import pickle
+
+from app.db.database import async_session_maker
+from app.documents.pdf_parser import PDFParser, iter_pdf_pages
+from app.documents.chunker import SemanticChunker
+from app.documents.embedder import get_embedder
+from app.rag.corpus import notify_document_changed, bump_corpus_version
+from app.documents.store import (
+    lock_filename, upsert_document, find_document, refresh_document_stats, copy_chunks,
+    chunk_hash, get_chunk_hashes, update_chunk_positions, delete_chunks
+)
+from app.config import get_settings
+
+settings = get_settings()
+
+# Progress callback: (stage, processed_chunks, total_chunks) -> awaitable
+StageProgressCallback = Callable[[str, int, Optional[int]], Awaitable[None]]
+# Hook run inside the storing transaction, before commit
+BeforeCommitHook = Callable[[AsyncSession], Awaitable[None]]
+
+
+INGEST_MODES = ("create", "update")
+
+
+class IngestSkipped(Exception):
+    """File cannot be ingested; the message is the user-facing reason"""
+
+
+async def ingest_file(
+    filename: str,
+    path: str,
+    on_progress: Optional[StageProgressCallback] = None,
+    before_commit: Optional[BeforeCommitHook] = None,
+    mode: str = "create"
+) -> int:
+    """
+    Parse, chunk, embed and store one spooled PDF file as a stream.
+
+    Pages are parsed in windows in the process pool and chunked incrementally;
+    chunks are embedded in batches of `ingest_batch_chunks` while the next pages
+    are parsed, and the embedded batches are staged in a spool file next to the
+    upload. Memory stays flat regardless of file size, and no database
+    transaction is open while the file is parsed and embedded.
+
+    The staged batches are then stored in one short transaction (filename lock,
+    COPY, stats, corpus version, caller's bookkeeping), so the file is still
+    stored all or nothing.
+
+    In "update" mode the new version is diffed against the stored chunks of the
+    same filename by content hash: unchanged chunks are kept (only their position
+    and metadata are updated), only new or changed chunks are embedded, and chunks
+    that disappeared are deleted - all in that final transaction, so readers see
+    either the old version or the new one. The diff is redone under the lock, in
+    case another upload of the same file committed meanwhile.
+
+    Args:
+        filename: Original filename (stored on every chunk)
+        path: Path of the spooled upload on disk
+        on_progress: Awaited on every stage change and embedding batch
+        before_commit: Runs in the same transaction as the chunk inserts
+        mode: "create" (append chunks) or "update" (replace the stored version)
+
+    Returns:
+        Number of chunks stored
+    """
+    async def _report(stage: str, processed: int = 0, total: Optional[int] = None):
+        if on_progress:
+            await on_progress(stage, processed, total)
+
+    chunker = SemanticChunker(
+        chunk_size=settings.chunk_size,
+        chunk_overlap=settings.chunk_overlap,
+        mode=settings.chunker_mode,
+        num_threads=settings.chunker_threads
+    )
+    batch_size = settings.ingest_batch_chunks
+    # Bounded hand-off between parsing and embedding: parsing runs ahead by at most 2 batches
+    batches: asyncio.Queue = asyncio.Queue(maxsize=2)
+
+    async def _produce():
+        cancelled = False
+        try:
+            stream = None
+            pending = []
+            async for window in iter_pdf_pages(path):
+                if stream is None:
+                    stream = chunker.start_stream(window["metadata"])
+                # Chunk the window in a thread: the window's pages are encoded as one
+                # threaded batch, and chunking of concurrent files runs in parallel
+                pages = [PDFParser.format_page(page) for page in window["pages"]]
+                pending.extend(await asyncio.to_thread(stream.feed_many, pages))
+                while len(pending) >= batch_size:
+                    await batches.put(pending[:batch_size])
+                    pending = pending[batch_size:]
+            if stream is not None:
+                pending.extend(stream.close())
+            if pending:
+                await batches.put(pending)
+        except asyncio.CancelledError:
+            # Cancelled after the consumer stopped: nobody reads the queue any more,
+            # so putting the sentinel into a full queue would block forever
+            cancelled = True
+            raise
+        finally:
+            # End of stream (also on error; the consumer re-raises it from the task)
+            if not cancelled:
+                await batches.put(None)
+
+    embedder = get_embedder()
+    staged_path = f"{path}.chunks"
+    stored = 0
+    reused = 0
+
+    # Update mode: stored chunk ids by content hash, read without locks. Only decides
+    # what to embed now; the final transaction diffs again against the committed rows.
+    old_chunks: dict[str, list[int]] = {}
+    if mode == "update":
+        async with async_session_maker() as session:
+            document_id = await find_document(session, filename)
+            if document_id is not None:
+                old_chunks = _hash_index(await get_chunk_hashes(session, document_id))
+
+    await _report("parsing")
+    producer = asyncio.create_task(_produce())
+    try:
+        with open(staged_path, "wb") as staged:
+            while (batch := await batches.get()) is not None:
+                kept, new_chunks = _split_reusable(batch, old_chunks)
+
+                async def _embedding_progress(done: int, total: int):
+                    await _report("embedding", stored + len(kept) + done)
+
+                if new_chunks:
+                    await embedder.embed_chunks(new_chunks, _embedding_progress)
+                await asyncio.to_thread(pickle.dump, batch, staged)
+                stored += len(batch)
+
+            # Surface parsing errors
+            await producer
+
+        if stored == 0:
+            raise IngestSkipped("Không thể trích xuất văn bản (File rỗng hoặc ảnh scan)")
+
+        await _report("storing", stored, stored)
+        async with async_session_maker() as session:
+            # One short transaction per file: all chunks (and the caller's bookkeeping) or nothing
+            await lock_filename(session, filename)
+            document_id = await upsert_document(session, filename)
+            current = {}
+            if mode == "update":
+                current = _hash_index(await get_chunk_hashes(session, document_id))
+
+            for batch in _read_staged(staged_path):
+                kept, new_chunks = _split_reusable(batch, current)
+                # Planned as reusable, but removed by an upload that committed meanwhile
+                unembedded = [chunk for chunk in new_chunks if "embedding" not in chunk]
+                if unembedded:
+                    await embedder.embed_chunks(unembedded)
+                await copy_chunks(session, document_id, filename, new_chunks)
+                await update_chunk_positions(session, kept)
+                reused += len(kept)
+
+            removed = await delete_chunks(session, [i for ids in current.values() for i in ids])
+            await refresh_document_stats(session, document_id, os.path.getsize(path))
+
+            await bump_corpus_version(session)
+            if before_commit:
+                await before_commit(session)
+            await session.commit()
+    finally:
+        if not producer.done():
+            producer.cancel()
+            # Wait for the cancellation so the task (and its parse window) does not leak
+            await asyncio.gather(producer, return_exceptions=True)
+        try:
+            os.remove(staged_path)
+        except FileNotFoundError:
+            pass
+
+    await notify_document_changed(document_id)
+
+    if mode == "update":
+        print(f"🔁 {filename}: giữ {reused}, thêm {stored - reused}, xóa {removed} chunks")
+    print(f"✅ Đã xử lý xong: {filename} ({stored} chunks)")
+    return stored
+
+
+def _hash_index(rows) -> dict[str, list[int]]:
+    """Stored chunk ids by content hash, in chunk order"""
+    index: dict[str, list[int]] = {}
+    for row in rows:
+        index.setdefault(row.content_hash, []).append(row.id)
+    return index
+
+
+def _read_staged(path: str):
+    """Batches staged by ingest_file, in order (one pickle per batch)"""
+    with open(path, "rb") as staged:
+        while True:
+            try:
+                yield pickle.load(staged)
+            except EOFError:
+                return
+
+
+def _split_reusable(
+    chunks: list[dict],
+    old_chunks: dict[str, list[int]]
+) -> tuple[list[tuple[int, dict]], list[dict]]:
+    """Split chunks into (stored id, chunk) pairs whose content is already stored, and new ones"""
+    kept = []
+    new_chunks = []
+    for chunk in chunks:
+        ids = old_chunks.get(chunk_hash(chunk["content"]))
+        if ids:
+            kept.append((ids.pop(0), chunk))
+        else:
+            new_chunks.append(chunk)
+    return kept, new_chunks
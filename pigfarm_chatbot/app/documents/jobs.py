@@ -0,0 +1,398 @@
+from fastapi import UploadFile
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import text
+from typing import Optional, BinaryIO
+from pathlib import Path
+import asyncio
+import os
+import shutil
+import uuid
+
+from app.db.database import async_session_maker
+from app.documents.ingest import ingest_file, IngestSkipped, INGEST_MODES
+from app.config import get_settings
+
+settings = get_settings()
+
+TERMINAL_STATUSES = ("completed", "skipped", "failed", "cancelled")
+
+
+class IngestCancelled(Exception):
+    """The file's job was cancelled while it was being processed"""
+
+
+class IngestJobManager:
+    """
+    Background ingestion jobs persisted in Postgres.
+
+    Uploads are spooled to disk and recorded in chat_ingest_jobs / chat_ingest_job_files.
+    A bounded pool of asyncio workers claims queued files with FOR UPDATE SKIP LOCKED,
+    so several server processes can share one queue. Running files are kept alive by a
+    heartbeat; a file whose heartbeat stops (crash, restart) is reclaimed after the lease.
+    """
+
+    def __init__(self, num_workers: int = 2):
+        self.num_workers = num_workers
+        self._tasks: list[asyncio.Task] = []
+        self._wakeup = asyncio.Event()
+        # job file id -> ingest task running in this process
+        self._running: dict[int, asyncio.Task] = {}
+        self._cancel_requested: set[int] = set()
+
+    async def start(self):
+        Path(settings.ingest_spool_dir).mkdir(parents=True, exist_ok=True)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.num_workers)]
+        self._tasks.append(asyncio.create_task(self._heartbeat()))
+        print(f"✅ Ingest workers started ({self.num_workers})")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def create_job(self, files: list[UploadFile], mode: str = "create") -> dict:
+        """
+        Spool uploaded files to disk and queue them; returns the job status.
+        mode "update" replaces the stored version of each file (see ingest_file).
+        """
+        if mode not in INGEST_MODES:
+            raise ValueError(f"Unknown ingest mode: {mode}")
+
+        job_id = uuid.uuid4()
+        job_dir = Path(settings.ingest_spool_dir) / str(job_id)
+        job_dir.mkdir(parents=True, exist_ok=True)
+        loop = asyncio.get_running_loop()
+
+        records = []
+        try:
+            for i, file in enumerate(files):
+                # Validate file type
+                if not file.filename.lower().endswith('.pdf'):
+                    records.append({
+                        "filename": file.filename,
+                        "spool_path": None,
+                        "status": "skipped",
+                        "reason": "Chỉ hỗ trợ file PDF"
+                    })
+                    continue
+
+                path = job_dir / f"{i}_{Path(file.filename).name}"
+                await loop.run_in_executor(None, _spool_upload, file.file, path)
+                records.append({
+                    "filename": file.filename,
+                    "spool_path": str(path),
+                    "status": "queued",
+                    "reason": None
+                })
+
+            async with async_session_maker() as session:
+                await session.execute(
+                    text("""
+                        INSERT INTO chat_ingest_jobs (id, status, total_files)
+                        VALUES (:id, 'queued', :total_files)
+                    """),
+                    {"id": job_id, "total_files": len(files)}
+                )
+                if records:
+                    await session.execute(
+                        text("""
+                            INSERT INTO chat_ingest_job_files (job_id, filename, mode, spool_path, status, reason)
+                            VALUES (:job_id, :filename, :mode, :spool_path, :status, :reason)
+                        """),
+                        [{"job_id": job_id, "mode": mode, **record} for record in records]
+                    )
+                job_status = await self._refresh_job_status(session, job_id)
+                await session.commit()
+        except BaseException:
+            shutil.rmtree(job_dir, ignore_errors=True)
+            raise
+
+        if job_status == "completed":
+            # Nothing was queued (every file skipped): no worker will ever clean up the job
+            shutil.rmtree(job_dir, ignore_errors=True)
+
+        print(f"📥 Ingest job {job_id}: {len(files)} files queued")
+        self._wakeup.set()
+        return await self.get_job(job_id)
+
+    async def get_job(self, job_id: uuid.UUID) -> Optional[dict]:
+        """Job status with per-file and per-chunk progress"""
+        async with async_session_maker() as session:
+            job = (await session.execute(
+                text("SELECT * FROM chat_ingest_jobs WHERE id = :id"),
+                {"id": job_id}
+            )).fetchone()
+            if job is None:
+                return None
+
+            files = (await session.execute(
+                text("""
+                    SELECT id, filename, mode, status, stage, total_chunks, processed_chunks, reason, updated_at
+                    FROM chat_ingest_job_files
+                    WHERE job_id = :id
+                    ORDER BY id
+                """),
+                {"id": job_id}
+            )).fetchall()
+
+        return {
+            "job_id": str(job.id),
+            "status": job.status,
+            "total_files": job.total_files,
+            "processed_files": sum(1 for f in files if f.status == "completed"),
+            "skipped_files": sum(1 for f in files if f.status in ("skipped", "failed")),
+            "created_at": str(job.created_at),
+            "updated_at": str(job.updated_at),
+            "files": [
+                {
+                    "filename": f.filename,
+                    "mode": f.mode,
+                    "status": f.status,
+                    "stage": f.stage,
+                    "total_chunks": f.total_chunks,
+                    "processed_chunks": f.processed_chunks,
+                    "reason": f.reason,
+                    "updated_at": str(f.updated_at)
+                }
+                for f in files
+            ]
+        }
+
+    async def cancel_job(self, job_id: uuid.UUID) -> Optional[dict]:
+        """Cancel queued and running files of a job; finished files are kept"""
+        async with async_session_maker() as session:
+            await session.execute(
+                text("""
+                    UPDATE chat_ingest_jobs
+                    SET status = 'cancelled', updated_at = CURRENT_TIMESTAMP
+                    WHERE id = :id AND status NOT IN ('completed', 'cancelled')
+                """),
+                {"id": job_id}
+            )
+            result = await session.execute(
+                text("""
+                    UPDATE chat_ingest_job_files
+                    SET status = 'cancelled', reason = 'Đã hủy', updated_at = CURRENT_TIMESTAMP
+                    WHERE job_id = :id AND status IN ('queued', 'running')
+                    RETURNING id, spool_path
+                """),
+                {"id": job_id}
+            )
+            cancelled = result.fetchall()
+            await session.commit()
+
+        for row in cancelled:
+            task = self._running.get(row.id)
+            if task is not None:
+                # Running here: stop it now. Other processes notice on their next progress update.
+                self._cancel_requested.add(row.id)
+                task.cancel()
+            elif row.spool_path:
+                _remove_spool_file(row.spool_path)
+
+        return await self.get_job(job_id)
+
+    async def _worker(self):
+        while True:
+            try:
+                job_file = await self._claim_next()
+            except Exception as e:
+                print(f"❌ [Ingest] Không thể lấy job: {e}")
+                job_file = None
+
+            if job_file is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=settings.ingest_poll_interval_seconds)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                continue
+
+            try:
+                await self._process(job_file)
+            except Exception as e:
+                print(f"❌ [Ingest] Worker error on file {job_file.filename}: {e}")
+
+    async def _claim_next(self):
+        """Atomically claim the oldest queued file (or one whose lease expired)"""
+        async with async_session_maker() as session:
+            result = await session.execute(
+                text("""
+                    UPDATE chat_ingest_job_files f
+                    SET status = 'running', stage = NULL, processed_chunks = 0,
+                        attempts = f.attempts + 1, updated_at = CURRENT_TIMESTAMP
+                    WHERE f.id = (
+                        SELECT id FROM chat_ingest_job_files
+                        WHERE status = 'queued'
+                           OR (status = 'running'
+                               AND updated_at < CURRENT_TIMESTAMP - make_interval(secs => :lease))
+                        ORDER BY id
+                        FOR UPDATE SKIP LOCKED
+                        LIMIT 1
+                    )
+                    RETURNING f.id, f.job_id, f.filename, f.mode, f.spool_path, f.attempts
+                """),
+                {"lease": settings.ingest_lease_seconds}
+            )
+            job_file = result.fetchone()
+            if job_file is not None:
+                await session.execute(
+                    text("""
+                        UPDATE chat_ingest_jobs
+                        SET status = 'running', updated_at = CURRENT_TIMESTAMP
+                        WHERE id = :id AND status = 'queued'
+                    """),
+                    {"id": job_file.job_id}
+                )
+            await session.commit()
+            return job_file
+
+    async def _process(self, job_file):
+        file_id = job_file.id
+        print(f"--- Đang xử lý file: {job_file.filename} (job {job_file.job_id}) ---")
+
+        if job_file.attempts > settings.ingest_max_attempts:
+            await self._finish(job_file, "failed", "Quá số lần thử xử lý file")
+            return
+        if not job_file.spool_path or not os.path.exists(job_file.spool_path):
+            await self._finish(job_file, "failed", "Mất file tạm, vui lòng upload lại")
+            return
+
+        async def _on_progress(stage: str, processed: int, total: Optional[int]):
+            async with async_session_maker() as session:
+                result = await session.execute(
+                    text("""
+                        UPDATE chat_ingest_job_files
+                        SET stage = :stage, processed_chunks = :processed,
+                            total_chunks = COALESCE(:total, total_chunks),
+                            updated_at = CURRENT_TIMESTAMP
+                        WHERE id = :id AND status = 'running'
+                    """),
+                    {"id": file_id, "stage": stage, "processed": processed, "total": total}
+                )
+                await session.commit()
+            if result.rowcount == 0:
+                raise IngestCancelled()
+
+        async def _mark_completed(session: AsyncSession):
+            # Same transaction as the chunk inserts: a cancelled file rolls back its chunks
+            result = await session.execute(
+                text("""
+                    UPDATE chat_ingest_job_files
+                    SET status = 'completed', stage = NULL, updated_at = CURRENT_TIMESTAMP
+                    WHERE id = :id AND status = 'running'
+                """),
+                {"id": file_id}
+            )
+            if result.rowcount == 0:
+                raise IngestCancelled()
+
+        task = asyncio.create_task(
+            ingest_file(
+                job_file.filename, job_file.spool_path, _on_progress, _mark_completed, job_file.mode
+            )
+        )
+        self._running[file_id] = task
+        try:
+            await task
+            await self._finish(job_file, None, None)
+        except IngestSkipped as e:
+            await self._finish(job_file, "skipped", str(e))
+        except IngestCancelled:
+            await self._finish(job_file, "cancelled", "Đã hủy")
+        except asyncio.CancelledError:
+            if file_id not in self._cancel_requested:
+                # Shutdown: leave the file 'running' so it is reclaimed after the lease
+                raise
+            await self._finish(job_file, "cancelled", "Đã hủy")
+        except Exception as e:
+            print(f"❌ Lỗi xử lý file {job_file.filename}: {str(e)}")
+            await self._finish(job_file, "failed", str(e))
+        finally:
+            self._running.pop(file_id, None)
+            self._cancel_requested.discard(file_id)
+
+    async def _finish(self, job_file, status: Optional[str], reason: Optional[str]):
+        """Record a terminal status (None = already recorded), clean up the spool and job"""
+        async with async_session_maker() as session:
+            if status is not None:
+                await session.execute(
+                    text("""
+                        UPDATE chat_ingest_job_files
+                        SET status = :status, reason = :reason, updated_at = CURRENT_TIMESTAMP
+                        WHERE id = :id AND status = 'running'
+                    """),
+                    {"id": job_file.id, "status": status, "reason": reason}
+                )
+            job_status = await self._refresh_job_status(session, job_file.job_id)
+            await session.commit()
+
+        if job_file.spool_path:
+            _remove_spool_file(job_file.spool_path)
+        if job_status in ("completed", "cancelled"):
+            shutil.rmtree(Path(settings.ingest_spool_dir) / str(job_file.job_id), ignore_errors=True)
+
+    async def _refresh_job_status(self, session: AsyncSession, job_id: uuid.UUID) -> str:
+        result = await session.execute(
+            text("""
+                UPDATE chat_ingest_jobs j
+                SET status = CASE
+                        WHEN j.status = 'cancelled' THEN 'cancelled'
+                        WHEN EXISTS (
+                            SELECT 1 FROM chat_ingest_job_files f
+                            WHERE f.job_id = j.id AND f.status <> ALL(:terminal)
+                        ) THEN j.status
+                        ELSE 'completed'
+                    END,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE j.id = :id
+                RETURNING j.status
+            """),
+            {"id": job_id, "terminal": list(TERMINAL_STATUSES)}
+        )
+        return result.scalar()
+
+    async def _heartbeat(self):
+        """Keep the lease of files running in this process alive"""
+        while True:
+            await asyncio.sleep(settings.ingest_lease_seconds / 3)
+            if not self._running:
+                continue
+            try:
+                async with async_session_maker() as session:
+                    await session.execute(
+                        text("""
+                            UPDATE chat_ingest_job_files
+                            SET updated_at = CURRENT_TIMESTAMP
+                            WHERE id = ANY(:ids) AND status = 'running'
+                        """),
+                        {"ids": list(self._running)}
+                    )
+                    await session.commit()
+            except Exception as e:
+                print(f"⚠️ [Ingest] Heartbeat failed: {e}")
+
+
+def _spool_upload(source: BinaryIO, path: Path):
+    source.seek(0)
+    with open(path, "wb") as target:
+        shutil.copyfileobj(source, target, length=1024 * 1024)
+
+
+def _remove_spool_file(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+# Singleton
+_job_manager: Optional[IngestJobManager] = None
+
+
+def get_job_manager() -> IngestJobManager:
+    global _job_manager
+    if _job_manager is None:
+        _job_manager = IngestJobManager(num_workers=settings.ingest_workers)
+    return _job_manager
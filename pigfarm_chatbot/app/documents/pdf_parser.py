@@ -1,49 +1,175 @@
 from pypdf import PdfReader
 from io import BytesIO
-from typing import Optional
+from typing import Optional, Union, AsyncIterator
+from concurrent.futures import ProcessPoolExecutor
+import asyncio
+import multiprocessing
+import os
+
+from app.config import get_settings
+
+settings = get_settings()
+
+# Per-process reader of the file being parsed: ((path, mtime, size), reader, metadata)
+_current: Optional[tuple] = None
 
 
 class PDFParser:
     """Parse PDF files and extract text content"""
-    
+
     @staticmethod
-    def extract_text(file_content: bytes) -> str:
-        """Extract all text from a PDF file"""
-        reader = PdfReader(BytesIO(file_content))
+    def parse(source: Union[bytes, str]) -> dict:
+        """
+        Single pass over a PDF (bytes or file path): full text, per-page text
+        and metadata, all from one PdfReader
+        """
+        reader = PdfReader(BytesIO(source) if isinstance(source, bytes) else source)
+        pages = []
         text_parts = []
-        
+
         for page_num, page in enumerate(reader.pages):
             page_text = page.extract_text()
             if page_text:
-                text_parts.append(f"[Trang {page_num + 1}]\n{page_text}")
-        
-        return "\n\n".join(text_parts)
-    
+                page = {
+                    "page_number": page_num + 1,
+                    "content": page_text
+                }
+                pages.append(page)
+                text_parts.append(PDFParser.format_page(page))
+
+        return {
+            "text": "\n\n".join(text_parts),
+            "pages": pages,
+            "metadata": PDFParser._reader_metadata(reader)
+        }
+
+    @staticmethod
+    def parse_pages(path: str, start: int, stop: int) -> dict:
+        """
+        Text of pages [start, stop) plus the document metadata.
+        Lets large files be processed in page windows instead of all at once.
+
+        Each process keeps the reader (and metadata) of the one file it is
+        parsing, so the file's xref and trailer are parsed once per worker rather
+        than once per window. It is dropped after the last window, on error, or
+        when the worker moves on to another file.
+        """
+        reader, metadata = _cached_reader(path)
+        num_pages = metadata["num_pages"]
+        pages = []
+
+        try:
+            for page_num in range(start, min(stop, num_pages)):
+                page_text = reader.pages[page_num].extract_text()
+                if page_text:
+                    pages.append({
+                        "page_number": page_num + 1,
+                        "content": page_text
+                    })
+        except BaseException:
+            _drop_reader(path)
+            raise
+
+        if stop >= num_pages:
+            _drop_reader(path)
+        return {
+            "pages": pages,
+            "metadata": metadata
+        }
+
+    @staticmethod
+    def format_page(page: dict) -> str:
+        """Page text as it appears in the full document text"""
+        return f"[Trang {page['page_number']}]\n{page['content']}"
+
+    @staticmethod
+    def extract_text(file_content: bytes) -> str:
+        """Extract all text from a PDF file"""
+        return PDFParser.parse(file_content)["text"]
+
     @staticmethod
     def extract_text_by_pages(file_content: bytes) -> list[dict]:
         """Extract text from each page separately"""
-        reader = PdfReader(BytesIO(file_content))
-        pages = []
-        
-        for page_num, page in enumerate(reader.pages):
-            page_text = page.extract_text()
-            if page_text:
-                pages.append({
-                    "page_number": page_num + 1,
-                    "content": page_text
-                })
-        
-        return pages
-    
+        return PDFParser.parse(file_content)["pages"]
+
+    @staticmethod
+    def get_metadata(source: Union[bytes, str]) -> dict:
+        """Extract metadata from PDF (bytes or file path; a path reuses the cached reader)"""
+        if isinstance(source, str):
+            return _cached_reader(source)[1]
+        return PDFParser._reader_metadata(PdfReader(BytesIO(source)))
+
     @staticmethod
-    def get_metadata(file_content: bytes) -> dict:
-        """Extract metadata from PDF"""
-        reader = PdfReader(BytesIO(file_content))
+    def _reader_metadata(reader: PdfReader) -> dict:
         metadata = reader.metadata
-        
+
         return {
             "title": metadata.title if metadata else None,
             "author": metadata.author if metadata else None,
             "subject": metadata.subject if metadata else None,
             "num_pages": len(reader.pages)
         }
+
+
+def _reader_key(path: str) -> tuple:
+    stat = os.stat(path)
+    return path, stat.st_mtime_ns, stat.st_size
+
+
+def _cached_reader(path: str) -> tuple[PdfReader, dict]:
+    """(reader, metadata) of `path`, replacing the cached file's reader (a changed file gets a new one)"""
+    global _current
+    key = _reader_key(path)
+    if _current is None or _current[0] != key:
+        # Release the previous reader before building the next one
+        _current = None
+        reader = PdfReader(path)
+        _current = (key, reader, PDFParser._reader_metadata(reader))
+    return _current[1], _current[2]
+
+
+def _drop_reader(path: str):
+    global _current
+    if _current is not None and _current[0][0] == path:
+        _current = None
+
+
+# Process pool for parsing (CPU-bound, must stay off the event loop)
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+def get_pdf_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=settings.pdf_parse_workers,
+            # spawn: workers start fresh instead of forking the server's event loop and threads
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _executor
+
+
+async def iter_pdf_pages(path: str, window: Optional[int] = None) -> AsyncIterator[dict]:
+    """
+    Yield a PDF file in windows of `window` pages, each parsed in the process pool.
+    Each item is a PDFParser.parse_pages result; only one window is held at a time.
+    """
+    window = window or settings.pdf_page_window
+    loop = asyncio.get_running_loop()
+    start = 0
+    num_pages = None
+
+    while num_pages is None or start < num_pages:
+        result = await loop.run_in_executor(
+            get_pdf_executor(), PDFParser.parse_pages, path, start, start + window
+        )
+        num_pages = result["metadata"]["num_pages"]
+        yield result
+        start += window
+
+
+def shutdown_pdf_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
@@ -0,0 +1,124 @@
+import asyncio
+import time
+from typing import Optional
+
+from app.config import get_settings
+
+settings = get_settings()
+
+
+class TokenBucket:
+    """
+    Classic token bucket refilled continuously at `per_minute / 60` units per second
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, scale: float = 1.0):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate * scale)
+        self.updated = now
+
+    def wait_time(self, amount: float, scale: float = 1.0) -> float:
+        """Seconds until `amount` units are available (0 if available now)"""
+        self.refill(scale)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / (self.rate * scale)
+
+    def consume(self, amount: float):
+        self.tokens -= amount
+
+    def drain(self):
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+
+
+class RateLimiter:
+    """
+    Quota-aware limiter for the embedding API.
+
+    Keeps one bucket for requests per minute and one for tokens per minute.
+    On a 429 the effective refill rate is halved and all callers pause for the
+    backoff delay; every successful call recovers the rate additively (AIMD),
+    so throughput converges to whatever the real quota allows.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: int,
+        tokens_per_minute: int,
+        min_scale: float = 0.1,
+        recovery_step: float = 0.05
+    ):
+        self._requests = TokenBucket(requests_per_minute)
+        self._tokens = TokenBucket(tokens_per_minute)
+        self.min_scale = min_scale
+        self.recovery_step = recovery_step
+        self.scale = 1.0
+        self._blocked_until = 0.0
+        # Waiters queue on this lock so acquisition is FIFO; API calls themselves run unlocked
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, tokens: int = 0):
+        """Wait until one request carrying `tokens` tokens fits in the quota"""
+        # A single oversized request can never fit a bucket, let it through at full capacity
+        tokens = min(tokens, self._tokens.capacity)
+
+        async with self._lock:
+            while True:
+                wait = max(
+                    self._blocked_until - time.monotonic(),
+                    self._requests.wait_time(1, self.scale),
+                    self._tokens.wait_time(tokens, self.scale)
+                )
+                if wait <= 0:
+                    self._requests.consume(1)
+                    self._tokens.consume(tokens)
+                    return
+                await asyncio.sleep(wait)
+
+    def record(self, tokens: int = 0):
+        """
+        Charge a request that was sent without waiting (latency-sensitive callers).
+        Buckets may go negative, which makes queued callers wait longer.
+        """
+        self._requests.refill(self.scale)
+        self._tokens.refill(self.scale)
+        self._requests.consume(1)
+        self._tokens.consume(tokens)
+
+    def on_success(self):
+        self.scale = min(1.0, self.scale + self.recovery_step)
+
+    def on_rate_limited(self, backoff_seconds: float):
+        """Shrink the rate and pause every caller for `backoff_seconds`"""
+        self.scale = max(self.min_scale, self.scale / 2)
+        self._blocked_until = max(self._blocked_until, time.monotonic() + backoff_seconds)
+        self._requests.drain()
+        self._tokens.drain()
+
+    def stats(self) -> dict:
+        return {
+            "rate_scale": round(self.scale, 3),
+            "requests_available": round(self._requests.tokens, 1),
+            "tokens_available": round(self._tokens.tokens, 1)
+        }
+
+
+# Singleton
+_limiter: Optional[RateLimiter] = None
+
+
+def get_embedding_rate_limiter() -> RateLimiter:
+    global _limiter
+    if _limiter is None:
+        _limiter = RateLimiter(
+            requests_per_minute=settings.embedding_rpm,
+            tokens_per_minute=settings.embedding_tpm
+        )
+    return _limiter
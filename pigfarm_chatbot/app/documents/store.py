@@ -0,0 +1,154 @@
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import text
+from typing import Optional
+import hashlib
+import json
+
+CHUNK_COLUMNS = [
+    "document_id", "filename", "content", "content_hash", "chunk_index", "embedding", "metadata"
+]
+
+
+def chunk_hash(content: str) -> str:
+    """sha256 hex of the chunk text (same as encode(sha256(convert_to(content, 'UTF8')), 'hex'))"""
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+async def lock_filename(session: AsyncSession, filename: str):
+    """
+    Serialize writers of the same filename for the rest of the transaction.
+    Also opens the transaction on the driver connection before any raw COPY.
+    """
+    await session.execute(
+        text("SELECT pg_advisory_xact_lock(hashtext(:filename))"),
+        {"filename": filename}
+    )
+
+
+async def upsert_document(session: AsyncSession, filename: str) -> int:
+    """Catalog row of a file (created on first upload); returns its id and locks it until commit"""
+    result = await session.execute(
+        text("""
+            INSERT INTO chat_document_catalog (filename)
+            VALUES (:filename)
+            ON CONFLICT (filename) DO UPDATE SET updated_at = CURRENT_TIMESTAMP
+            RETURNING id
+        """),
+        {"filename": filename}
+    )
+    return result.scalar()
+
+
+async def find_document(session: AsyncSession, filename: str) -> Optional[int]:
+    """Catalog id of a file, or None if it was never uploaded (takes no locks)"""
+    result = await session.execute(
+        text("SELECT id FROM chat_document_catalog WHERE filename = :filename"),
+        {"filename": filename}
+    )
+    return result.scalar()
+
+
+async def refresh_document_stats(session: AsyncSession, document_id: int, file_size: int):
+    """Recompute the catalog counters of a document from its chunks (uses the document_id index)"""
+    await session.execute(
+        text("""
+            UPDATE chat_document_catalog c
+            SET chunk_count = s.chunk_count,
+                content_bytes = s.content_bytes,
+                file_size = :file_size,
+                updated_at = CURRENT_TIMESTAMP
+            FROM (
+                SELECT COUNT(*) AS chunk_count, COALESCE(SUM(octet_length(content)), 0) AS content_bytes
+                FROM chat_documents
+                WHERE document_id = :document_id
+            ) s
+            WHERE c.id = :document_id
+        """),
+        {"document_id": document_id, "file_size": file_size}
+    )
+
+
+async def copy_chunks(
+    session: AsyncSession,
+    document_id: int,
+    filename: str,
+    chunks: list[dict]
+) -> int:
+    """
+    Bulk-insert chunks into chat_documents with a binary COPY.
+
+    Runs on the session's connection, inside its open transaction (call
+    `lock_filename` first), so all chunks of a file commit or roll back together.
+    Embeddings go through the registered pgvector binary codec.
+    """
+    if not chunks:
+        return 0
+
+    connection = await session.connection()
+    raw_connection = await connection.get_raw_connection()
+    records = [
+        (
+            document_id,
+            filename,
+            chunk["content"],
+            chunk_hash(chunk["content"]),
+            chunk["chunk_index"],
+            chunk["embedding"],
+            json.dumps(chunk["metadata"])
+        )
+        for chunk in chunks
+    ]
+    await raw_connection.driver_connection.copy_records_to_table(
+        "chat_documents",
+        records=records,
+        columns=CHUNK_COLUMNS
+    )
+    return len(records)
+
+
+async def get_chunk_hashes(session: AsyncSession, document_id: int) -> list:
+    """(id, content_hash) of the stored chunks of a document, in chunk order"""
+    result = await session.execute(
+        text("""
+            SELECT id, content_hash FROM chat_documents
+            WHERE document_id = :document_id
+            ORDER BY chunk_index
+        """),
+        {"document_id": document_id}
+    )
+    return result.fetchall()
+
+
+async def update_chunk_positions(session: AsyncSession, chunks: list[tuple[int, dict]]):
+    """Move kept chunks (id, chunk) to their new chunk_index / metadata in one statement"""
+    if not chunks:
+        return
+
+    await session.execute(
+        text("""
+            UPDATE chat_documents d
+            SET chunk_index = u.chunk_index, metadata = u.metadata::jsonb
+            FROM unnest(
+                CAST(:ids AS integer[]),
+                CAST(:chunk_indexes AS integer[]),
+                CAST(:metadata AS text[])
+            ) AS u(id, chunk_index, metadata)
+            WHERE d.id = u.id
+        """),
+        {
+            "ids": [chunk_id for chunk_id, _ in chunks],
+            "chunk_indexes": [chunk["chunk_index"] for _, chunk in chunks],
+            "metadata": [json.dumps(chunk["metadata"]) for _, chunk in chunks]
+        }
+    )
+
+
+async def delete_chunks(session: AsyncSession, ids: list[int]) -> int:
+    if not ids:
+        return 0
+
+    result = await session.execute(
+        text("DELETE FROM chat_documents WHERE id = ANY(:ids)"),
+        {"ids": ids}
+    )
+    return result.rowcount
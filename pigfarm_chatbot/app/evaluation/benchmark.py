@@ -0,0 +1,481 @@
+"""
+Retrieval benchmarks (run against the configured database)
+
+Usage:
+    python -m app.evaluation.benchmark vector-storage --k 10
+    python -m app.evaluation.benchmark chunker manual1.pdf manual2.pdf
+    python -m app.evaluation.benchmark fanout --runs 5
+    python -m app.evaluation.benchmark fusion --runs 5
+    python -m app.evaluation.benchmark ef-search --ef 20 40 80 160 --filename manual.pdf
+    python -m app.evaluation.benchmark rerank-budget --runs 3
+"""
+import argparse
+import asyncio
+import time
+from sqlalchemy import text
+
+from app.db.database import async_session_maker, close_db, VECTOR_INDEXES
+from app.documents.embedder import get_embedder
+from app.documents.chunker import SemanticChunker, CHUNKER_MODES
+from app.documents.pdf_parser import PDFParser
+from app.rag.vector_search import VectorSearch
+from app.rag.hybrid_search import get_hybrid_search
+from app.rag.reranker import get_reranker
+from app.rag.rerank_policy import plan_rerank
+from app.rag.memory_vector import get_memory_vector_index
+from app.rag.search_options import SearchOptions, filter_sql, filter_params
+from app.rag.corpus import hydrate_chunks
+from app.evaluation.dataset import get_test_cases
+
+
+def get_rag_questions() -> list[str]:
+    """Questions from the evaluation dataset that should be answered from documents"""
+    return [tc["question"] for tc in get_test_cases() if tc["expected_type"] == "rag"]
+
+
+def summarize_latency(samples_ms: list[float]) -> dict:
+    samples = sorted(samples_ms)
+    p95_index = min(len(samples) - 1, int(len(samples) * 0.95))
+    return {
+        "mean_ms": sum(samples) / len(samples),
+        "p95_ms": samples[p95_index]
+    }
+
+
+async def timed(coro) -> tuple[object, float]:
+    """Await a coroutine and return (result, elapsed milliseconds)"""
+    start = time.perf_counter()
+    result = await coro
+    return result, (time.perf_counter() - start) * 1000
+
+
+async def exact_top_k(
+    query_embedding: list[float],
+    k: int,
+    options: SearchOptions | None = None
+) -> list[int]:
+    """Ground-truth neighbours: exact cosine ordering (with the options' filters) and index scans disabled"""
+    async with async_session_maker() as session:
+        await session.execute(text("SET LOCAL enable_indexscan = off"))
+        result = await session.execute(
+            text(f"""
+                SELECT id FROM chat_documents
+                WHERE embedding IS NOT NULL{filter_sql(options)}
+                ORDER BY embedding <=> :embedding
+                LIMIT :limit
+            """),
+            {"embedding": query_embedding, "limit": k, **filter_params(options)}
+        )
+        return [row.id for row in result.fetchall()]
+
+
+async def ensure_vector_indexes(modes: list[str]) -> list[str]:
+    """Build the HNSW index of every benchmarked mode; return the ones created here"""
+    created = []
+    async with async_session_maker() as session:
+        for mode in modes:
+            index_name, index_def = VECTOR_INDEXES[mode]
+            exists = await session.execute(
+                text("SELECT 1 FROM pg_indexes WHERE indexname = :name"),
+                {"name": index_name}
+            )
+            if exists.scalar() is None:
+                print(f"Building {index_name} ...")
+                await session.execute(text(f"""
+                    CREATE INDEX {index_name} ON chat_documents
+                    {index_def}
+                    WITH (m = 32, ef_construction = 128)
+                """))
+                created.append(index_name)
+        await session.commit()
+    return created
+
+
+async def drop_indexes(index_names: list[str]):
+    async with async_session_maker() as session:
+        for index_name in index_names:
+            await session.execute(text(f"DROP INDEX IF EXISTS {index_name}"))
+        await session.commit()
+
+
+async def benchmark_vector_storage(
+    modes: list[str],
+    k: int = 10,
+    runs: int = 5,
+    keep_indexes: bool = False,
+    include_memory: bool = False
+) -> dict:
+    """
+    Compare recall@k and latency of each vector storage mode against exact search.
+    Indexes missing for a mode are built for the run and dropped afterwards.
+    include_memory adds the in-memory backend (MemoryVectorIndex snapshot) as a row.
+    """
+    embedder = get_embedder()
+    questions = get_rag_questions()
+    query_embeddings = await embedder.embed_queries(questions)
+
+    created = await ensure_vector_indexes(modes)
+    report = {}
+    try:
+        ground_truth = [await exact_top_k(e, k) for e in query_embeddings]
+
+        searchers = {mode: VectorSearch(top_k=k, storage_mode=mode, backend="pgvector") for mode in modes}
+        if include_memory:
+            await get_memory_vector_index().reload()
+            searchers["memory"] = VectorSearch(top_k=k, backend="memory")
+
+        for mode, searcher in searchers.items():
+            recalls = []
+            latencies = []
+            for embedding, expected in zip(query_embeddings, ground_truth):
+                results = []
+                for _ in range(runs):
+                    results, elapsed = await timed(searcher.search_by_embedding(embedding, k))
+                    latencies.append(elapsed)
+                found = {doc["id"] for doc in results}
+                recalls.append(len(found & set(expected)) / max(1, len(expected)))
+
+            report[mode] = {
+                "recall_at_k": sum(recalls) / len(recalls),
+                **summarize_latency(latencies)
+            }
+    finally:
+        if not keep_indexes:
+            await drop_indexes(created)
+
+    print(f"\nVector storage benchmark (k={k}, {len(questions)} queries x {runs} runs)")
+    print(f"{'mode':<10} {'recall@k':>10} {'mean ms':>10} {'p95 ms':>10}")
+    for mode, row in report.items():
+        print(f"{mode:<10} {row['recall_at_k']:>10.3f} {row['mean_ms']:>10.2f} {row['p95_ms']:>10.2f}")
+
+    return report
+
+
+async def benchmark_ef_search(
+    ef_values: list[int],
+    k: int = 10,
+    runs: int = 5,
+    filename: str | None = None,
+    iterative_scan: str | None = None
+) -> dict:
+    """
+    Recall@k / latency trade-off of per-query hnsw.ef_search on the configured
+    storage mode, optionally restricted to one file (filtered HNSW scans, where
+    iterative scans keep filtered queries from coming back short).
+    """
+    embedder = get_embedder()
+    questions = get_rag_questions()
+    query_embeddings = await embedder.embed_queries(questions)
+    searcher = VectorSearch(top_k=k, backend="pgvector")
+
+    base_options = SearchOptions(filename=filename)
+    ground_truth = [await exact_top_k(e, k, base_options) for e in query_embeddings]
+
+    report = {}
+    for ef in ef_values:
+        options = SearchOptions(ef_search=ef, iterative_scan=iterative_scan, filename=filename)
+        recalls = []
+        latencies = []
+        for embedding, expected in zip(query_embeddings, ground_truth):
+            results = []
+            for _ in range(runs):
+                results, elapsed = await timed(searcher.search_by_embedding(embedding, k, options))
+                latencies.append(elapsed)
+            found = {doc["id"] for doc in results}
+            recalls.append(len(found & set(expected)) / max(1, len(expected)))
+
+        report[ef] = {
+            "recall_at_k": sum(recalls) / len(recalls),
+            **summarize_latency(latencies)
+        }
+
+    scope = f"file={filename}, " if filename else ""
+    print(f"\nef_search benchmark ({searcher.storage_mode}, {scope}iterative_scan={iterative_scan}, "
+          f"k={k}, {len(questions)} queries x {runs} runs)")
+    print(f"{'ef_search':<10} {'recall@k':>10} {'mean ms':>10} {'p95 ms':>10}")
+    for ef, row in report.items():
+        print(f"{ef:<10} {row['recall_at_k']:>10.3f} {row['mean_ms']:>10.2f} {row['p95_ms']:>10.2f}")
+
+    return report
+
+
+def benchmark_chunker(
+    paths: list[str],
+    runs: int = 3,
+    chunk_size: int = 500,
+    chunk_overlap: int = 50,
+    num_threads: int = 4
+) -> dict:
+    """
+    Time each chunker mode on the given PDFs, one file at a time and all files
+    as one batch, and check that every mode produces the same chunks.
+    """
+    texts = [PDFParser.parse(path)["text"] for path in paths]
+    total_chars = sum(len(t) for t in texts)
+
+    report = {}
+    reference = None
+    for mode in CHUNKER_MODES:
+        chunker = SemanticChunker(chunk_size, chunk_overlap, mode=mode, num_threads=num_threads)
+        single_ms = []
+        batch_ms = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            chunks = [chunker.chunk_text(text) for text in texts]
+            single_ms.append((time.perf_counter() - start) * 1000)
+
+            start = time.perf_counter()
+            batch_chunks = chunker.chunk_texts(texts)
+            batch_ms.append((time.perf_counter() - start) * 1000)
+
+        if batch_chunks != chunks:
+            raise AssertionError(f"{mode}: chunk_texts differs from chunk_text")
+        if reference is None:
+            reference = chunks
+        elif chunks != reference:
+            raise AssertionError(f"{mode}: chunks differ from {CHUNKER_MODES[0]}")
+
+        report[mode] = {
+            "chunks": sum(len(c) for c in chunks),
+            "single_ms": min(single_ms),
+            "batch_ms": min(batch_ms)
+        }
+
+    print(f"\nChunker benchmark ({len(paths)} files, {total_chars} chars, best of {runs})")
+    print(f"{'mode':<10} {'chunks':>8} {'per file ms':>12} {'batch ms':>10}")
+    for mode, row in report.items():
+        print(f"{mode:<10} {row['chunks']:>8} {row['single_ms']:>12.1f} {row['batch_ms']:>10.1f}")
+    print("Chunk boundaries identical across modes")
+
+    return report
+
+
+async def benchmark_fanout(runs: int = 5, transform: bool = True) -> dict:
+    """
+    Latency of hybrid retrieval (vector + BM25 for every query variation),
+    sequential vs concurrent fan-out, on the evaluation questions.
+    Query embeddings are warmed up first, so both paths measure retrieval only.
+    """
+    hybrid = get_hybrid_search()
+    query_sets = []
+    for question in get_rag_questions():
+        if transform:
+            query_sets.append((await hybrid.query_transformer.transform(question))["variations"])
+        else:
+            query_sets.append([question])
+
+    for queries in query_sets:
+        await hybrid.retrieve(queries)
+
+    report = {}
+    for label, concurrent in (("sequential", False), ("concurrent", True)):
+        latencies = []
+        for queries in query_sets:
+            for _ in range(runs):
+                _, elapsed = await timed(hybrid.retrieve(queries, concurrent=concurrent))
+                latencies.append(elapsed)
+        report[label] = summarize_latency(latencies)
+
+    avg_queries = sum(len(q) for q in query_sets) / len(query_sets)
+    print(f"\nRetrieval fan-out benchmark ({len(query_sets)} questions, "
+          f"{avg_queries:.1f} variations each, x {runs} runs)")
+    print(f"{'path':<12} {'mean ms':>10} {'p95 ms':>10}")
+    for label, row in report.items():
+        print(f"{label:<12} {row['mean_ms']:>10.2f} {row['p95_ms']:>10.2f}")
+
+    return report
+
+
+async def benchmark_fusion(runs: int = 5, top_k: int = 20, transform: bool = True) -> dict:
+    """
+    Hybrid search latency with RRF fusion in Python (two retrievers, one query
+    per variation) vs in SQL (one statement), and whether both return the same
+    ranking. Query embeddings are warmed up first.
+    """
+    hybrid = get_hybrid_search()
+    query_sets = []
+    for question in get_rag_questions():
+        if transform:
+            query_sets.append((await hybrid.query_transformer.transform(question))["variations"])
+        else:
+            query_sets.append([question])
+
+    async def python_fusion(queries: list[str]) -> list[dict]:
+        vector_candidates, bm25_candidates = await hybrid.retrieve(queries)
+        fused = hybrid._reciprocal_rank_fusion(vector_candidates, bm25_candidates, top_k)
+        # Hydrate like HybridSearch.search, so both paths return content
+        return await hydrate_chunks(fused)
+
+    paths = {
+        "python": python_fusion,
+        "sql": lambda queries: hybrid.search_sql(queries, top_k)
+    }
+
+    rankings = {label: [] for label in paths}
+    for queries in query_sets:
+        for label, search in paths.items():
+            rankings[label].append([doc["id"] for doc in await search(queries)])
+
+    report = {}
+    for label, search in paths.items():
+        latencies = []
+        for queries in query_sets:
+            for _ in range(runs):
+                _, elapsed = await timed(search(queries))
+                latencies.append(elapsed)
+        report[label] = summarize_latency(latencies)
+
+    identical = sum(p == s for p, s in zip(rankings["python"], rankings["sql"]))
+    report["identical_rankings"] = identical
+
+    print(f"\nHybrid fusion benchmark ({len(query_sets)} questions, top {top_k}, x {runs} runs)")
+    print(f"{'path':<12} {'mean ms':>10} {'p95 ms':>10}")
+    for label in paths:
+        row = report[label]
+        print(f"{label:<12} {row['mean_ms']:>10.2f} {row['p95_ms']:>10.2f}")
+    print(f"Identical rankings: {identical}/{len(query_sets)}")
+
+    return report
+
+
+async def benchmark_rerank_budget(runs: int = 3, top_k: int = 5, candidates: int = 20) -> dict:
+    """
+    Adaptive rerank budget (rerank_policy.plan_rerank) vs reranking every fused
+    candidate, on the evaluation questions. Cohere is called directly (no score
+    cache) so latencies are real API round trips. The full rerank is the
+    reference: relevance kept is the reference score mass of the adaptive top_k
+    over that of the reference top_k; overlap is the share of the reference
+    results (score >= 0.3) the adaptive path also returns.
+    """
+    hybrid = get_hybrid_search()
+    reranker = get_reranker()
+    threshold = 0.3
+
+    rows = []
+    for question in get_rag_questions():
+        results = await hybrid.search(question, top_k=candidates)
+        if not results:
+            continue
+
+        reference_scores, reference_ms = [], []
+        for _ in range(runs):
+            reference_scores, elapsed = await timed(reranker._cohere_scores(question, results))
+            reference_ms.append(elapsed)
+        by_id = {doc["id"]: score for doc, score in zip(results, reference_scores)}
+        reference = sorted(by_id, key=by_id.get, reverse=True)[:top_k]
+
+        plan = plan_rerank(results, top_k, candidates)
+        adaptive_ms = []
+        if plan.skip:
+            adaptive = [doc["id"] for doc in results[:top_k]]
+            adaptive_final = set(adaptive)
+            adaptive_ms = [0.0] * runs
+        else:
+            budget = results[:plan.candidates]
+            scores = []
+            for _ in range(runs):
+                scores, elapsed = await timed(reranker._cohere_scores(question, budget))
+                adaptive_ms.append(elapsed)
+            ranked = sorted(zip(budget, scores), key=lambda pair: pair[1], reverse=True)[:top_k]
+            adaptive = [doc["id"] for doc, _ in ranked]
+            adaptive_final = {doc["id"] for doc, score in ranked if score >= threshold}
+
+        reference_final = {i for i in reference if by_id[i] >= threshold}
+        ideal = sum(by_id[i] for i in reference)
+        rows.append({
+            "plan": plan,
+            "reference_ms": reference_ms,
+            "adaptive_ms": adaptive_ms,
+            "relevance_kept": sum(by_id[i] for i in adaptive) / ideal if ideal else 1.0,
+            "overlap": len(reference_final & adaptive_final) / len(reference_final) if reference_final else 1.0
+        })
+
+    if not rows:
+        print("No results: upload documents first")
+        return {}
+
+    report = {
+        "questions": len(rows),
+        "skipped": sum(row["plan"].skip for row in rows),
+        "mean_candidates": sum(row["plan"].candidates for row in rows) / len(rows),
+        "reference": summarize_latency([ms for row in rows for ms in row["reference_ms"]]),
+        "adaptive": summarize_latency([ms for row in rows for ms in row["adaptive_ms"]]),
+        "relevance_kept": sum(row["relevance_kept"] for row in rows) / len(rows),
+        "overlap": sum(row["overlap"] for row in rows) / len(rows)
+    }
+
+    print(f"\nRerank budget benchmark ({len(rows)} questions, top {top_k} of {candidates}, x {runs} runs)")
+    print(f"Skipped rerank: {report['skipped']}/{len(rows)}, "
+          f"mean documents sent: {report['mean_candidates']:.1f} (vs {candidates})")
+    print(f"{'path':<12} {'mean ms':>10} {'p95 ms':>10}")
+    for label in ("reference", "adaptive"):
+        row = report[label]
+        print(f"{label:<12} {row['mean_ms']:>10.2f} {row['p95_ms']:>10.2f}")
+    print(f"Relevance kept: {report['relevance_kept']:.3f}, overlap with full rerank: {report['overlap']:.3f}")
+
+    return report
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="PigFarm chatbot retrieval benchmarks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    storage = subparsers.add_parser("vector-storage", help="Recall/latency of vector storage modes")
+    storage.add_argument("--modes", nargs="+", default=list(VECTOR_INDEXES))
+    storage.add_argument("--k", type=int, default=10)
+    storage.add_argument("--runs", type=int, default=5)
+    storage.add_argument("--keep-indexes", action="store_true")
+    storage.add_argument("--memory", action="store_true", help="Also benchmark the in-memory backend")
+
+    ef = subparsers.add_parser("ef-search", help="Recall/latency of per-query hnsw.ef_search")
+    ef.add_argument("--ef", type=int, nargs="+", default=[20, 40, 80, 160, 320])
+    ef.add_argument("--k", type=int, default=10)
+    ef.add_argument("--runs", type=int, default=5)
+    ef.add_argument("--filename", help="Only search this file (filtered scan)")
+    ef.add_argument("--iterative-scan", choices=["off", "strict_order", "relaxed_order"])
+
+    chunker = subparsers.add_parser("chunker", help="Speed and equality of chunker modes on PDFs")
+    chunker.add_argument("paths", nargs="+", help="PDF files (large manuals)")
+    chunker.add_argument("--runs", type=int, default=3)
+    chunker.add_argument("--chunk-size", type=int, default=500)
+    chunker.add_argument("--chunk-overlap", type=int, default=50)
+    chunker.add_argument("--threads", type=int, default=4)
+
+    fanout = subparsers.add_parser("fanout", help="Sequential vs concurrent hybrid retrieval latency")
+    fanout.add_argument("--runs", type=int, default=5)
+    fanout.add_argument("--no-transform", action="store_true", help="Only the original question")
+
+    fusion = subparsers.add_parser("fusion", help="Python vs SQL RRF fusion latency and agreement")
+    fusion.add_argument("--runs", type=int, default=5)
+    fusion.add_argument("--top-k", type=int, default=20)
+    fusion.add_argument("--no-transform", action="store_true", help="Only the original question")
+
+    budget = subparsers.add_parser("rerank-budget", help="Adaptive rerank budget: latency saved vs relevance lost")
+    budget.add_argument("--runs", type=int, default=3)
+    budget.add_argument("--top-k", type=int, default=5)
+    budget.add_argument("--candidates", type=int, default=20)
+
+    args = parser.parse_args()
+    try:
+        if args.command == "vector-storage":
+            await benchmark_vector_storage(
+                args.modes, args.k, args.runs, args.keep_indexes, args.memory
+            )
+        elif args.command == "ef-search":
+            await benchmark_ef_search(args.ef, args.k, args.runs, args.filename, args.iterative_scan)
+        elif args.command == "chunker":
+            benchmark_chunker(
+                args.paths, args.runs, args.chunk_size, args.chunk_overlap, args.threads
+            )
+        elif args.command == "fanout":
+            await benchmark_fanout(args.runs, not args.no_transform)
+        elif args.command == "fusion":
+            await benchmark_fusion(args.runs, args.top_k, not args.no_transform)
+        elif args.command == "rerank-budget":
+            await benchmark_rerank_budget(args.runs, args.top_k, args.candidates)
+    finally:
+        await close_db()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
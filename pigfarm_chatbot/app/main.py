@@ -5,7 +5,12 @@ import os
 
 from app.config import get_settings
 from app.db.database import init_db, close_db
-from app.api import chat, documents
+from app.documents.jobs import get_job_manager
+from app.documents.embedder import get_embedder
+from app.documents.pdf_parser import shutdown_pdf_executor
+from app.rag.memory_bm25 import get_memory_bm25
+from app.rag.memory_vector import get_memory_vector_index
+from app.api import chat, documents, metrics
 
 
 settings = get_settings()
@@ -23,11 +28,25 @@ async def lifespan(app: FastAPI):
     # Startup
     try:
         await init_db()
+        await get_job_manager().start()
+        if settings.embedding_cache_enabled:
+            await get_embedder().cache.start()
+        if settings.lexical_search_backend == "memory":
+            # Loads in the background; lexical search stays on SQL until it is ready
+            await get_memory_bm25().start()
+        if settings.vector_search_backend == "memory":
+            # Maps (or builds) the vector snapshot in the background; pgvector serves until then
+            await get_memory_vector_index().start()
         print("✅ PigFarm Chatbot sẵn sàng!")
     except Exception as e:
         print(f"❌ Lỗi khởi động: {e}")
     yield
     # Shutdown
+    await get_job_manager().stop()
+    await get_embedder().cache.stop()
+    await get_memory_bm25().stop()
+    await get_memory_vector_index().stop()
+    shutdown_pdf_executor()
     await close_db()
 
 
@@ -54,6 +73,7 @@ app.add_middleware(
 # Include routers
 app.include_router(chat.router, prefix="/chat", tags=["Chat"])
 app.include_router(documents.router, prefix="/documents", tags=["Documents"])
+app.include_router(metrics.router, prefix="/metrics", tags=["Metrics"])
 
 
 @app.get("/health")
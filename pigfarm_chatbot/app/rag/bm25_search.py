@@ -1,136 +1,127 @@
 from sqlalchemy import text
 from typing import Optional
+import asyncio
 
 from app.db.database import async_session_maker
+from app.rag.search_options import SearchOptions, filter_sql, filter_params
+from app.rag.corpus import hydrate_chunks
+
+# Vietnamese lexical search ({query} is a text SQL expression); shared by
+# search_vietnamese and the server-side hybrid query so both rank alike.
+# Both sides are compared lowercased and unaccented (chat_normalize, see init_db), and
+# every match predicate is backed by an index: content_tsv @@ (all words present) and
+# the trigram % / <% operators (thresholds set per connection from settings).
+NORMALIZED_QUERY = "chat_normalize(CAST({query} AS text))"
+VIETNAMESE_SCORE = "similarity(content_norm, {q}) * 0.5 + word_similarity({q}, content_norm) * 0.5"
+VIETNAMESE_MATCH = (
+    "content_tsv @@ plainto_tsquery('simple', {q}) "
+    "OR content_norm % {q} "
+    "OR {q} <% content_norm"
+)
+
+
+def vietnamese_score(query: str) -> str:
+    return VIETNAMESE_SCORE.format(q=NORMALIZED_QUERY.format(query=query))
+
+
+def vietnamese_match(query: str) -> str:
+    return VIETNAMESE_MATCH.format(q=NORMALIZED_QUERY.format(query=query))
 
 
 class BM25Search:
     """
-    BM25-style search using PostgreSQL Full-Text Search (tsvector) 
+    Lexical search using PostgreSQL Full-Text Search (tsvector)
     and trigram similarity for fuzzy matching
     
-    Combines:
-    1. Full-text search with ts_rank
+    Combines, on the normalized content columns (content_tsv, content_norm):
+    1. Word matching with the 'simple' text search config
     2. Trigram similarity for fuzzy matching
     """
     
+    # Source label of search_vietnamese results
+    source = "bm25_vi"
+    
     def __init__(self, top_k: int = 10):
         self.top_k = top_k
     
-    async def search(self, query: str, top_k: Optional[int] = None) -> list[dict]:
+    async def search_vietnamese(
+        self,
+        query: str,
+        top_k: Optional[int] = None,
+        options: Optional[SearchOptions] = None
+    ) -> list[dict]:
         """
-        Search using PostgreSQL full-text search with BM25-like ranking
-        
-        Args:
-            query: Search query text
-            top_k: Number of results to return
+        Search optimized for Vietnamese text using trigram similarity
+        (PostgreSQL FTS doesn't have Vietnamese dictionary by default)
         
-        Returns:
-            List of documents with relevance scores
+        Matches and scores on the normalized content columns, accent-insensitively,
+        using only index-backed predicates so latency stays flat as the corpus grows.
+        Filters in `options` are pushed into the WHERE clause.
         """
+        candidates = await self.search_candidates(query, top_k, options)
+        return await hydrate_chunks([
+            {"id": chunk_id, "score": score, "source": self.source}
+            for chunk_id, score in candidates
+        ])
+    
+    async def search_candidates(
+        self,
+        query: str,
+        top_k: Optional[int] = None,
+        options: Optional[SearchOptions] = None
+    ) -> list[tuple[int, float]]:
+        """(chunk id, score) of the best search_vietnamese matches, best first; no content is fetched"""
         k = top_k or self.top_k
         
         async with async_session_maker() as session:
-            # Combine full-text search rank and trigram similarity
-            # This gives us both exact matches and fuzzy matches
+            # Use trigram similarity for Vietnamese
+            # Also do simple word matching (tsvector, 'simple' config)
             result = await session.execute(
-                text("""
-                    SELECT 
-                        id,
-                        filename,
-                        content,
-                        chunk_index,
-                        metadata,
-                        (
-                            ts_rank(to_tsvector('english', content), plainto_tsquery('english', :query)) * 0.6 +
-                            similarity(content, :query) * 0.4
-                        ) as score
-                    FROM chat_documents
-                    WHERE 
-                        to_tsvector('english', content) @@ plainto_tsquery('english', :query)
-                        OR similarity(content, :query) > 0.1
-                    ORDER BY score DESC
-                    LIMIT :limit
-                """),
-                {"query": query, "limit": k}
+                text(self.candidates_sql(":query", options)),
+                {"query": query, "bm25_k": k, **filter_params(options)}
             )
             
-            rows = result.fetchall()
-            
-            return [
-                {
-                    "id": row.id,
-                    "filename": row.filename,
-                    "content": row.content,
-                    "chunk_index": row.chunk_index,
-                    "metadata": row.metadata,
-                    "score": float(row.score),
-                    "source": "bm25"
-                }
-                for row in rows
-            ]
+            return [(row.id, float(row.score)) for row in result.fetchall()]
     
-    async def search_vietnamese(self, query: str, top_k: Optional[int] = None) -> list[dict]:
+    def candidates_sql(self, query: str, options: Optional[SearchOptions] = None) -> str:
         """
-        Search optimized for Vietnamese text using trigram similarity
-        (PostgreSQL FTS doesn't have Vietnamese dictionary by default)
+        Subquery with the best (id, score) rows of search_vietnamese for one query,
+        limited by the :bm25_k parameter. `query` is any text SQL expression, so the
+        server-side hybrid query can run it as a LATERAL search per query variation.
+        Filters in `options` bind the parameters of filter_params().
+        """
+        return f"""
+            SELECT id, ({vietnamese_score(query)}) AS score
+            FROM chat_documents
+            WHERE ({vietnamese_match(query)}){filter_sql(options)}
+            ORDER BY score DESC
+            LIMIT :bm25_k
         """
-        k = top_k or self.top_k
-        
-        async with async_session_maker() as session:
-            # Use trigram similarity for Vietnamese
-            # Also do simple word matching
-            result = await session.execute(
-                text("""
-                    SELECT 
-                        id,
-                        filename,
-                        content,
-                        chunk_index,
-                        metadata,
-                        (
-                            similarity(content, :query) * 0.5 +
-                            word_similarity(:query, content) * 0.5
-                        ) as score
-                    FROM chat_documents
-                    WHERE 
-                        content ILIKE '%' || :query || '%'
-                        OR similarity(content, :query) > 0.1
-                    ORDER BY score DESC
-                    LIMIT :limit
-                """),
-                {"query": query, "limit": k}
-            )
-            
-            rows = result.fetchall()
-            
-            return [
-                {
-                    "id": row.id,
-                    "filename": row.filename,
-                    "content": row.content,
-                    "chunk_index": row.chunk_index,
-                    "metadata": row.metadata,
-                    "score": float(row.score),
-                    "source": "bm25_vi"
-                }
-                for row in rows
-            ]
     
     async def search_multi_query(
         self, 
         queries: list[str], 
-        top_k_per_query: int = 10
-    ) -> list[dict]:
-        """Search with multiple queries"""
-        all_results = []
-        
-        for query in queries:
+        top_k_per_query: int = 10,
+        semaphore: Optional[asyncio.Semaphore] = None,
+        options: Optional[SearchOptions] = None
+    ) -> list[tuple[int, float]]:
+        """
+        Search with multiple queries, concurrently under `semaphore` if given
+        (sequentially if None). Candidates (chunk id, score) are combined in query order.
+        """
+        async def _search(query: str) -> list[tuple[int, float]]:
             # Use Vietnamese-optimized search
-            results = await self.search_vietnamese(query, top_k_per_query)
-            all_results.extend(results)
+            if semaphore is None:
+                return await self.search_candidates(query, top_k_per_query, options)
+            async with semaphore:
+                return await self.search_candidates(query, top_k_per_query, options)
+        
+        if semaphore is None:
+            per_query = [await _search(q) for q in queries]
+        else:
+            per_query = await asyncio.gather(*(_search(q) for q in queries))
         
-        return all_results
+        return [candidate for results in per_query for candidate in results]
 
 
 # Singleton
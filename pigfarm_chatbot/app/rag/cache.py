@@ -0,0 +1,97 @@
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+import re
+import threading
+import time
+import unicodedata
+
+
+def normalize_query(query: str) -> str:
+    """Normalize a query for use as a cache key (case, unicode form, whitespace, trailing punctuation)"""
+    query = unicodedata.normalize("NFC", query).lower()
+    query = re.sub(r"\s+", " ", query).strip()
+    return query.rstrip("?!. ")
+
+
+class LRUTTLCache:
+    """
+    Bounded in-memory LRU cache with a per-entry time-to-live.
+    Expired entries are dropped lazily on access; the least recently used
+    entry is evicted when the cache is full. With `sizeof` (value -> approximate
+    bytes), the memory held by cached values is tracked for stats().
+    """
+
+    def __init__(
+        self,
+        max_size: int = 1024,
+        ttl_seconds: float = 3600,
+        sizeof: Optional[Callable[[Any], int]] = None
+    ):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.sizeof = sizeof
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._sizes: dict[Hashable, int] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def __contains__(self, key: Hashable) -> bool:
+        """Whether `key` has a live entry (does not count as a lookup or refresh recency)"""
+        with self._lock:
+            entry = self._data.get(key)
+            return entry is not None and entry[0] >= time.monotonic()
+
+    def set(self, key: Hashable, value: Any, ttl_seconds: Optional[float] = None):
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        size = self.sizeof(value) if self.sizeof else 0
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._sizes[key] = size
+            self._bytes += size
+            while len(self._data) > self.max_size:
+                self._remove(next(iter(self._data)))
+
+    def _remove(self, key: Hashable):
+        del self._data[key]
+        self._bytes -= self._sizes.pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._sizes.clear()
+            self._bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            **({"approx_bytes": self._bytes} if self.sizeof else {})
+        }
@@ -0,0 +1,101 @@
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Callable, Awaitable, Optional
+
+from app.db.database import async_session_maker
+
+# Corpus change notifications for in-process indexes, the corpus version counter,
+# and chunk lookups by id.
+# Ingestion and deletion notify after their transaction commits; listeners re-read
+# what they need from chat_documents. Changes made by other processes are not
+# notified here, so listeners also reconcile periodically against corpus_signature().
+# Every transaction that changes chat_documents also bumps chat_corpus_version, which
+# all processes read, so caches keyed on it never serve results of an older corpus.
+
+DOCUMENT_CHANGED = "changed"  # chunks of the document were inserted, replaced or moved
+DOCUMENT_DELETED = "deleted"  # the document and all its chunks are gone
+
+# Listener: (event, document_id) -> awaitable
+CorpusListener = Callable[[str, int], Awaitable[None]]
+
+_listeners: list[CorpusListener] = []
+
+
+def add_listener(listener: CorpusListener):
+    if listener not in _listeners:
+        _listeners.append(listener)
+
+
+def remove_listener(listener: CorpusListener):
+    if listener in _listeners:
+        _listeners.remove(listener)
+
+
+async def notify(event: str, document_id: int):
+    """Run every listener; a failing listener never fails the caller (it reconciles later)"""
+    for listener in list(_listeners):
+        try:
+            await listener(event, document_id)
+        except Exception as e:
+            print(f"⚠️ [Corpus] Listener failed on {event} document {document_id}: {e!r}")
+
+
+async def notify_document_changed(document_id: int):
+    await notify(DOCUMENT_CHANGED, document_id)
+
+
+async def notify_document_deleted(document_id: int):
+    await notify(DOCUMENT_DELETED, document_id)
+
+
+async def corpus_signature(session: Optional[AsyncSession] = None) -> tuple[int, int]:
+    """
+    (chunk count, max chunk id) of chat_documents; differs after any insert or delete.
+    Pass a session to read it in the same snapshot as other queries.
+    """
+    if session is None:
+        async with async_session_maker() as session:
+            return await corpus_signature(session)
+
+    row = (await session.execute(
+        text("SELECT COUNT(*) AS chunks, COALESCE(MAX(id), 0) AS max_id FROM chat_documents")
+    )).one()
+    return row.chunks, row.max_id
+
+
+async def bump_corpus_version(session: AsyncSession):
+    """Increment the corpus version inside the caller's transaction (visible on commit)"""
+    await session.execute(text("UPDATE chat_corpus_version SET version = version + 1 WHERE id = 1"))
+
+
+async def corpus_version() -> int:
+    """Current corpus version; changes with every committed upload or delete"""
+    async with async_session_maker() as session:
+        result = await session.execute(text("SELECT version FROM chat_corpus_version WHERE id = 1"))
+        return result.scalar() or 0
+
+
+async def fetch_chunks(ids: list[int]) -> dict[int, dict]:
+    """Chunk rows (id, filename, content, chunk_index, metadata) by id, in one query"""
+    if not ids:
+        return {}
+
+    async with async_session_maker() as session:
+        result = await session.execute(
+            text("""
+                SELECT id, filename, content, chunk_index, metadata
+                FROM chat_documents
+                WHERE id = ANY(:ids)
+            """),
+            {"ids": list(set(ids))}
+        )
+        return {row.id: dict(row._mapping) for row in result.fetchall()}
+
+
+async def hydrate_chunks(docs: list[dict]) -> list[dict]:
+    """
+    Late hydration: add the stored fields to search results that only carry ids
+    and scores. Chunks deleted since they were retrieved are dropped.
+    """
+    rows = await fetch_chunks([doc["id"] for doc in docs])
+    return [{**rows[doc["id"]], **doc} for doc in docs if doc["id"] in rows]
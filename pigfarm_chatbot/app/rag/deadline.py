@@ -0,0 +1,68 @@
+from typing import Awaitable, TypeVar
+import asyncio
+import time
+
+T = TypeVar("T")
+
+
+class Deadline:
+    """
+    Time budget of one RAG request, passed down to every stage.
+
+    Each stage runs within min(its own budget, time remaining), optionally
+    keeping a reserve for the stages after it, and is skipped when too little
+    time is left. Whatever was skipped, timed out or replaced by a fallback is
+    recorded with degrade() and reported with the response.
+    """
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.started_at = time.monotonic()
+        self.expires_at = self.started_at + seconds
+        self.degradations: list[dict] = []
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    def budget(self, stage_seconds: float, reserve: float = 0.0) -> float:
+        """Timeout for a stage: its own budget, capped by the time left minus `reserve`"""
+        return max(0.0, min(stage_seconds, self.remaining() - reserve))
+
+    def allows(self, min_seconds: float, reserve: float = 0.0) -> bool:
+        """Whether at least `min_seconds` are left after `reserve`"""
+        return self.remaining() - reserve >= min_seconds
+
+    def degrade(self, stage: str, action: str, detail: str = ""):
+        """Record that `stage` was degraded (e.g. "skipped", "timeout", "fallback")"""
+        self.degradations.append({
+            "stage": stage,
+            "action": action,
+            "detail": detail,
+            "at_ms": round(1000 * self.elapsed(), 1)
+        })
+        print(f"⚠️ [Deadline] {stage}: {action}" + (f" ({detail})" if detail else ""))
+
+    def to_dict(self) -> dict:
+        return {
+            "deadline_ms": round(1000 * self.seconds, 1),
+            "elapsed_ms": round(1000 * self.elapsed(), 1),
+            "degradations": list(self.degradations)
+        }
+
+
+async def wait_for_stage(awaitable: Awaitable[T], timeout: float) -> T:
+    """asyncio.wait_for that fails fast (no scheduling) when the budget is already spent"""
+    if timeout <= 0:
+        if asyncio.iscoroutine(awaitable):
+            awaitable.close()
+        raise asyncio.TimeoutError()
+    return await asyncio.wait_for(awaitable, timeout=timeout)
+
+
+def log_background_failure(task: asyncio.Task):
+    """Done callback for a task nobody awaits any more (avoids 'never retrieved' warnings)"""
+    if not task.cancelled() and task.exception() is not None:
+        print(f"⚠️ Background task failed: {task.exception()!r}")
@@ -1,18 +1,41 @@
-from typing import Optional
+from sqlalchemy import text
+from typing import Optional, Awaitable
 from collections import defaultdict
+import asyncio
+import time
 
+from app.db.database import async_session_maker
 from app.rag.vector_search import get_vector_search, VectorSearch
 from app.rag.bm25_search import get_bm25_search, BM25Search
-from app.rag.query_transformer import get_query_transformer, QueryTransformer
+from app.rag.memory_bm25 import get_memory_bm25, MemoryBM25Search
+from app.rag.query_transformer import get_query_transformer, QueryTransformer, REWRITE_DEADLINE
+from app.rag.search_options import SearchOptions
+from app.rag.metrics import OutcomeStats
+from app.rag.corpus import hydrate_chunks
+from app.rag.deadline import Deadline, wait_for_stage, log_background_failure
 from app.config import get_settings
 
 settings = get_settings()
 
+# Outcomes of search_speculative
+SPECULATIVE_MERGED = "merged"  # rewrite arrived in time; its searches were merged in
+SPECULATIVE_DEADLINE_MISSED = "deadline_missed"  # answered from the original query only
+SPECULATIVE_REWRITE_FAILED = "rewrite_failed"
+
 
 class HybridSearch:
     """
     Hybrid search combining Vector Search and BM25 Search
     Uses Reciprocal Rank Fusion (RRF) to combine results
+    
+    With hybrid_search_mode "sql" both searches and the fusion run in Postgres as
+    one statement; the Python fusion path is the fallback if that fails. With the
+    in-memory BM25 backend (lexical_search_backend "memory") lexical scoring runs
+    in-process and only vector search goes to the database (Python fusion); the
+    in-memory vector backend likewise switches fusion to Python.
+    
+    With speculative_retrieval_enabled, a search whose rewrite needs the LLM
+    retrieves the original query while the rewrite runs (search_speculative).
     """
     
     def __init__(
@@ -23,16 +46,23 @@ class HybridSearch:
     ):
         self.vector_search = get_vector_search()
         self.bm25_search = get_bm25_search()
+        self.memory_bm25 = get_memory_bm25()
         self.query_transformer = get_query_transformer()
         self.vector_k = vector_k
         self.bm25_k = bm25_k
         self.rrf_k = rrf_k
+        # Outcome and end-to-end latency of speculative searches
+        self.speculative_metrics = OutcomeStats(
+            [SPECULATIVE_MERGED, SPECULATIVE_DEADLINE_MISSED, SPECULATIVE_REWRITE_FAILED]
+        )
     
     async def search(
         self,
         query: str,
         use_query_transformation: bool = True,
-        top_k: int = 20
+        top_k: int = 20,
+        options: Optional[SearchOptions] = None,
+        deadline: Optional[Deadline] = None
     ) -> list[dict]:
         """
         Perform hybrid search with optional query transformation
@@ -41,42 +71,318 @@ class HybridSearch:
             query: Original user query
             use_query_transformation: Whether to rewrite and expand queries
             top_k: Number of final results after fusion
+            options: Per-query HNSW settings and filters, passed to both retrievers
+            deadline: Request deadline; caps every stage's timeout and records
+                skipped or timed-out stages
         
         Returns:
             List of documents ranked by RRF score
         """
+        if (
+            use_query_transformation
+            and settings.speculative_retrieval_enabled
+            and self.query_transformer.needs_llm(query)
+        ):
+            return await self.search_speculative(query, top_k, options, deadline)
+        
         # Step 1: Query Transformation (optional)
         if use_query_transformation:
-            transformed = await self.query_transformer.transform(query)
+            transformed = await self.query_transformer.transform(query, deadline)
             queries = transformed["variations"]
         else:
             queries = [query]
         
-        # Step 2: Parallel search with both methods
-        vector_results = await self.vector_search.search_multi_query(
-            queries, 
-            top_k_per_query=self.vector_k
-        )
+        if settings.hybrid_search_mode == "sql" and self.sql_fusion_available(options):
+            timeout = max(settings.vector_search_timeout_seconds, settings.bm25_search_timeout_seconds)
+            if deadline:
+                timeout = deadline.budget(timeout)
+            try:
+                return await wait_for_stage(self.search_sql(queries, top_k, options), timeout)
+            except asyncio.TimeoutError:
+                # The Python fan-out would need at least as long: return no results instead
+                print(f"⚠️ [HybridSearch] SQL fusion timed out after {timeout:.2f}s, no results")
+                if deadline:
+                    deadline.degrade("sql_fusion", "timeout", f"{timeout:.2f}s, no results")
+                return []
+            except Exception as e:
+                print(f"⚠️ [HybridSearch] SQL fusion failed, falling back to Python fusion: {e!r}")
+                if deadline:
+                    deadline.degrade("sql_fusion", "fallback", repr(e))
         
-        bm25_results = await self.bm25_search.search_multi_query(
-            queries,
-            top_k_per_query=self.bm25_k
-        )
+        # Step 2: Parallel search with both methods (ids and scores only)
+        vector_candidates, bm25_candidates = await self.retrieve(queries, options=options, deadline=deadline)
         
         # Step 3: Reciprocal Rank Fusion
         fused_results = self._reciprocal_rank_fusion(
-            vector_results, 
-            bm25_results,
-            top_k
+            vector_candidates, 
+            bm25_candidates,
+            top_k,
+            lexical_source=self.lexical_search(options).source
+        )
+        
+        # Step 4: Fetch content for the final results only
+        return await hydrate_chunks(fused_results)
+    
+    async def search_speculative(
+        self,
+        query: str,
+        top_k: int = 20,
+        options: Optional[SearchOptions] = None,
+        deadline: Optional[Deadline] = None
+    ) -> list[dict]:
+        """
+        Hybrid search that overlaps the rewrite LLM call with retrieval of the
+        original query, so the critical path is max(rewrite, search) plus the
+        rewritten query's own searches.
+        
+        If the rewrite misses `rewrite_deadline_seconds`, results come from the
+        original query alone; the rewrite keeps running in the background and
+        lands in the rewrite cache for the next time. Candidates are merged in
+        query order, so the fusion matches search() with the same variations.
+        With a request deadline, transform() budgets the rewrite itself, keeping
+        `rag_retrieval_reserve_seconds` for the rewritten query's searches: the
+        LLM is not called at all when too little time is left.
+        """
+        started = time.perf_counter()
+        rewrite_timeout = settings.rewrite_deadline_seconds
+        transform_task = asyncio.create_task(self.query_transformer.transform(query, deadline))
+        original_task = asyncio.create_task(self.retrieve([query], options=options, deadline=deadline))
+        
+        outcome = SPECULATIVE_MERGED
+        try:
+            if deadline:
+                # Skips or times out on its own, recording it on the deadline
+                transformed = await transform_task
+            else:
+                transformed = await wait_for_stage(asyncio.shield(transform_task), rewrite_timeout)
+            extra_queries = [q for q in transformed["variations"] if q != query]
+            if transformed["rewrite_source"] == REWRITE_DEADLINE:
+                outcome = SPECULATIVE_DEADLINE_MISSED
+        except asyncio.TimeoutError:
+            print(f"⚠️ [HybridSearch] Rewrite missed the {rewrite_timeout:.2f}s deadline, "
+                  f"using the original query only")
+            transform_task.add_done_callback(log_background_failure)
+            extra_queries = []
+            outcome = SPECULATIVE_DEADLINE_MISSED
+        except Exception as e:
+            print(f"⚠️ [HybridSearch] Rewrite failed, using the original query only: {e!r}")
+            extra_queries = []
+            outcome = SPECULATIVE_REWRITE_FAILED
+            if deadline:
+                deadline.degrade("rewrite", "failed", repr(e))
+        
+        vector_candidates, bm25_candidates = await original_task
+        if extra_queries:
+            extra_vector, extra_bm25 = await self.retrieve(extra_queries, options=options, deadline=deadline)
+            vector_candidates = vector_candidates + extra_vector
+            bm25_candidates = bm25_candidates + extra_bm25
+        
+        fused_results = self._reciprocal_rank_fusion(
+            vector_candidates,
+            bm25_candidates,
+            top_k,
+            lexical_source=self.lexical_search(options).source
+        )
+        results = await hydrate_chunks(fused_results)
+        self.speculative_metrics.record(outcome, time.perf_counter() - started)
+        return results
+    
+    def lexical_search(self, options: Optional[SearchOptions] = None) -> BM25Search | MemoryBM25Search:
+        """
+        The in-memory BM25 index when configured and loaded (unfiltered searches),
+        else the SQL lexical search
+        """
+        if options is not None and options.has_filters:
+            return self.bm25_search
+        if settings.lexical_search_backend == "memory" and self.memory_bm25.ready:
+            return self.memory_bm25
+        return self.bm25_search
+    
+    def sql_fusion_available(self, options: Optional[SearchOptions] = None) -> bool:
+        """search_sql needs both retrievers in Postgres (no in-process backend in use)"""
+        return (
+            self.lexical_search(options) is self.bm25_search
+            and not self.vector_search.use_memory_index(options)
         )
+    
+    async def search_sql(
+        self,
+        queries: list[str],
+        top_k: int = 20,
+        options: Optional[SearchOptions] = None
+    ) -> list[dict]:
+        """
+        Vector + lexical search for all query variations and RRF fusion in one
+        SQL statement; only the fused top_k rows (with content) come back.
+        
+        Ranks follow _reciprocal_rank_fusion exactly: each retriever's per-query
+        lists are concatenated in query order, a document ranks by its first
+        occurrence, and ties keep vector-first insertion order.
+        """
+        query_embeddings = await self.vector_search.embedder.embed_queries(queries)
+        
+        params = {"rrf_k": self.rrf_k, "top_k": top_k, "bm25_k": self.bm25_k}
+        variations = []
+        for i, (query, embedding) in enumerate(zip(queries, query_embeddings)):
+            variations.append(f"({i}, CAST(:embedding_{i} AS vector(1536)), CAST(:query_{i} AS text))")
+            params[f"embedding_{i}"] = embedding
+            params[f"query_{i}"] = query
         
-        return fused_results
+        async with async_session_maker() as session:
+            params.update(await self.vector_search.prepare_candidates(session, self.vector_k, options))
+            result = await session.execute(
+                text(f"""
+                    WITH variations(q, embedding, query) AS (
+                        VALUES {", ".join(variations)}
+                    ),
+                    vector_hits AS (
+                        SELECT
+                            v.q,
+                            c.id,
+                            c.distance,
+                            row_number() OVER (PARTITION BY v.q ORDER BY c.distance) AS pos
+                        FROM variations v
+                        CROSS JOIN LATERAL ({self.vector_search.candidates_sql("v.embedding", options)}) c
+                    ),
+                    bm25_hits AS (
+                        SELECT
+                            v.q,
+                            c.id,
+                            c.score,
+                            row_number() OVER (PARTITION BY v.q ORDER BY c.score DESC) AS pos
+                        FROM variations v
+                        CROSS JOIN LATERAL ({self.bm25_search.candidates_sql("v.query", options)}) c
+                    ),
+                    vector_ranked AS (
+                        SELECT id, 1 - distance AS score, row_number() OVER (ORDER BY q, pos) AS rank
+                        FROM (
+                            SELECT DISTINCT ON (id) id, q, pos, distance
+                            FROM vector_hits
+                            ORDER BY id, q, pos
+                        ) first_hits
+                    ),
+                    bm25_ranked AS (
+                        SELECT id, score, row_number() OVER (ORDER BY q, pos) AS rank
+                        FROM (
+                            SELECT DISTINCT ON (id) id, q, pos, score
+                            FROM bm25_hits
+                            ORDER BY id, q, pos
+                        ) first_hits
+                    ),
+                    fused AS (
+                        SELECT
+                            COALESCE(v.id, b.id) AS id,
+                            COALESCE(1 / (CAST(:rrf_k AS float8) + v.rank), 0) +
+                                COALESCE(1 / (CAST(:rrf_k AS float8) + b.rank), 0) AS rrf_score,
+                            COALESCE(v.score, b.score) AS score,
+                            v.rank AS vector_rank,
+                            b.rank AS bm25_rank
+                        FROM vector_ranked v
+                        FULL OUTER JOIN bm25_ranked b ON b.id = v.id
+                        ORDER BY rrf_score DESC, vector_rank NULLS LAST, bm25_rank
+                        LIMIT :top_k
+                    )
+                    SELECT
+                        f.id,
+                        d.filename,
+                        d.content,
+                        d.chunk_index,
+                        d.metadata,
+                        f.score,
+                        f.rrf_score,
+                        f.vector_rank,
+                        f.bm25_rank
+                    FROM fused f
+                    JOIN chat_documents d ON d.id = f.id
+                    ORDER BY f.rrf_score DESC, f.vector_rank NULLS LAST, f.bm25_rank
+                """),
+                params
+            )
+            rows = result.fetchall()
+        
+        return [
+            {
+                "id": row.id,
+                "filename": row.filename,
+                "content": row.content,
+                "chunk_index": row.chunk_index,
+                "metadata": row.metadata,
+                "score": float(row.score),
+                "source": "vector" if row.vector_rank is not None else "bm25_vi",
+                "rrf_score": float(row.rrf_score),
+                "in_vector": row.vector_rank is not None,
+                "in_bm25": row.bm25_rank is not None
+            }
+            for row in rows
+        ]
+    
+    async def retrieve(
+        self,
+        queries: list[str],
+        concurrent: bool = True,
+        options: Optional[SearchOptions] = None,
+        deadline: Optional[Deadline] = None
+    ) -> tuple[list[tuple[int, float]], list[tuple[int, float]]]:
+        """
+        Vector and BM25 candidates (chunk id, score) for all query variations.
+        
+        Concurrent (default): both retrievers and all variations fan out at once,
+        bounded by `retrieval_concurrency` per call (concurrent searches are only
+        bounded by the DB pool, so they do not queue behind each other's
+        timeouts); each retriever has its own timeout and
+        contributes no results if it expires, so a slow one cannot hold up the other.
+        Timeouts are capped by `deadline` and expiries are recorded on it.
+        Otherwise every query runs one after another (previous behaviour).
+        """
+        lexical_search = self.lexical_search(options)
+        if not concurrent:
+            vector_results = await self.vector_search.search_multi_query(
+                queries, self.vector_k, options=options
+            )
+            bm25_results = await lexical_search.search_multi_query(queries, self.bm25_k, options=options)
+            return vector_results, bm25_results
+        
+        # Bounds this call's fan-out (both retrievers, all variations)
+        semaphore = asyncio.Semaphore(settings.retrieval_concurrency)
+        vector_results, bm25_results = await asyncio.gather(
+            self._with_timeout(
+                "vector",
+                self.vector_search.search_multi_query(queries, self.vector_k, semaphore, options),
+                settings.vector_search_timeout_seconds,
+                deadline
+            ),
+            self._with_timeout(
+                "bm25",
+                lexical_search.search_multi_query(queries, self.bm25_k, semaphore, options),
+                settings.bm25_search_timeout_seconds,
+                deadline
+            )
+        )
+        return vector_results, bm25_results
+    
+    async def _with_timeout(
+        self,
+        retriever: str,
+        search: Awaitable[list[tuple[int, float]]],
+        timeout: float,
+        deadline: Optional[Deadline] = None
+    ) -> list[tuple[int, float]]:
+        if deadline:
+            timeout = deadline.budget(timeout)
+        try:
+            return await wait_for_stage(search, timeout)
+        except asyncio.TimeoutError:
+            print(f"⚠️ [HybridSearch] {retriever} search timed out after {timeout:.2f}s, skipping")
+            if deadline:
+                deadline.degrade(retriever, "timeout", f"{timeout:.2f}s, no results from this retriever")
+            return []
     
     def _reciprocal_rank_fusion(
         self,
-        vector_results: list[dict],
-        bm25_results: list[dict],
-        top_k: int
+        vector_candidates: list[tuple[int, float]],
+        bm25_candidates: list[tuple[int, float]],
+        top_k: int,
+        lexical_source: str = "bm25_vi"
     ) -> list[dict]:
         """
         Combine results using Reciprocal Rank Fusion (RRF)
@@ -85,32 +391,33 @@ class HybridSearch:
         
         This gives higher scores to documents that appear in both lists
         and/or at higher ranks.
+        
+        Works on (chunk id, score) candidates and returns id/score/RRF fields
+        only; hydrate_chunks adds the content of the final top_k.
         """
-        # Create document lookup by id
-        doc_lookup = {}
+        # Retriever score and source of each id (vector first)
+        best = {}
         rrf_scores = defaultdict(float)
         
         # Process vector results
         seen_ids_vector = set()
         rank = 1
-        for doc in vector_results:
-            doc_id = doc["id"]
+        for doc_id, score in vector_candidates:
             if doc_id not in seen_ids_vector:
                 seen_ids_vector.add(doc_id)
                 rrf_scores[doc_id] += 1 / (self.rrf_k + rank)
-                doc_lookup[doc_id] = doc
+                best[doc_id] = (score, "vector")
                 rank += 1
         
         # Process BM25 results
         seen_ids_bm25 = set()
         rank = 1
-        for doc in bm25_results:
-            doc_id = doc["id"]
+        for doc_id, score in bm25_candidates:
             if doc_id not in seen_ids_bm25:
                 seen_ids_bm25.add(doc_id)
                 rrf_scores[doc_id] += 1 / (self.rrf_k + rank)
-                if doc_id not in doc_lookup:
-                    doc_lookup[doc_id] = doc
+                if doc_id not in best:
+                    best[doc_id] = (score, lexical_source)
                 rank += 1
         
         # Sort by RRF score
@@ -119,11 +426,15 @@ class HybridSearch:
         # Build final results
         results = []
         for doc_id in sorted_ids[:top_k]:
-            doc = doc_lookup[doc_id].copy()
-            doc["rrf_score"] = rrf_scores[doc_id]
-            doc["in_vector"] = doc_id in seen_ids_vector
-            doc["in_bm25"] = doc_id in seen_ids_bm25
-            results.append(doc)
+            score, source = best[doc_id]
+            results.append({
+                "id": doc_id,
+                "score": score,
+                "source": source,
+                "rrf_score": rrf_scores[doc_id],
+                "in_vector": doc_id in seen_ids_vector,
+                "in_bm25": doc_id in seen_ids_bm25
+            })
         
         return results
 
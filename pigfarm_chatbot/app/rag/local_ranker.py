@@ -0,0 +1,43 @@
+from typing import Callable, Optional
+
+from app.rag.memory_bm25 import tokenize
+
+# Local ranker: (query, documents) -> one relevance score in [0, 1] per document.
+# Used by CohereReranker when the Cohere API fails or exceeds its latency budget.
+LocalRanker = Callable[[str, list[dict]], list[float]]
+
+# Syllable bigrams ("tiem_phong") count for more than single syllables
+BIGRAM_WEIGHT = 2.0
+
+
+def lexical_scores(query: str, documents: list[dict]) -> list[float]:
+    """
+    Weighted share of the query's terms (accent-insensitive syllables and
+    syllable bigrams, see memory_bm25.tokenize) found in each chunk. No network
+    and no model: scores 20 chunks in well under a millisecond.
+    """
+    query_terms = set(tokenize(query))
+    weights = {term: BIGRAM_WEIGHT if "_" in term else 1.0 for term in query_terms}
+    total = sum(weights.values())
+    if total == 0:
+        return [0.0 for _ in documents]
+
+    scores = []
+    for doc in documents:
+        doc_terms = set(tokenize(doc["content"]))
+        scores.append(sum(weight for term, weight in weights.items() if term in doc_terms) / total)
+    return scores
+
+
+LOCAL_RANKERS: dict[str, LocalRanker] = {
+    "lexical": lexical_scores,
+}
+
+
+def get_local_ranker(name: str) -> Optional[LocalRanker]:
+    """Local ranker by name; None for "none" / empty (no fallback)"""
+    if not name or name == "none":
+        return None
+    if name not in LOCAL_RANKERS:
+        raise ValueError(f"Unknown local ranker: {name}")
+    return LOCAL_RANKERS[name]
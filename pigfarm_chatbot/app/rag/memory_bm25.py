@@ -0,0 +1,378 @@
+from sqlalchemy import text
+from typing import Optional
+import asyncio
+import math
+import re
+import unicodedata
+
+import numpy as np
+
+from app.db.database import async_session_maker
+from app.rag import corpus
+from app.rag.search_options import SearchOptions
+from app.config import get_settings
+
+settings = get_settings()
+
+_COMBINING_MARKS = re.compile(r"[\u0300-\u036f]")
+_SYLLABLE = re.compile(r"\w+")
+
+# Rows fetched per query while loading the corpus
+LOAD_PAGE_SIZE = 5000
+# Compact the postings once this fraction of slots belongs to deleted chunks
+COMPACT_DEAD_FRACTION = 0.25
+
+
+def normalize_text(text: str) -> str:
+    """Lowercase and strip Vietnamese diacritics ("Tiêm phòng" -> "tiem phong")"""
+    text = _COMBINING_MARKS.sub("", unicodedata.normalize("NFD", text.lower()))
+    return text.replace("đ", "d")
+
+
+def tokenize(text: str) -> list[str]:
+    """
+    Vietnamese terms: normalized syllables plus adjacent-syllable bigrams.
+    Vietnamese words are mostly two syllables written apart ("tiêm phòng"),
+    so bigrams give word-level matches without a segmenter.
+    """
+    syllables = _SYLLABLE.findall(normalize_text(text))
+    bigrams = [f"{a}_{b}" for a, b in zip(syllables, syllables[1:])]
+    return syllables + bigrams
+
+
+class _Postings:
+    """
+    One immutable postings segment in CSR form: for terms[i] (sorted term ids),
+    slots[offsets[i]:offsets[i + 1]] are the slots containing it and freqs the
+    term frequencies there.
+    """
+
+    def __init__(self, term_ids: np.ndarray, slots: np.ndarray, freqs: np.ndarray):
+        # Input is sorted by (term id, slot)
+        self.terms, starts = np.unique(term_ids, return_index=True)
+        self.offsets = np.append(starts, len(term_ids)).astype(np.int64)
+        self.slots = slots.astype(np.int32)
+        self.freqs = freqs.astype(np.float32)
+
+    def __len__(self) -> int:
+        return len(self.slots)
+
+    @classmethod
+    def from_tokens(cls, term_ids: np.ndarray, slots: np.ndarray) -> "_Postings":
+        """Build from one (term id, slot) pair per token occurrence"""
+        keys, counts = np.unique((term_ids.astype(np.int64) << 32) | slots, return_counts=True)
+        return cls(keys >> 32, keys & 0xFFFFFFFF, counts)
+
+    def expanded_terms(self) -> np.ndarray:
+        return np.repeat(self.terms, np.diff(self.offsets))
+
+    def merge(self, other: "_Postings") -> "_Postings":
+        term_ids = np.concatenate([self.expanded_terms(), other.expanded_terms()])
+        slots = np.concatenate([self.slots, other.slots])
+        freqs = np.concatenate([self.freqs, other.freqs])
+        order = np.lexsort((slots, term_ids))
+        return _Postings(term_ids[order], slots[order], freqs[order])
+
+    def remap(self, keep_slot: np.ndarray, new_slot: np.ndarray) -> "_Postings":
+        """Drop postings of removed slots and renumber the rest (order is preserved)"""
+        keep = keep_slot[self.slots]
+        return _Postings(self.expanded_terms()[keep], new_slot[self.slots[keep]], self.freqs[keep])
+
+    def get(self, term_id: int) -> Optional[tuple[np.ndarray, np.ndarray]]:
+        i = np.searchsorted(self.terms, term_id)
+        if i == len(self.terms) or self.terms[i] != term_id:
+            return None
+        start, stop = self.offsets[i], self.offsets[i + 1]
+        return self.slots[start:stop], self.freqs[start:stop]
+
+
+class BM25Index:
+    """
+    In-memory BM25 inverted index over chunks.
+
+    Each chunk occupies a slot; terms are interned to integer ids and postings
+    live in a few CSR segments of numpy arrays. Every add creates a segment and
+    segments of similar size are merged, so adding stays cheap as the index grows.
+    Deleted chunks are tombstoned (excluded from scoring and document frequencies)
+    and squeezed out once they make up a large fraction.
+    Not thread-safe: mutate and search from one thread (the event loop).
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._vocabulary: dict[str, int] = {}
+        self._segments: list[_Postings] = []
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._lengths = np.zeros(0, dtype=np.float32)
+        self._alive = np.zeros(0, dtype=bool)
+        self._slots_by_document: dict[int, list[int]] = {}
+        self._num_alive = 0
+        self._total_length = 0.0
+        self._length_norm: Optional[np.ndarray] = None  # k1 * (1 - b + b * len / avg), per slot
+
+    def __len__(self) -> int:
+        return self._num_alive
+
+    def signature(self) -> tuple[int, int]:
+        """Same shape as corpus.corpus_signature(), for reconciling"""
+        alive_ids = self._ids[self._alive]
+        return self._num_alive, int(alive_ids.max()) if len(alive_ids) else 0
+
+    @staticmethod
+    def prepare(rows: list[dict]) -> list[tuple[dict, list[str]]]:
+        """Tokenize rows (pure; safe to run in a worker thread before add_prepared)"""
+        return [(row, tokenize(row["content"])) for row in rows]
+
+    def add(self, rows: list[dict]):
+        self.add_prepared(self.prepare(rows))
+
+    def add_prepared(self, prepared: list[tuple[dict, list[str]]]):
+        """Append chunks (rows with id, document_id, content); only ids and postings are kept"""
+        if not prepared:
+            return
+
+        start = len(self._ids)
+        vocabulary = self._vocabulary
+        term_ids = []
+        lengths = []
+        for offset, (row, tokens) in enumerate(prepared):
+            term_ids.extend(vocabulary.setdefault(token, len(vocabulary)) for token in tokens)
+            lengths.append(len(tokens))
+            self._slots_by_document.setdefault(row["document_id"], []).append(start + offset)
+
+        lengths = np.array(lengths, dtype=np.int64)
+        slots = np.repeat(np.arange(start, start + len(prepared), dtype=np.int64), lengths)
+        self._add_segment(_Postings.from_tokens(np.array(term_ids, dtype=np.int64), slots))
+
+        self._ids = np.concatenate([self._ids, np.array([row["id"] for row, _ in prepared], dtype=np.int64)])
+        self._lengths = np.concatenate([self._lengths, lengths.astype(np.float32)])
+        self._alive = np.concatenate([self._alive, np.ones(len(prepared), dtype=bool)])
+        self._num_alive += len(prepared)
+        self._total_length += float(lengths.sum())
+        self._length_norm = None
+
+    def _add_segment(self, segment: _Postings):
+        self._segments.append(segment)
+        # Merge while the newest segment is at least half the previous one: O(log n) segments
+        while len(self._segments) > 1 and 2 * len(self._segments[-1]) >= len(self._segments[-2]):
+            newer = self._segments.pop()
+            self._segments[-1] = self._segments[-1].merge(newer)
+
+    def remove_document(self, document_id: int) -> int:
+        """Tombstone all chunks of a document; returns the number removed"""
+        slots = self._slots_by_document.pop(document_id, [])
+        if not slots:
+            return 0
+
+        self._alive[slots] = False
+        self._num_alive -= len(slots)
+        self._total_length -= float(self._lengths[slots].sum())
+        self._length_norm = None
+
+        if len(self._ids) - self._num_alive > COMPACT_DEAD_FRACTION * len(self._ids):
+            self._compact()
+        return len(slots)
+
+    def _compact(self):
+        """Drop tombstoned slots and renumber the postings"""
+        alive = self._alive
+        new_slot = np.cumsum(alive, dtype=np.int64) - 1
+
+        segments = [segment.remap(alive, new_slot) for segment in self._segments]
+        self._segments = []
+        for segment in segments:
+            if len(segment):
+                self._add_segment(segment)
+
+        self._ids = self._ids[alive]
+        self._lengths = self._lengths[alive]
+        self._alive = np.ones(len(self._ids), dtype=bool)
+        self._slots_by_document = {
+            document_id: [int(new_slot[slot]) for slot in slots]
+            for document_id, slots in self._slots_by_document.items()
+        }
+
+    def search(self, query: str, top_k: int = 10) -> list[tuple[int, float]]:
+        """Top (chunk id, BM25 score), best first (only chunks sharing at least one term)"""
+        if self._num_alive == 0:
+            return []
+
+        n = self._num_alive
+        if self._length_norm is None:
+            avg_length = self._total_length / n
+            self._length_norm = self.k1 * (1 - self.b + self.b * self._lengths / avg_length)
+        scores = np.zeros(len(self._ids), dtype=np.float32)
+
+        for token in set(tokenize(query)):
+            term_id = self._vocabulary.get(token)
+            if term_id is None:
+                continue
+            postings = [p for p in (segment.get(term_id) for segment in self._segments) if p is not None]
+            df = sum(int(self._alive[slots].sum()) for slots, _ in postings)
+            if df == 0:
+                continue
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            for slots, freqs in postings:
+                # A slot appears once per term, so plain fancy-index += is safe
+                scores[slots] += idf * freqs * (self.k1 + 1) / (freqs + self._length_norm[slots])
+
+        scores[~self._alive] = 0
+        candidates = np.flatnonzero(scores)
+        if len(candidates) > top_k:
+            candidates = candidates[np.argpartition(-scores[candidates], top_k - 1)[:top_k]]
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+
+        return [(int(self._ids[slot]), float(scores[slot])) for slot in candidates]
+
+
+class MemoryBM25Search:
+    """
+    Lexical retriever backed by an in-process BM25Index (no database round trip).
+
+    Loaded from chat_documents at startup and kept current by corpus events
+    (upload / update / delete in this process, applied by a background task so
+    the notifying request never waits on it) plus a periodic reconcile that
+    rebuilds the index if the database changed behind its back.
+    Until the first load finishes, `ready` is False and callers use BM25Search.
+    Only ids and postings are held in memory; content is fetched for final results.
+    """
+
+    # Source label of hydrated results
+    source = "bm25_memory"
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._index: Optional[BM25Index] = None
+        # Serializes reloads and incremental updates (searches never wait on it)
+        self._lock = asyncio.Lock()
+        self._tasks: list[asyncio.Task] = []
+        # Corpus events not applied yet: document id -> latest event
+        self._pending: dict[int, str] = {}
+        self._apply_task: Optional[asyncio.Task] = None
+
+    @property
+    def ready(self) -> bool:
+        return self._index is not None
+
+    async def start(self):
+        corpus.add_listener(self._on_corpus_event)
+        self._tasks = [asyncio.create_task(self._reconcile())]
+
+    async def stop(self):
+        corpus.remove_listener(self._on_corpus_event)
+        tasks = self._tasks + ([self._apply_task] if self._apply_task is not None else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = []
+        self._apply_task = None
+        self._pending.clear()
+
+    def search(self, query: str, top_k: int = 10) -> list[tuple[int, float]]:
+        return self._index.search(query, top_k) if self._index is not None else []
+
+    async def search_multi_query(
+        self,
+        queries: list[str],
+        top_k_per_query: int = 10,
+        semaphore: Optional[asyncio.Semaphore] = None,
+        options: Optional[SearchOptions] = None
+    ) -> list[tuple[int, float]]:
+        """
+        Same contract as BM25Search.search_multi_query; scoring is in-process, so no
+        semaphore is needed. Filtered searches are not supported (HybridSearch routes
+        them to BM25Search).
+        """
+        if options is not None and options.has_filters:
+            raise ValueError("MemoryBM25Search does not support filters")
+        return [candidate for query in queries for candidate in self.search(query, top_k_per_query)]
+
+    async def reload(self):
+        """Rebuild the whole index from chat_documents and swap it in"""
+        async with self._lock:
+            rows = await self._fetch_rows()
+            index = BM25Index(self.k1, self.b)
+            await asyncio.to_thread(index.add, rows)
+            self._index = index
+        print(f"✅ [MemoryBM25] Indexed {len(index)} chunks")
+
+    async def _on_corpus_event(self, event: str, document_id: int):
+        if self._index is None:
+            # Not loaded yet; the initial load will include this change
+            return
+
+        # Repeated events of a document coalesce: applying re-reads its current chunks
+        self._pending.pop(document_id, None)
+        self._pending[document_id] = event
+        if self._apply_task is None or self._apply_task.done():
+            self._apply_task = asyncio.create_task(self._apply_pending())
+
+    async def _apply_pending(self):
+        """Apply queued corpus events in arrival order"""
+        while self._pending:
+            document_id = next(iter(self._pending))
+            event = self._pending.pop(document_id)
+            try:
+                await self._apply_event(event, document_id)
+            except Exception as e:
+                # The periodic reconcile rebuilds the index
+                print(f"⚠️ [MemoryBM25] Update of document {document_id} failed: {e!r}")
+
+    async def _apply_event(self, event: str, document_id: int):
+        async with self._lock:
+            if self._index is None:
+                return
+            rows = []
+            if event == corpus.DOCUMENT_CHANGED:
+                rows = await self._fetch_rows(document_id)
+            prepared = await asyncio.to_thread(BM25Index.prepare, rows)
+            # Remove and re-add without awaiting in between, so searches never see half a document
+            self._index.remove_document(document_id)
+            self._index.add_prepared(prepared)
+
+    async def _reconcile(self):
+        while True:
+            try:
+                if self._index is None or self._index.signature() != await corpus.corpus_signature():
+                    await self.reload()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️ [MemoryBM25] Reload failed: {e!r}")
+            await asyncio.sleep(settings.corpus_reconcile_interval_seconds)
+
+    async def _fetch_rows(self, document_id: Optional[int] = None) -> list[dict]:
+        """Chunk rows in id order, paged by keyset; all chunks or those of one document"""
+        rows = []
+        last_id = 0
+        async with async_session_maker() as session:
+            while True:
+                result = await session.execute(
+                    text("""
+                        SELECT id, document_id, content
+                        FROM chat_documents
+                        WHERE id > :last_id
+                          AND (CAST(:document_id AS INTEGER) IS NULL OR document_id = :document_id)
+                        ORDER BY id
+                        LIMIT :limit
+                    """),
+                    {"last_id": last_id, "document_id": document_id, "limit": LOAD_PAGE_SIZE}
+                )
+                page = [dict(row._mapping) for row in result.fetchall()]
+                rows.extend(page)
+                if len(page) < LOAD_PAGE_SIZE:
+                    return rows
+                last_id = page[-1]["id"]
+
+
+# Singleton
+_memory_bm25: Optional[MemoryBM25Search] = None
+
+
+def get_memory_bm25() -> MemoryBM25Search:
+    global _memory_bm25
+    if _memory_bm25 is None:
+        _memory_bm25 = MemoryBM25Search(k1=settings.bm25_k1, b=settings.bm25_b)
+    return _memory_bm25
@@ -0,0 +1,253 @@
+from sqlalchemy import text
+from typing import Optional
+from pathlib import Path
+import asyncio
+import os
+
+import numpy as np
+
+from app.db.database import async_session_maker
+from app.rag import corpus
+from app.config import get_settings
+
+settings = get_settings()
+
+EMBEDDING_DIM = 1536
+# Rows fetched per query while building a snapshot
+LOAD_PAGE_SIZE = 2000
+# float16 snapshots are scored in blocks converted to float32 (NumPy has no float16 BLAS)
+SCORE_BLOCK_ROWS = 8192
+SNAPSHOT_DTYPES = ("float32", "float16")
+# Snapshot versions kept on disk (current included), so processes that read the
+# previous signature can still open its files
+SNAPSHOT_GENERATIONS = 2
+
+
+class MemoryVectorIndex:
+    """
+    Exact cosine search over an in-memory matrix of all chunk embeddings.
+
+    Vectors are L2-normalized rows of one contiguous matrix, so a query (or a
+    batch of queries) is scored with a single matrix product and the top k are
+    picked with argpartition. The matrix is a snapshot file memory-mapped
+    read-only: gunicorn workers map the same file and share one copy through the
+    page cache. Snapshots are named after corpus.corpus_signature(), so the
+    first process to see a new corpus version writes it and the others reuse it.
+
+    Upload/delete events in this process mark the index stale and schedule a
+    rebuild in the background (repeated events coalesce into one more reload);
+    other processes pick up the new version on their periodic reconcile.
+    While the index is stale or loading, `ready` is False and callers use pgvector.
+    """
+
+    def __init__(self, snapshot_dir: str, dtype: str = "float32"):
+        if dtype not in SNAPSHOT_DTYPES:
+            raise ValueError(f"Unknown vector snapshot dtype: {dtype}")
+        self.snapshot_dir = Path(snapshot_dir)
+        self.dtype = dtype
+        self._ids: Optional[np.ndarray] = None
+        self._vectors: Optional[np.ndarray] = None
+        self._signature: Optional[tuple[int, int]] = None
+        self._stale = False
+        # Serializes reloads (searches never wait on it)
+        self._lock = asyncio.Lock()
+        self._tasks: list[asyncio.Task] = []
+        self._reload_task: Optional[asyncio.Task] = None
+        self._reload_requested = False
+
+    @property
+    def ready(self) -> bool:
+        return self._vectors is not None and not self._stale
+
+    def __len__(self) -> int:
+        return 0 if self._ids is None else len(self._ids)
+
+    async def start(self):
+        corpus.add_listener(self._on_corpus_event)
+        self._tasks = [asyncio.create_task(self._reconcile())]
+
+    async def stop(self):
+        corpus.remove_listener(self._on_corpus_event)
+        tasks = self._tasks + ([self._reload_task] if self._reload_task is not None else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = []
+        self._reload_task = None
+
+    def search_batch(self, query_embeddings: list, top_k: int = 10) -> list[list[tuple[int, float]]]:
+        """
+        Exact top-k (chunk id, cosine similarity) per query embedding, best first,
+        from one matrix product for the whole batch
+        """
+        ids, vectors = self._ids, self._vectors
+        if vectors is None or len(ids) == 0 or len(query_embeddings) == 0:
+            return [[] for _ in query_embeddings]
+
+        queries = np.asarray(query_embeddings, dtype=np.float32).reshape(-1, EMBEDDING_DIM)
+        queries /= np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+
+        if vectors.dtype == np.float32:
+            scores = vectors @ queries.T
+        else:
+            scores = np.empty((len(vectors), len(queries)), dtype=np.float32)
+            for start in range(0, len(vectors), SCORE_BLOCK_ROWS):
+                block = vectors[start:start + SCORE_BLOCK_ROWS].astype(np.float32)
+                scores[start:start + SCORE_BLOCK_ROWS] = block @ queries.T
+
+        k = min(top_k, len(ids))
+        results = []
+        for column in scores.T:
+            top = np.argpartition(-column, k - 1)[:k] if k < len(column) else np.arange(len(column))
+            top = top[np.argsort(-column[top], kind="stable")]
+            results.append([(int(ids[i]), float(column[i])) for i in top])
+        return results
+
+    async def search(self, query_embeddings: list, top_k: int = 10) -> list[list[tuple[int, float]]]:
+        """search_batch off the event loop (the matrix product releases the GIL)"""
+        return await asyncio.to_thread(self.search_batch, query_embeddings, top_k)
+
+    async def reload(self):
+        """Map the snapshot of the current corpus version, building it first if needed"""
+        async with self._lock:
+            signature = await corpus.corpus_signature()
+            if not self._snapshot_path(signature, "vectors").exists():
+                signature = await self._build_snapshot()
+            try:
+                self._ids, self._vectors = await asyncio.to_thread(self._open_snapshot, signature)
+            except FileNotFoundError:
+                # Pruned by a process that wrote newer versions meanwhile: build the current one
+                signature = await self._build_snapshot()
+                self._ids, self._vectors = await asyncio.to_thread(self._open_snapshot, signature)
+            self._signature = signature
+            # Still stale if a corpus event arrived meanwhile (its reload is scheduled)
+            self._stale = self._reload_requested
+        print(f"✅ [MemoryVector] Loaded {len(self)} vectors ({self.dtype})")
+
+    async def _on_corpus_event(self, event: str, document_id: int):
+        if self._vectors is None:
+            # Not loaded yet; the initial load will include this change
+            return
+        # Fall back to pgvector until the new snapshot is mapped; the caller does not wait for it
+        self._stale = True
+        self._reload_requested = True
+        if self._reload_task is None or self._reload_task.done():
+            self._reload_task = asyncio.create_task(self._reload_requested_versions())
+
+    async def _reload_requested_versions(self):
+        # Events during a reload may not be in the snapshot it maps: reload once more for all of them
+        while self._reload_requested:
+            self._reload_requested = False
+            try:
+                await self.reload()
+            except Exception as e:
+                # Stays stale; the periodic reconcile retries
+                print(f"⚠️ [MemoryVector] Reload failed: {e!r}")
+
+    async def _reconcile(self):
+        while True:
+            try:
+                if (
+                    self._vectors is None
+                    or self._stale
+                    or self._signature != await corpus.corpus_signature()
+                ):
+                    await self.reload()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️ [MemoryVector] Reload failed: {e!r}")
+            await asyncio.sleep(settings.corpus_reconcile_interval_seconds)
+
+    async def _build_snapshot(self) -> tuple[int, int]:
+        """Write a snapshot of all embeddings; returns the corpus signature it reflects"""
+        ids = []
+        pages = []
+        last_id = 0
+        async with async_session_maker() as session:
+            # One snapshot for all pages and the signature, so they describe the same corpus
+            await session.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+            signature = await corpus.corpus_signature(session)
+            while True:
+                result = await session.execute(
+                    text("""
+                        SELECT id, embedding
+                        FROM chat_documents
+                        WHERE id > :last_id AND embedding IS NOT NULL
+                        ORDER BY id
+                        LIMIT :limit
+                    """),
+                    {"last_id": last_id, "limit": LOAD_PAGE_SIZE}
+                )
+                rows = result.fetchall()
+                if rows:
+                    ids.extend(row.id for row in rows)
+                    pages.append(np.asarray([row.embedding for row in rows], dtype=np.float32))
+                    last_id = rows[-1].id
+                if len(rows) < LOAD_PAGE_SIZE:
+                    break
+
+        await asyncio.to_thread(self._write_snapshot, signature, ids, pages)
+        return signature
+
+    def _snapshot_path(self, signature: tuple[int, int], kind: str) -> Path:
+        chunks, max_id = signature
+        return self.snapshot_dir / f"{chunks}-{max_id}-{self.dtype}.{kind}.npy"
+
+    def _write_snapshot(self, signature: tuple[int, int], ids: list[int], pages: list[np.ndarray]):
+        vectors = np.concatenate(pages) if pages else np.zeros((0, EMBEDDING_DIM), dtype=np.float32)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+        self.snapshot_dir.mkdir(parents=True, exist_ok=True)
+        # ids first, vectors last: the vectors file marks a complete snapshot.
+        # Each file is written under a temporary name and renamed, so readers never see a partial file.
+        for kind, array in (("ids", np.asarray(ids, dtype=np.int64)), ("vectors", vectors.astype(self.dtype))):
+            path = self._snapshot_path(signature, kind)
+            tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+            with open(tmp_path, "wb") as f:
+                np.save(f, array)
+            os.replace(tmp_path, path)
+
+        self._prune_snapshots(signature)
+
+    def _prune_snapshots(self, signature: tuple[int, int]):
+        """
+        Delete all but the SNAPSHOT_GENERATIONS most recently written versions
+        (always keeping `signature`). Processes still mapping a deleted version
+        keep their pages until they reload.
+        """
+        current = self._snapshot_path(signature, "vectors").name.split(".")[0]
+        versions: dict[str, list[Path]] = {}
+        for path in self.snapshot_dir.glob(f"*-{self.dtype}.*.npy"):
+            versions.setdefault(path.name.split(".")[0], []).append(path)
+
+        def _written_at(version: str) -> float:
+            try:
+                return max(path.stat().st_mtime_ns for path in versions[version])
+            except FileNotFoundError:
+                return 0
+
+        older = sorted((v for v in versions if v != current), key=_written_at, reverse=True)
+        for version in older[SNAPSHOT_GENERATIONS - 1:]:
+            for path in versions[version]:
+                path.unlink(missing_ok=True)
+
+    def _open_snapshot(self, signature: tuple[int, int]) -> tuple[np.ndarray, np.ndarray]:
+        ids = np.load(self._snapshot_path(signature, "ids"))
+        # An empty array cannot be memory-mapped
+        vectors = np.load(self._snapshot_path(signature, "vectors"), mmap_mode="r" if len(ids) else None)
+        return ids, vectors
+
+
+# Singleton
+_memory_vector_index: Optional[MemoryVectorIndex] = None
+
+
+def get_memory_vector_index() -> MemoryVectorIndex:
+    global _memory_vector_index
+    if _memory_vector_index is None:
+        _memory_vector_index = MemoryVectorIndex(
+            snapshot_dir=settings.vector_snapshot_dir,
+            dtype=settings.vector_snapshot_dtype
+        )
+    return _memory_vector_index
@@ -0,0 +1,56 @@
+from collections import deque
+from typing import Optional
+import threading
+
+# Latency samples kept per outcome for percentiles
+WINDOW_SIZE = 1000
+
+
+class OutcomeStats:
+    """
+    In-process counters and latencies of a pipeline stage, per outcome
+    (e.g. a rewrite served by the LLM, the cache, or skipped). Percentiles
+    are over the most recent WINDOW_SIZE samples of each outcome.
+    """
+
+    def __init__(self, outcomes: Optional[list[str]] = None):
+        self._lock = threading.Lock()
+        self._counts: dict[str, int] = {}
+        self._total_seconds: dict[str, float] = {}
+        self._samples: dict[str, deque] = {}
+        for outcome in outcomes or []:
+            self._ensure(outcome)
+
+    def _ensure(self, outcome: str):
+        if outcome not in self._counts:
+            self._counts[outcome] = 0
+            self._total_seconds[outcome] = 0.0
+            self._samples[outcome] = deque(maxlen=WINDOW_SIZE)
+
+    def record(self, outcome: str, seconds: float):
+        with self._lock:
+            self._ensure(outcome)
+            self._counts[outcome] += 1
+            self._total_seconds[outcome] += seconds
+            self._samples[outcome].append(seconds)
+
+    def count(self, outcome: str) -> int:
+        return self._counts.get(outcome, 0)
+
+    def mean_seconds(self, outcome: str) -> float:
+        count = self.count(outcome)
+        return self._total_seconds[outcome] / count if count else 0.0
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = sum(self._counts.values())
+            report = {"total": total}
+            for outcome, count in self._counts.items():
+                samples = sorted(self._samples[outcome])
+                report[outcome] = {
+                    "count": count,
+                    "share": count / total if total else 0.0,
+                    "mean_ms": 1000 * self._total_seconds[outcome] / count if count else 0.0,
+                    "p95_ms": 1000 * samples[int(0.95 * (len(samples) - 1))] if samples else 0.0
+                }
+            return report
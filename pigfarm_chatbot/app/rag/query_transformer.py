@@ -1,17 +1,119 @@
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.prompts import ChatPromptTemplate
 from typing import Optional
+import asyncio
+import json
+import re
+import time
 
+from app.rag.cache import LRUTTLCache, normalize_query
+from app.rag.metrics import OutcomeStats
+from app.rag.deadline import Deadline, wait_for_stage, log_background_failure
 from app.config import get_settings
 
 settings = get_settings()
 
+# How transform() obtained the rewrite
+REWRITE_LLM = "llm"
+REWRITE_CACHED = "cached"
+REWRITE_SKIPPED = "skipped"
+REWRITE_DEADLINE = "deadline"  # not enough request time left, or the LLM overran its budget
+
+# Question words and colloquial phrasing: the rewrite turns these into searchable terms
+REWRITE_MARKERS = (
+    "gì", "sao", "nào", "bao giờ", "bao nhiêu", "thế nào", "ra sao", "có nên", "được không",
+    "không", "bị", "làm", "hả", "nhỉ", "ạ", "à", "vậy", "ko", "k"
+)
+# Acronyms and codes (PRRS, ASF, PCV2, 3/3/3) and quoted phrases are exact lookups
+EXACT_TERM_PATTERN = re.compile(r"\b[A-Z][A-Z0-9]{1,}\b|\d+/\d+|[\"“”]")
+
+
+def _message_text(content) -> str:
+    """Text of an LLM message content (a string, or a list of content blocks)"""
+    if isinstance(content, str):
+        return content
+    return "".join(
+        block if isinstance(block, str) else str(block.get("text", ""))
+        for block in content
+        if isinstance(block, (str, dict))
+    )
+
+
+def parse_expansion(text: str, query: str, n: int) -> tuple[str, list[str]]:
+    """
+    (rewritten, variations) from the combined rewrite call's output, parsed defensively:
+    JSON (possibly inside a code fence or surrounding text), else one query per line
+    with the rewrite first. Missing or empty fields fall back to the original query.
+    """
+    text = re.sub(r"^```(?:json)?\s*|\s*```$", "", text.strip())
+    rewritten, variations = "", []
+
+    try:
+        data = json.loads(text)
+    except ValueError:
+        # JSON object surrounded by other text
+        match = re.search(r"\{.*\}", text, re.DOTALL)
+        try:
+            data = json.loads(match.group(0)) if match else None
+        except ValueError:
+            data = None
+
+    if isinstance(data, dict):
+        if isinstance(data.get("rewritten"), str):
+            rewritten = data["rewritten"]
+        raw_variations = data.get("variations")
+        if isinstance(raw_variations, str):
+            raw_variations = raw_variations.split("\n")
+        if isinstance(raw_variations, list):
+            variations = [v for v in raw_variations if isinstance(v, str)]
+    elif isinstance(data, list):
+        items = [item for item in data if isinstance(item, str)]
+        if items:
+            rewritten, variations = items[0], items[1:]
+    elif data is None and not text.startswith(("{", "[")):
+        # Plain lines; drop numbering, bullets and quotes
+        lines = [re.sub(r"^\s*(?:[-*•]|\d+[.)])\s*", "", line).strip().strip('"') for line in text.split("\n")]
+        lines = [line for line in lines if line]
+        if lines:
+            rewritten, variations = lines[0], lines[1:]
+
+    rewritten = rewritten.strip() or query
+    variations = [v.strip() for v in variations if v.strip()][:n]
+    return rewritten, variations
+
+
+def rewrite_skip_reason(query: str) -> Optional[str]:
+    """
+    Why rewriting `query` is unlikely to help (None if it should be rewritten):
+    long queries are already specific; without question or colloquial words,
+    queries with exact terms (which a rewrite could drop) and short keyword
+    queries are searched as-is.
+    """
+    words = re.findall(r"\w+", normalize_query(query))
+    if len(words) > settings.rewrite_skip_min_long_words:
+        return "long"
+
+    padded = f" {' '.join(words)} "
+    if any(f" {marker} " in padded for marker in REWRITE_MARKERS):
+        return None
+    if EXACT_TERM_PATTERN.search(query):
+        return "exact_terms"
+    if len(words) <= settings.rewrite_skip_max_keyword_words:
+        return "keywords"
+    return None
+
 
 class QueryTransformer:
     """
     Transform user queries for better retrieval:
     1. Query Rewriting - Make queries clearer and more specific
     2. Multi-Query Generation - Generate multiple query variations
+    
+    With query_variations > 0 both come from one JSON-mode LLM call
+    (expand_query); otherwise only the rewrite is generated.
+    Rewrites (with their variations) are cached by normalized query, and skipped when
+    rewrite_skip_reason() says they are unlikely to help; `stats()` reports
+    how each transform was served and its latency.
     """
     
     def __init__(self):
@@ -21,6 +123,14 @@ class QueryTransformer:
             temperature=0.3,
             streaming=False  # IMPORTANT: Disable streaming to avoid polluting Agent's event stream
         )
+        # Same model in JSON mode, for the combined rewrite + variations call
+        self.json_llm = ChatGoogleGenerativeAI(
+            model=settings.gemini_model,
+            google_api_key=settings.google_api_key,
+            temperature=0.3,
+            streaming=False,
+            response_mime_type="application/json"
+        )
         
         # Query rewriting prompt
         self.rewrite_prompt = ChatPromptTemplate.from_messages([
@@ -60,6 +170,29 @@ Các bệnh phổ biến gây sốt ở heo thịt
 """),
             ("human", "Câu hỏi gốc: {query}\n\n3 biến thể:")
         ])
+        
+        # Combined rewrite + multi-query prompt (one call, JSON output)
+        self.expand_prompt = ChatPromptTemplate.from_messages([
+            ("system", """Bạn là một chuyên gia viết lại câu hỏi để tìm kiếm tài liệu chăn nuôi heo.
+
+Nhiệm vụ:
+1. Viết lại câu hỏi của người dùng thành một câu hỏi rõ ràng, cụ thể hơn, giữ nguyên ý nghĩa gốc, thêm từ khóa chuyên ngành nếu cần.
+2. Tạo {n} biến thể câu hỏi khác nhau, mỗi biến thể tiếp cận vấn đề từ một góc độ khác.
+
+Chỉ trả về JSON theo đúng dạng:
+{{"rewritten": "câu hỏi viết lại", "variations": ["biến thể 1", "biến thể 2"]}}
+
+Ví dụ với câu hỏi "Heo bị sốt cao":
+{{"rewritten": "Nguyên nhân, triệu chứng và cách điều trị heo bị sốt cao", "variations": ["Cách hạ sốt và điều trị heo bị sốt", "Các bệnh phổ biến gây sốt ở heo thịt", "Cách nhận biết heo bị sốt cao"]}}
+"""),
+            ("human", "Câu hỏi gốc: {query}")
+        ])
+        
+        self.rewrite_cache = LRUTTLCache(
+            max_size=settings.rewrite_cache_size,
+            ttl_seconds=settings.rewrite_cache_ttl_seconds
+        )
+        self.metrics = OutcomeStats([REWRITE_LLM, REWRITE_CACHED, REWRITE_SKIPPED, REWRITE_DEADLINE])
     
     async def rewrite_query(self, query: str) -> str:
         """Rewrite query to be clearer and more specific"""
@@ -78,27 +211,102 @@ Các bệnh phổ biến gây sốt ở heo thịt
         # Include original query
         return [query] + queries[:3]  # Original + 3 variations
     
-    async def transform(self, query: str) -> dict:
+    async def expand_query(self, query: str) -> tuple[str, list[str]]:
+        """Rewrite and `query_variations` variations in one LLM call"""
+        chain = self.expand_prompt | self.json_llm
+        result = await chain.ainvoke({"query": query, "n": settings.query_variations})
+        return parse_expansion(_message_text(result.content), query, settings.query_variations)
+    
+    async def transform(self, query: str, deadline: Optional[Deadline] = None) -> dict:
         """
         Full query transformation pipeline:
-        1. Rewrite the query
-        2. Skip Multi-query (Disabled)
+        1. Rewrite the query (skipped, or served from the rewrite cache, when possible)
+        2. Multi-query variations, from the same LLM call as the rewrite
+        
+        With a `deadline`, the LLM call gets the rewrite budget minus the time kept
+        for retrieval; if that is too short, or the call overruns it, the original
+        query is used alone (a late rewrite still fills the cache).
         """
-        rewritten = await self.rewrite_query(query)
-        print(f"\n[RAG] Query Rewrite: '{query}' -> '{rewritten}'")
-        # multi_queries = await self.generate_multi_queries(rewritten) # Disabled
+        started = time.perf_counter()
+        rewritten, extra_variations, source = await self.rewrite_or_skip(query, deadline)
+        self.metrics.record(source, time.perf_counter() - started)
+        if source in (REWRITE_SKIPPED, REWRITE_DEADLINE):
+            print(f"\n[RAG] Query Rewrite skipped: '{query}'")
+        else:
+            print(f"\n[RAG] Query Rewrite ({source}): '{query}' -> '{rewritten}' (+{len(extra_variations)} variations)")
         
-        # Variations now only include original and rewritten query
-        # This reduces LLM calls by 1 (only 1 call for rewrite)
-        variations = [query]
-        if rewritten != query:
-            variations.append(rewritten)
+        # Original first, then the rewrite and variations (without repeats)
+        variations = []
+        seen = set()
+        for variation in [query, rewritten, *extra_variations]:
+            key = normalize_query(variation)
+            if key and key not in seen:
+                seen.add(key)
+                variations.append(variation)
         
         return {
             "original": query,
             "rewritten": rewritten,
+            "rewrite_source": source,
             "variations": variations
         }
+    
+    def needs_llm(self, query: str) -> bool:
+        """Whether transform() would call the LLM (rewrite neither skipped nor cached)"""
+        if settings.rewrite_skip_enabled and rewrite_skip_reason(query) is not None:
+            return False
+        return normalize_query(query) not in self.rewrite_cache
+    
+    async def rewrite_or_skip(
+        self,
+        query: str,
+        deadline: Optional[Deadline] = None
+    ) -> tuple[str, list[str], str]:
+        """(rewritten query, extra variations, REWRITE_LLM | REWRITE_CACHED | REWRITE_SKIPPED | REWRITE_DEADLINE)"""
+        if settings.rewrite_skip_enabled and rewrite_skip_reason(query) is not None:
+            return query, [], REWRITE_SKIPPED
+        
+        key = normalize_query(query)
+        cached = self.rewrite_cache.get(key)
+        if cached is not None:
+            rewritten, extra_variations = cached
+            return rewritten, list(extra_variations), REWRITE_CACHED
+        
+        if deadline is None:
+            rewritten, extra_variations = await self._generate(query, key)
+            return rewritten, extra_variations, REWRITE_LLM
+        
+        budget = deadline.budget(settings.rewrite_deadline_seconds, reserve=settings.rag_retrieval_reserve_seconds)
+        if budget < settings.rag_min_stage_seconds:
+            deadline.degrade("rewrite", "skipped", f"{deadline.remaining():.2f}s left")
+            return query, [], REWRITE_DEADLINE
+        
+        task = asyncio.create_task(self._generate(query, key))
+        try:
+            rewritten, extra_variations = await wait_for_stage(asyncio.shield(task), budget)
+        except asyncio.TimeoutError:
+            # Keeps running in the background and fills the cache
+            task.add_done_callback(log_background_failure)
+            deadline.degrade("rewrite", "timeout", f"{budget:.2f}s, original query only")
+            return query, [], REWRITE_DEADLINE
+        return rewritten, extra_variations, REWRITE_LLM
+    
+    async def _generate(self, query: str, key: str) -> tuple[str, list[str]]:
+        """LLM rewrite (+ variations), stored in the rewrite cache under `key`"""
+        if settings.query_variations > 0:
+            rewritten, extra_variations = await self.expand_query(query)
+        else:
+            rewritten, extra_variations = await self.rewrite_query(query), []
+        self.rewrite_cache.set(key, (rewritten, tuple(extra_variations)))
+        return rewritten, extra_variations
+    
+    def stats(self) -> dict:
+        """Rewrite outcomes with latency, the rewrite cache, and the estimated time saved"""
+        report = self.metrics.stats()
+        avoided = self.metrics.count(REWRITE_CACHED) + self.metrics.count(REWRITE_SKIPPED)
+        report["estimated_saved_ms"] = 1000 * avoided * self.metrics.mean_seconds(REWRITE_LLM)
+        report["cache"] = self.rewrite_cache.stats()
+        return report
 
 
 # Singleton
@@ -0,0 +1,72 @@
+from dataclasses import dataclass
+
+from app.config import get_settings
+
+settings = get_settings()
+
+
+@dataclass(frozen=True)
+class RerankPlan:
+    """How many fused candidates to send to the reranker, or skip it entirely"""
+    candidates: int
+    skip: bool
+    reason: str
+
+
+def _agree(doc: dict) -> bool:
+    """Both retrievers found the document"""
+    return bool(doc.get("in_vector")) and bool(doc.get("in_bm25"))
+
+
+def plan_rerank(
+    results: list[dict],
+    top_k: int = 5,
+    max_candidates: int = 20
+) -> RerankPlan:
+    """
+    Adaptive rerank budget from the fused (RRF) results, best first.
+
+    The reranker can only promote what it is sent, so the budget is the top_k
+    plus every candidate still competitive with the top_k boundary: RRF score at
+    least `rerank_budget_ratio` x the boundary score. RRF rewards agreement, so a
+    document found by both retrievers scores about twice one found by one; when
+    the head is made of agreed documents, single-retriever candidates fall out
+    of the budget.
+
+    Reranking is skipped when the top_k are all agreed documents and the next
+    candidate scores below `rerank_skip_margin` x the boundary score.
+    """
+    results = results[:max_candidates]
+    if settings.rerank_policy != "adaptive" or not results:
+        return RerankPlan(candidates=len(results), skip=False, reason="all")
+
+    head = results[:top_k]
+    boundary = head[-1]["rrf_score"]
+    next_score = results[len(head)]["rrf_score"] if len(results) > len(head) else 0.0
+
+    if settings.rerank_skip_enabled and all(_agree(doc) for doc in head) and (
+        next_score < settings.rerank_skip_margin * boundary
+    ):
+        return RerankPlan(candidates=0, skip=True, reason="unambiguous")
+
+    candidates = len(head) + sum(
+        1 for doc in results[len(head):]
+        if doc["rrf_score"] >= settings.rerank_budget_ratio * boundary
+    )
+    reason = "budget" if candidates < len(results) else "all"
+    return RerankPlan(candidates=candidates, skip=False, reason=reason)
+
+
+def without_rerank(results: list[dict], top_k: int, rrf_k: int) -> list[dict]:
+    """
+    The fused top_k as rerank output when reranking is skipped. rerank_score is
+    the RRF score relative to its maximum (rank 1 in both retrievers), in [0, 1].
+    """
+    max_score = 2 / (rrf_k + 1)
+    skipped = []
+    for doc in results[:top_k]:
+        doc = doc.copy()
+        doc["rerank_score"] = min(1.0, doc["rrf_score"] / max_score)
+        doc["rerank_source"] = "skipped"
+        skipped.append(doc)
+    return skipped
@@ -1,27 +1,53 @@
 import cohere
 from typing import Optional
+import time
 
+from app.rag import corpus
+from app.rag.cache import LRUTTLCache, normalize_query
+from app.rag.local_ranker import LocalRanker, get_local_ranker
+from app.rag.metrics import OutcomeStats
+from app.rag.deadline import Deadline, wait_for_stage
 from app.config import get_settings
 
 settings = get_settings()
 
+# How rerank() scored the documents of a call
+RERANK_CACHED = "cached"  # every pair was in the score cache
+RERANK_COHERE = "cohere"  # unseen pairs scored by Cohere
+RERANK_FALLBACK = "fallback"  # Cohere failed or timed out; every document scored locally
+
 
 class CohereReranker:
     """
     Cross-encoder reranking using Cohere's rerank API
     Filters and reorders search results for better relevance
+    
+    Relevance scores are cached per (normalized query, chunk id, corpus version),
+    so only unseen pairs are sent to Cohere. If Cohere fails or exceeds
+    `rerank_timeout_seconds`, the `fallback` local ranker scores every document
+    of the call, cached ones included: its scores are on a different scale and
+    are never mixed with Cohere's (nor cached). rerank_with_threshold applies
+    `rerank_fallback_threshold` to them.
     """
     
-    def __init__(self, top_k: int = 5):
+    def __init__(self, top_k: int = 5, fallback: Optional[LocalRanker] = None):
         self.client = cohere.AsyncClient(api_key=settings.cohere_api_key)
         self.top_k = top_k
         self.model = "rerank-multilingual-v3.0"  # Supports Vietnamese
+        self.fallback = fallback
+        self.score_cache = LRUTTLCache(
+            max_size=settings.rerank_cache_size,
+            ttl_seconds=settings.rerank_cache_ttl_seconds
+        )
+        self.metrics = OutcomeStats([RERANK_CACHED, RERANK_COHERE, RERANK_FALLBACK])
     
     async def rerank(
         self,
         query: str,
         documents: list[dict],
-        top_k: Optional[int] = None
+        top_k: Optional[int] = None,
+        corpus_version: Optional[int] = None,
+        deadline: Optional[Deadline] = None
     ) -> list[dict]:
         """
         Rerank documents using Cohere's cross-encoder model
@@ -30,6 +56,8 @@ class CohereReranker:
             query: Original search query
             documents: List of documents from hybrid search
             top_k: Number of top results to return
+            corpus_version: Version the documents were retrieved at (read if None)
+            deadline: Request deadline; caps the Cohere timeout, fallbacks are recorded on it
         
         Returns:
             Reranked documents with relevance scores
@@ -38,34 +66,87 @@ class CohereReranker:
             return []
         
         k = top_k or self.top_k
+        started = time.perf_counter()
+        
+        if corpus_version is None:
+            corpus_version = await corpus.corpus_version()
+        query_key = normalize_query(query)
         
-        # Extract content for reranking
-        doc_texts = [doc["content"] for doc in documents]
+        # Cached pairs first; only unseen pairs go to the API
+        scores: dict[int, float] = {}
+        for i, doc in enumerate(documents):
+            cached = self.score_cache.get((query_key, doc["id"], corpus_version))
+            if cached is not None:
+                scores[i] = cached
+        missing = [i for i in range(len(documents)) if i not in scores]
+        
+        unseen = set(missing)
+        outcome = RERANK_CACHED
+        if missing:
+            missing_docs = [documents[i] for i in missing]
+            timeout = settings.rerank_timeout_seconds
+            if deadline:
+                timeout = deadline.budget(timeout)
+            try:
+                missing_scores = await wait_for_stage(self._cohere_scores(query, missing_docs), timeout)
+                for i, score in zip(missing, missing_scores):
+                    self.score_cache.set((query_key, documents[i]["id"], corpus_version), score)
+                outcome = RERANK_COHERE
+            except Exception as e:
+                if self.fallback is None:
+                    raise
+                print(f"⚠️ [Reranker] Cohere failed ({e!r}), using local fallback ranker")
+                if deadline:
+                    deadline.degrade("rerank", "fallback", f"local ranker for {len(documents)} documents: {e!r}")
+                # Local scores for all documents: cached Cohere scores are not comparable
+                scores = dict(enumerate(self.fallback(query, documents)))
+                unseen = set(scores)
+                outcome = RERANK_FALLBACK
+            else:
+                scores.update(zip(missing, missing_scores))
+        
+        # Build reranked results (stable for equal scores: keeps fusion order)
+        ranked = sorted(range(len(documents)), key=lambda i: scores[i], reverse=True)[:k]
+        reranked = []
+        for i in ranked:
+            doc = documents[i].copy()
+            doc["rerank_score"] = scores[i]
+            doc["rerank_source"] = RERANK_CACHED if i not in unseen else outcome
+            reranked.append(doc)
         
-        # Call Cohere rerank API
+        self.metrics.record(outcome, time.perf_counter() - started)
+        return reranked
+    
+    async def _cohere_scores(self, query: str, documents: list[dict]) -> list[float]:
+        """Cohere relevance score of every document, in input order"""
+        # Call Cohere rerank API (all documents are billed either way, so score them all)
         response = await self.client.rerank(
             model=self.model,
             query=query,
-            documents=doc_texts,
-            top_n=min(k, len(documents)),
+            documents=[doc["content"] for doc in documents],
+            top_n=len(documents),
             return_documents=False  # We already have the documents
         )
         
-        # Build reranked results
-        reranked = []
+        scores = [0.0] * len(documents)
         for result in response.results:
-            doc = documents[result.index].copy()
-            doc["rerank_score"] = result.relevance_score
-            reranked.append(doc)
-        
-        return reranked
+            scores[result.index] = result.relevance_score
+        return scores
+    
+    def stats(self) -> dict:
+        """Rerank outcomes with latency, and the score cache"""
+        report = self.metrics.stats()
+        report["cache"] = self.score_cache.stats()
+        return report
     
     async def rerank_with_threshold(
         self,
         query: str,
         documents: list[dict],
         threshold: float = 0.3,
-        top_k: Optional[int] = None
+        top_k: Optional[int] = None,
+        corpus_version: Optional[int] = None,
+        deadline: Optional[Deadline] = None
     ) -> list[dict]:
         """
         Rerank and filter documents below relevance threshold
@@ -73,18 +154,24 @@ class CohereReranker:
         Args:
             query: Search query
             documents: Documents to rerank
-            threshold: Minimum relevance score (0-1)
+            threshold: Minimum Cohere relevance score (0-1); documents scored by
+                the local fallback ranker use `rerank_fallback_threshold` instead
             top_k: Maximum results to return
+            corpus_version: Version the documents were retrieved at (read if None)
+            deadline: Request deadline (see rerank)
         
         Returns:
             Filtered and reranked documents
         """
-        reranked = await self.rerank(query, documents, top_k)
+        reranked = await self.rerank(query, documents, top_k, corpus_version, deadline)
         
-        # Filter by threshold
+        # Filter by threshold (the fallback ranker's scores have their own scale)
         filtered = [
             doc for doc in reranked 
-            if doc["rerank_score"] >= threshold
+            if doc["rerank_score"] >= (
+                settings.rerank_fallback_threshold
+                if doc["rerank_source"] == RERANK_FALLBACK else threshold
+            )
         ]
         
         return filtered
@@ -97,5 +184,8 @@ _reranker: Optional[CohereReranker] = None
 def get_reranker() -> CohereReranker:
     global _reranker
     if _reranker is None:
-        _reranker = CohereReranker(top_k=settings.rerank_top_k)
+        _reranker = CohereReranker(
+            top_k=settings.rerank_top_k,
+            fallback=get_local_ranker(settings.rerank_fallback)
+        )
     return _reranker
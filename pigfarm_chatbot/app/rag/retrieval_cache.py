@@ -0,0 +1,69 @@
+from typing import Optional
+import sys
+
+from app.rag import corpus
+from app.rag.cache import LRUTTLCache, normalize_query
+from app.rag.search_options import SearchOptions
+from app.config import get_settings
+
+settings = get_settings()
+
+
+def chunks_size(chunks: list[dict]) -> int:
+    """Approximate bytes held by a list of chunk dicts (list, dicts and their values)"""
+    size = sys.getsizeof(chunks)
+    for chunk in chunks:
+        size += sys.getsizeof(chunk) + sum(sys.getsizeof(value) for value in chunk.values())
+    return size
+
+
+class RetrievalCache:
+    """
+    Final (reranked) chunks of the RAG tool, keyed by (normalized query, search
+    options, corpus version).
+
+    The key is taken before retrieval starts. Every committed upload or delete
+    bumps the corpus version (see corpus.bump_corpus_version), so entries of an
+    older corpus are never looked up again and age out by LRU / TTL. The cache is
+    per process; the version is shared through the database.
+    """
+
+    def __init__(self, max_size: int = 512, ttl_seconds: float = 1800):
+        self._cache = LRUTTLCache(max_size=max_size, ttl_seconds=ttl_seconds, sizeof=chunks_size)
+
+    async def key(
+        self,
+        query: str,
+        options: Optional[SearchOptions] = None,
+        corpus_version: Optional[int] = None
+    ) -> tuple:
+        """Cache key; reads the corpus version unless the caller already has it"""
+        if corpus_version is None:
+            corpus_version = await corpus.corpus_version()
+        return normalize_query(query), options, corpus_version
+
+    def get(self, key: tuple) -> Optional[list[dict]]:
+        return self._cache.get(key)
+
+    def set(self, key: tuple, chunks: list[dict]):
+        self._cache.set(key, chunks)
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self) -> dict:
+        return self._cache.stats()
+
+
+# Singleton
+_retrieval_cache: Optional[RetrievalCache] = None
+
+
+def get_retrieval_cache() -> RetrievalCache:
+    global _retrieval_cache
+    if _retrieval_cache is None:
+        _retrieval_cache = RetrievalCache(
+            max_size=settings.retrieval_cache_size,
+            ttl_seconds=settings.retrieval_cache_ttl_seconds
+        )
+    return _retrieval_cache
@@ -0,0 +1,62 @@
+from dataclasses import dataclass, field
+from typing import Optional
+import json
+
+ITERATIVE_SCAN_MODES = ("off", "strict_order", "relaxed_order")
+
+
+@dataclass(frozen=True)
+class SearchOptions:
+    """
+    Per-query retrieval options, passed from the RAG tool through HybridSearch
+    down to each retriever.
+
+    ef_search / iterative_scan tune the pgvector HNSW scan for this query only
+    (SET LOCAL); None keeps the server setting. Filters are pushed into SQL:
+    filename goes through the document catalog and (document_id, chunk_index)
+    index, metadata is a JSONB containment filter (@>) backed by a GIN index.
+    In-process backends (memory BM25 / vector) serve unfiltered queries only.
+    """
+    ef_search: Optional[int] = None
+    iterative_scan: Optional[str] = None  # "off" | "strict_order" | "relaxed_order" (pgvector >= 0.8)
+    filename: Optional[str] = None
+    metadata: Optional[dict] = field(default=None, hash=False)
+
+    def __post_init__(self):
+        if self.iterative_scan is not None and self.iterative_scan not in ITERATIVE_SCAN_MODES:
+            raise ValueError(f"Unknown iterative_scan mode: {self.iterative_scan}")
+
+    @property
+    def has_filters(self) -> bool:
+        return self.filename is not None or bool(self.metadata)
+
+
+def filter_sql(options: Optional[SearchOptions], alias: str = "") -> str:
+    """
+    " AND ..." conditions for the options' filters on chat_documents (optionally aliased);
+    bind with filter_params()
+    """
+    if options is None:
+        return ""
+
+    prefix = f"{alias}." if alias else ""
+    conditions = []
+    if options.filename is not None:
+        conditions.append(
+            f"{prefix}document_id = (SELECT id FROM chat_document_catalog WHERE filename = :filter_filename)"
+        )
+    if options.metadata:
+        conditions.append(f"{prefix}metadata @> CAST(:filter_metadata AS jsonb)")
+    return "".join(f" AND {condition}" for condition in conditions)
+
+
+def filter_params(options: Optional[SearchOptions]) -> dict:
+    if options is None:
+        return {}
+
+    params = {}
+    if options.filename is not None:
+        params["filter_filename"] = options.filename
+    if options.metadata:
+        params["filter_metadata"] = json.dumps(options.metadata, ensure_ascii=False)
+    return params
@@ -1,97 +1,275 @@
 from sqlalchemy import text
 from typing import Optional
+import asyncio
 
 from app.db.database import async_session_maker
 from app.documents.embedder import get_embedder
+from app.rag.memory_vector import get_memory_vector_index
+from app.rag.search_options import SearchOptions, filter_sql, filter_params
+from app.rag.corpus import hydrate_chunks
+from app.config import get_settings
+
+settings = get_settings()
+
+HNSW_DEFAULT_EF_SEARCH = 40
+# First pgvector release with hnsw.iterative_scan
+ITERATIVE_SCAN_MIN_VERSION = (0, 8)
+
+# First-pass distance per compact storage mode (must match the index expressions in init_db).
+# {embedding} is a vector(1536) expression so the re-scoring pass stays full precision.
+COMPACT_DISTANCE = {
+    "halfvec": "embedding::halfvec(1536) <=> ({embedding})::halfvec(1536)",
+    "binary": "binary_quantize(embedding)::bit(1536) <~> binary_quantize({embedding})",
+}
+QUERY_EMBEDDING = "CAST(:embedding AS vector(1536))"
 
 
 class VectorSearch:
     """
     Vector similarity search using pgvector
     Uses cosine similarity for finding semantically similar documents
+    
+    With a compact storage mode ("halfvec" / "binary") the HNSW index holds a
+    quantized copy; candidates are re-ranked by exact cosine on the full vectors.
+    
+    With the "memory" backend, searches run exactly against the in-process
+    MemoryVectorIndex (pgvector is used while it is loading or rebuilding, and
+    for filtered searches).
+    
+    SearchOptions set ef_search / iterative scan for one query and push
+    filename / metadata filters into the SQL. HNSW returns at most ef_search
+    rows before the filter runs, so filtered searches default to an iterative
+    scan (`filtered_iterative_scan`, pgvector >= 0.8) or, on older pgvector, to a
+    larger `filtered_ef_search`.
     """
     
-    def __init__(self, top_k: int = 10):
+    # Source label of search_by_embedding results
+    source = "vector"
+    
+    def __init__(
+        self,
+        top_k: int = 10,
+        storage_mode: Optional[str] = None,
+        backend: Optional[str] = None
+    ):
         self.top_k = top_k
         self.embedder = get_embedder()
+        self.storage_mode = storage_mode or settings.vector_storage_mode
+        self.backend = backend or settings.vector_search_backend
+        self.memory_index = get_memory_vector_index()
+        # Installed pgvector version, read on the first database search
+        self._pgvector_version: Optional[tuple[int, ...]] = None
+    
+    def use_memory_index(self, options: Optional[SearchOptions] = None) -> bool:
+        """Whether a search with these options runs on the in-process index"""
+        if options is not None and options.has_filters:
+            return False
+        return self.backend == "memory" and self.memory_index.ready
     
-    async def search(self, query: str, top_k: Optional[int] = None) -> list[dict]:
+    async def search(
+        self,
+        query: str,
+        top_k: Optional[int] = None,
+        options: Optional[SearchOptions] = None
+    ) -> list[dict]:
         """
         Search for documents similar to query using vector similarity
         
         Args:
             query: Search query text
             top_k: Number of results to return (overrides default)
+            options: Per-query HNSW settings and filters
         
         Returns:
             List of documents with similarity scores
         """
+        query_embedding = await self.embedder.embed_query(query)
+        return await self.search_by_embedding(query_embedding, top_k, options)
+    
+    async def search_by_embedding(
+        self,
+        query_embedding: list[float],
+        top_k: Optional[int] = None,
+        options: Optional[SearchOptions] = None
+    ) -> list[dict]:
+        """Search with a precomputed query embedding"""
+        candidates = await self.search_candidates(query_embedding, top_k, options)
+        return await hydrate_chunks([
+            {"id": chunk_id, "score": score, "source": self.source}
+            for chunk_id, score in candidates
+        ])
+    
+    async def search_candidates(
+        self,
+        query_embedding: list[float],
+        top_k: Optional[int] = None,
+        options: Optional[SearchOptions] = None
+    ) -> list[tuple[int, float]]:
+        """(chunk id, cosine similarity) of the nearest chunks, best first; no content is fetched"""
         k = top_k or self.top_k
         
-        # Generate query embedding
-        query_embedding = await self.embedder.embed_text(query)
-        
-        # Format embedding for PostgreSQL
-        embedding_str = "[" + ",".join(map(str, query_embedding)) + "]"
+        if self.use_memory_index(options):
+            return (await self.memory_index.search([query_embedding], k))[0]
         
         async with async_session_maker() as session:
-            # Cosine similarity search
-            # Note: pgvector uses <=> for cosine distance, so we convert to similarity
-            # Removed explicit ::vector cast to avoid asyncpg syntax error with bound params
+            params = await self.prepare_candidates(session, k, options)
+            # The query vector is sent in pgvector's binary format (codec registered on connect)
             result = await session.execute(
-                text("""
-                    SELECT 
-                        id,
-                        filename,
-                        content,
-                        chunk_index,
-                        metadata,
-                        1 - (embedding <=> :embedding) as similarity
-                    FROM chat_documents
-                    WHERE embedding IS NOT NULL
-                    ORDER BY embedding <=> :embedding
-                    LIMIT :limit
-                """),
-                {"embedding": embedding_str, "limit": k}
+                text(self.candidates_sql(QUERY_EMBEDDING, options)),
+                {"embedding": query_embedding, **params}
             )
-            
             rows = result.fetchall()
-            
-            return [
-                {
-                    "id": row.id,
-                    "filename": row.filename,
-                    "content": row.content,
-                    "chunk_index": row.chunk_index,
-                    "metadata": row.metadata,
-                    "score": float(row.similarity),
-                    "source": "vector"
-                }
-                for row in rows
-            ]
+        
+        # pgvector uses <=> for cosine distance, so we convert to similarity
+        candidates = [(row.id, 1 - float(row.distance)) for row in rows]
+        if self.iterative_scan(options) == "relaxed_order":
+            # Relaxed iterative scans may return rows slightly out of distance order
+            candidates.sort(key=lambda candidate: candidate[1], reverse=True)
+        return candidates
+    
+    def candidates_sql(self, embedding: str, options: Optional[SearchOptions] = None) -> str:
+        """
+        Subquery with the nearest (id, distance) rows for one query embedding,
+        limited by the :vector_k parameter (and :vector_candidates in compact modes).
+        Compact modes take oversampled candidates from the compact index, then
+        re-rank them by exact cosine against the full vectors.
+        
+        `embedding` is any vector(1536) SQL expression, so the server-side hybrid
+        query can run it as a LATERAL search per query variation. Bind the
+        parameters returned by prepare_candidates.
+        """
+        if self.storage_mode == "full":
+            return f"""
+                SELECT id, embedding <=> {embedding} AS distance
+                FROM chat_documents
+                WHERE embedding IS NOT NULL{filter_sql(options)}
+                ORDER BY embedding <=> {embedding}
+                LIMIT :vector_k
+            """
+        return f"""
+            SELECT d.id, d.embedding <=> {embedding} AS distance
+            FROM (
+                SELECT id
+                FROM chat_documents
+                WHERE embedding IS NOT NULL{filter_sql(options)}
+                ORDER BY {COMPACT_DISTANCE[self.storage_mode].format(embedding=embedding)}
+                LIMIT :vector_candidates
+            ) c
+            JOIN chat_documents d ON d.id = c.id
+            ORDER BY distance
+            LIMIT :vector_k
+        """
+    
+    async def prepare_candidates(
+        self,
+        session,
+        k: int,
+        options: Optional[SearchOptions] = None
+    ) -> dict:
+        """
+        Transaction-local HNSW settings and bind parameters (including filters)
+        for a search with `k` results
+        """
+        candidates = k * settings.vector_rescore_oversample
+        # HNSW returns at most ef_search rows per scan
+        needed = k if self.storage_mode == "full" else candidates
+        if self._pgvector_version is None:
+            self._pgvector_version = await self._read_pgvector_version(session)
+        ef_search = options.ef_search if options is not None else None
+        iterative_scan = self.iterative_scan(options)
+        if options is not None and options.has_filters and iterative_scan is None:
+            # No iterative scan: rows removed by the filter must fit in one larger scan
+            needed = max(needed, settings.filtered_ef_search)
+        if ef_search is not None:
+            ef_search = max(ef_search, needed)
+        elif needed > HNSW_DEFAULT_EF_SEARCH:
+            ef_search = needed
+        
+        assignments = []
+        hnsw_params = {}
+        if ef_search is not None:
+            assignments.append("set_config('hnsw.ef_search', :ef_search, true)")
+            hnsw_params["ef_search"] = str(ef_search)
+        if iterative_scan is not None:
+            assignments.append("set_config('hnsw.iterative_scan', :iterative_scan, true)")
+            hnsw_params["iterative_scan"] = iterative_scan
+        if assignments:
+            await session.execute(text("SELECT " + ", ".join(assignments)), hnsw_params)
+        
+        return {"vector_k": k, "vector_candidates": candidates, **filter_params(options)}
+    
+    def iterative_scan(self, options: Optional[SearchOptions] = None) -> Optional[str]:
+        """
+        hnsw.iterative_scan for a search: the explicit option, else
+        `filtered_iterative_scan` for filtered searches when pgvector supports it
+        """
+        if options is None:
+            return None
+        if options.iterative_scan is not None:
+            return options.iterative_scan
+        if (
+            options.has_filters
+            and settings.filtered_iterative_scan != "off"
+            and self._pgvector_version is not None
+            and self._pgvector_version >= ITERATIVE_SCAN_MIN_VERSION
+        ):
+            return settings.filtered_iterative_scan
+        return None
+    
+    @staticmethod
+    async def _read_pgvector_version(session) -> tuple[int, ...]:
+        """Installed pgvector version, e.g. (0, 8, 0); () if it cannot be read"""
+        result = await session.execute(
+            text("SELECT extversion FROM pg_extension WHERE extname = 'vector'")
+        )
+        version = result.scalar()
+        try:
+            return tuple(int(part) for part in version.split("."))
+        except (AttributeError, ValueError):
+            print(f"⚠️ [VectorSearch] Unknown pgvector version {version!r}, iterative scan disabled")
+            return ()
     
     async def search_multi_query(
         self, 
         queries: list[str], 
-        top_k_per_query: int = 10
-    ) -> list[dict]:
+        top_k_per_query: int = 10,
+        semaphore: Optional[asyncio.Semaphore] = None,
+        options: Optional[SearchOptions] = None
+    ) -> list[tuple[int, float]]:
         """
         Search with multiple queries and combine results
         
         Args:
             queries: List of query variations
             top_k_per_query: Results per query
+            semaphore: Run the per-query searches concurrently under this bound
+                (sequentially if None)
+            options: Per-query HNSW settings and filters
         
         Returns:
-            Combined list of documents (may have duplicates)
+            Combined (chunk id, similarity) candidates (may have duplicates), in query order;
+            fetch content for the final results with corpus.hydrate_chunks
         """
-        all_results = []
+        # Embed all variations in one batched call
+        query_embeddings = await self.embedder.embed_queries(queries)
+        
+        if self.use_memory_index(options):
+            # All variations in one matrix product
+            per_query = await self.memory_index.search(query_embeddings, top_k_per_query)
+            return [candidate for results in per_query for candidate in results]
+        
+        async def _search(query_embedding) -> list[tuple[int, float]]:
+            if semaphore is None:
+                return await self.search_candidates(query_embedding, top_k_per_query, options)
+            async with semaphore:
+                return await self.search_candidates(query_embedding, top_k_per_query, options)
         
-        for query in queries:
-            results = await self.search(query, top_k_per_query)
-            all_results.extend(results)
+        if semaphore is None:
+            per_query = [await _search(e) for e in query_embeddings]
+        else:
+            per_query = await asyncio.gather(*(_search(e) for e in query_embeddings))
         
-        return all_results
+        return [candidate for results in per_query for candidate in results]
 
 
 # Singleton
@@ -0,0 +1,107 @@
+import asyncio
+import unicodedata
+
+import pytest
+
+from app.rag import cache as cache_module
+from app.rag.cache import LRUTTLCache, normalize_query
+from app.rag.retrieval_cache import RetrievalCache, chunks_size
+from app.rag.search_options import SearchOptions
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> FakeClock:
+    clock = FakeClock()
+    monkeypatch.setattr(cache_module.time, "monotonic", clock)
+    return clock
+
+
+def test_normalize_query():
+    assert normalize_query("  Heo  bị SỐT\tthì sao?? ") == "heo bị sốt thì sao"
+    # NFD input (combining marks) maps to the same key as NFC
+    assert normalize_query("tiêm phòng") == normalize_query("tiêm phòng")
+
+
+def test_lru_eviction(clock):
+    cache = LRUTTLCache(max_size=2, ttl_seconds=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1  # "b" is now least recently used
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+    assert len(cache) == 2
+
+
+def test_ttl(clock):
+    cache = LRUTTLCache(max_size=10, ttl_seconds=60)
+    cache.set("a", 1)
+    cache.set("b", 2, ttl_seconds=600)
+
+    clock.now += 61
+    assert "a" not in cache
+    assert cache.get("a", "missing") == "missing"
+    assert cache.get("b") == 2
+    assert len(cache) == 1  # "a" dropped on access
+
+
+def test_stats(clock):
+    cache = LRUTTLCache(max_size=10, ttl_seconds=60)
+    cache.set("a", 1)
+    cache.get("a")
+    cache.get("b")
+    assert "a" in cache  # not a lookup
+
+    assert cache.stats() == {"size": 1, "max_size": 10, "hits": 1, "misses": 1, "hit_ratio": 0.5}
+
+
+def test_sizeof_tracks_bytes(clock):
+    cache = LRUTTLCache(max_size=2, ttl_seconds=60, sizeof=len)
+    cache.set("a", "x" * 10)
+    cache.set("b", "x" * 20)
+    assert cache.stats()["approx_bytes"] == 30
+
+    cache.set("a", "x" * 5)  # overwrite
+    assert cache.stats()["approx_bytes"] == 25
+
+    cache.set("c", "x" * 7)  # evicts "b"
+    assert cache.stats()["approx_bytes"] == 12
+
+    clock.now += 61
+    cache.get("a")  # expired
+    assert cache.stats()["approx_bytes"] == 7
+
+    cache.clear()
+    assert cache.stats()["approx_bytes"] == 0
+    assert len(cache) == 0
+
+
+def test_chunks_size_grows_with_content():
+    small = [{"id": 1, "content": "heo"}]
+    large = [{"id": 1, "content": "heo " * 1000}]
+
+    assert chunks_size([]) > 0
+    assert chunks_size(large) > chunks_size(small) + 3000
+
+
+def test_retrieval_cache_key():
+    cache = RetrievalCache(max_size=4)
+    options = SearchOptions(filename="so_tay.pdf")
+
+    key = asyncio.run(cache.key("Heo bị sốt?", options, corpus_version=3))
+    assert key == asyncio.run(cache.key("heo  bị sốt", SearchOptions(filename="so_tay.pdf"), corpus_version=3))
+    assert key != asyncio.run(cache.key("heo bị sốt", options, corpus_version=4))
+    assert key != asyncio.run(cache.key("heo bị sốt", None, corpus_version=3))
+
+    cache.set(key, [{"id": 1, "content": "heo"}])
+    assert cache.get(key) == [{"id": 1, "content": "heo"}]
+    assert "approx_bytes" in cache.stats()
@@ -0,0 +1,114 @@
+import random
+
+import pytest
+import tiktoken
+
+from app.documents import chunker as chunker_module
+from app.documents.chunker import SemanticChunker
+
+# cl100k_base's pre-tokenizer: EncodedText relies on where it splits, not on the merges
+CL100K_PATTERN = (
+    r"""'(?i:[sdmt]|ll|ve|re)|[^\r\n\p{L}\p{N}]?+\p{L}++|\p{N}{1,3}+| ?[^\s\p{L}\p{N}]++[\r\n]*+"""
+    r"""|\s++$|\s*[\r\n]|\s+(?!\S)|\s"""
+)
+
+WORDS = [
+    "heo", "nái", "tiêm", "phòng", "dịch", "tả", "châu", "Phi", "chuồng", "trại", "thức", "ăn",
+    "PRRS", "ASF", "3/3/3", "2,5", "ml/kg", "sốt", "(cao)", "đàn", "con", "vaccine", "ngày", "tuổi",
+]
+
+
+def _local_encoding() -> tiktoken.Encoding:
+    """Small BPE with the cl100k_base pattern: every byte plus the prefixes of WORDS"""
+    ranks = {bytes([i]): i for i in range(256)}
+    for word in WORDS:
+        for text in (word, " " + word):
+            encoded = text.encode("utf-8")
+            for end in range(2, len(encoded) + 1):
+                ranks.setdefault(encoded[:end], len(ranks))
+    return tiktoken.Encoding(
+        name="test_cl100k_pattern", pat_str=CL100K_PATTERN, mergeable_ranks=ranks, special_tokens={}
+    )
+
+
+@pytest.fixture(params=["local", "cl100k_base"])
+def encoding(request) -> tiktoken.Encoding:
+    if request.param == "local":
+        return _local_encoding()
+    try:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:  # first use downloads the BPE file
+        pytest.skip(f"cl100k_base unavailable: {e!r}")
+
+
+@pytest.fixture
+def make_chunker(encoding, monkeypatch):
+    monkeypatch.setattr(chunker_module.tiktoken, "get_encoding", lambda name: encoding)
+
+    def _make(mode: str, chunk_size: int = 40, chunk_overlap: int = 10) -> SemanticChunker:
+        return SemanticChunker(chunk_size=chunk_size, chunk_overlap=chunk_overlap, mode=mode, num_threads=2)
+
+    return _make
+
+
+def _sentence(rng: random.Random) -> str:
+    words = rng.choices(WORDS, k=rng.randint(1, 14))
+    return " ".join(words) + rng.choice([".", "!", "?", "", ":"])
+
+
+def _page(rng: random.Random, number: int) -> str:
+    paragraphs = []
+    for _ in range(rng.randint(1, 6)):
+        separator = rng.choice([" ", "  ", "\n", " \n", "\t"])
+        paragraphs.append(separator.join(_sentence(rng) for _ in range(rng.randint(1, 12))))
+    body = rng.choice(["\n\n", "\n \n", "\n\n\n"]).join(paragraphs)
+    return f"[Trang {number}]\n{body}" + rng.choice(["", " ", "\n"])
+
+
+def _pages(seed: int) -> list[str]:
+    rng = random.Random(seed)
+    return [_page(rng, number) for number in range(1, rng.randint(2, 8))]
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_offsets_stream_matches_legacy(make_chunker, seed):
+    pages = _pages(seed)
+    metadata = {"title": "Sổ tay thú y"}
+
+    legacy = make_chunker("legacy").start_stream(metadata)
+    offsets = make_chunker("offsets").start_stream(metadata)
+
+    expected = legacy.feed_many(pages) + legacy.close()
+    assert offsets.feed_many(pages) + offsets.close() == expected
+    assert len(expected) > 1
+
+
+@pytest.mark.parametrize("chunk_size, chunk_overlap", [(8, 2), (40, 10), (200, 50)])
+def test_offsets_chunk_texts_match_legacy(make_chunker, chunk_size, chunk_overlap):
+    texts = ["\n\n".join(_pages(seed)) for seed in range(5)]
+
+    legacy = make_chunker("legacy", chunk_size, chunk_overlap)
+    offsets = make_chunker("offsets", chunk_size, chunk_overlap)
+
+    assert offsets.chunk_texts(texts) == legacy.chunk_texts(texts)
+    assert offsets.chunk_text(texts[0]) == legacy.chunk_text(texts[0])
+
+
+def test_token_counts_are_exact(make_chunker, encoding):
+    chunks = make_chunker("offsets").chunk_text("\n\n".join(_pages(7)))
+
+    for chunk in chunks:
+        assert chunk["token_count"] == len(encoding.encode(chunk["content"]))
+
+
+def test_stream_equals_joined_text(make_chunker):
+    pages = _pages(3)
+    chunker = make_chunker("offsets")
+    stream = chunker.start_stream()
+
+    assert stream.feed_many(pages) + stream.close() == chunker.chunk_text("\n\n".join(pages))
+
+
+def test_unknown_mode(make_chunker):
+    with pytest.raises(ValueError):
+        make_chunker("fast")
@@ -0,0 +1,126 @@
+import asyncio
+
+import pytest
+
+from app.rag import deadline as deadline_module
+from app.rag import hybrid_search as hybrid_module
+from app.rag.deadline import Deadline, wait_for_stage
+from app.rag.hybrid_search import HybridSearch
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 500.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> FakeClock:
+    clock = FakeClock()
+    monkeypatch.setattr(deadline_module.time, "monotonic", clock)
+    return clock
+
+
+def test_budget_and_allows(clock):
+    deadline = Deadline(10.0)
+
+    assert deadline.budget(3.0) == 3.0
+    assert deadline.budget(3.0, reserve=8.0) == pytest.approx(2.0)
+    assert deadline.allows(0.5, reserve=9.0)
+
+    clock.now += 9.8
+    assert deadline.remaining() == pytest.approx(0.2)
+    assert deadline.budget(3.0) == pytest.approx(0.2)
+    assert deadline.budget(3.0, reserve=1.0) == 0.0
+    assert not deadline.allows(0.3)
+
+    clock.now += 5
+    assert deadline.remaining() == 0.0
+    assert deadline.budget(3.0) == 0.0
+
+
+def test_degradations(clock):
+    deadline = Deadline(2.0)
+    clock.now += 0.25
+    deadline.degrade("rerank", "fallback", "timeout")
+    clock.now += 0.5
+
+    assert deadline.to_dict() == {
+        "deadline_ms": 2000.0,
+        "elapsed_ms": 750.0,
+        "degradations": [{"stage": "rerank", "action": "fallback", "detail": "timeout", "at_ms": 250.0}]
+    }
+
+
+def test_wait_for_stage():
+    async def value(delay: float):
+        await asyncio.sleep(delay)
+        return "ok"
+
+    assert asyncio.run(wait_for_stage(value(0), 1.0)) == "ok"
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(wait_for_stage(value(1.0), 0.01))
+
+
+def test_wait_for_stage_spent_budget_never_starts():
+    started = []
+
+    async def stage():
+        started.append(1)
+
+    coroutine = stage()
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(wait_for_stage(coroutine, 0.0))
+    assert started == []
+    assert coroutine.cr_frame is None  # closed, no "never awaited" warning
+
+
+@pytest.fixture
+def hybrid(monkeypatch) -> HybridSearch:
+    hybrid = HybridSearch()
+
+    async def retrieve(queries, concurrent=True, options=None, deadline=None):
+        return [(1, 0.9)], [(1, 3.0)]
+
+    async def hydrate(results):
+        return results
+
+    monkeypatch.setattr(hybrid, "retrieve", retrieve)
+    monkeypatch.setattr(hybrid_module, "hydrate_chunks", hydrate)
+    monkeypatch.setattr(hybrid_module.settings, "speculative_retrieval_enabled", True)
+    return hybrid
+
+
+def test_speculative_search_respects_spent_deadline(hybrid, monkeypatch):
+    calls = []
+
+    async def expand_query(query):
+        calls.append(query)
+        return "xử lý heo sốt", []
+
+    monkeypatch.setattr(hybrid.query_transformer, "expand_query", expand_query)
+    query = "heo nái bị sốt cao phải làm gì"
+    deadline = Deadline(hybrid_module.settings.rag_retrieval_reserve_seconds)
+
+    assert hybrid.query_transformer.needs_llm(query)
+    results = asyncio.run(hybrid.search(query, deadline=deadline))
+
+    assert calls == []
+    assert [doc["id"] for doc in results] == [1]
+    assert [(d["stage"], d["action"]) for d in deadline.degradations] == [("rewrite", "skipped")]
+    assert hybrid.speculative_metrics.count(hybrid_module.SPECULATIVE_DEADLINE_MISSED) == 1
+
+
+def test_sql_fusion_timeout_is_recorded(hybrid, monkeypatch):
+    async def search_sql(queries, top_k, options):
+        await asyncio.sleep(1)
+
+    monkeypatch.setattr(hybrid_module.settings, "hybrid_search_mode", "sql")
+    monkeypatch.setattr(hybrid, "sql_fusion_available", lambda options: True)
+    monkeypatch.setattr(hybrid, "search_sql", search_sql)
+    deadline = Deadline(0.05)
+
+    assert asyncio.run(hybrid.search("heo sốt", use_query_transformation=False, deadline=deadline)) == []
+    assert [(d["stage"], d["action"]) for d in deadline.degradations] == [("sql_fusion", "timeout")]
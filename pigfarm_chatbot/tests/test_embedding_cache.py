@@ -0,0 +1,93 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app.documents import embedding_cache as cache_module
+from app.documents.embedding_cache import EmbeddingCache
+
+
+class FakeResult:
+    def __init__(self, rows, rowcount=0):
+        self.rows = rows
+        self.rowcount = rowcount
+
+    def fetchall(self):
+        return self.rows
+
+
+class FakeSession:
+    """Records statements; SELECTs answer with the stored rows"""
+
+    def __init__(self, log, stored):
+        self.log = log
+        self.stored = stored
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, statement, params=None):
+        sql = " ".join(str(statement).split())
+        self.log.append((sql, params))
+        if sql.startswith("SELECT"):
+            rows = [
+                SimpleNamespace(content_hash=h, embedding=self.stored[h])
+                for h in params["hashes"] if h in self.stored
+            ]
+            return FakeResult(rows)
+        return FakeResult([], rowcount=len(params["hashes"]) if isinstance(params, dict) else 0)
+
+    async def commit(self):
+        self.log.append(("COMMIT", None))
+
+
+@pytest.fixture
+def log(monkeypatch):
+    statements = []
+    stored = {"b": [0.2], "a": [0.1]}
+    monkeypatch.setattr(cache_module, "async_session_maker", lambda: FakeSession(statements, stored))
+    return statements
+
+
+def test_lookup_reads_then_touches_in_hash_order(log):
+    cache = EmbeddingCache("model", 4)
+
+    found = asyncio.run(cache.get_many(["c", "b", "a", "b"]))
+
+    assert found == {"b": [0.2], "a": [0.1]}
+    assert (cache.hits, cache.misses) == (3, 1)
+    lookup, touch = log[0], log[1]
+    assert lookup[0].startswith("SELECT") and "UPDATE" not in lookup[0] and "FOR UPDATE" not in lookup[0]
+    assert touch[0].startswith("UPDATE") and "ORDER BY content_hash FOR UPDATE SKIP LOCKED" in touch[0]
+    assert touch[1]["hashes"] == ["a", "b"]
+
+
+def test_no_touch_on_full_miss(log):
+    asyncio.run(EmbeddingCache("model", 4).get_many(["x", "y"]))
+
+    assert [sql for sql, _ in log] == [log[0][0]]
+
+
+def test_put_does_not_evict(log):
+    asyncio.run(EmbeddingCache("model", 4).put_many({"x": [0.3]}))
+
+    assert not any("DELETE" in sql for sql, _ in log)
+
+
+def test_periodic_eviction(log, monkeypatch):
+    monkeypatch.setattr(cache_module.settings, "embedding_cache_evict_interval_seconds", 0)
+
+    async def run():
+        cache = EmbeddingCache("model", 4)
+        await cache.start()
+        await asyncio.sleep(0.01)
+        await cache.stop()
+        return cache
+
+    cache = asyncio.run(run())
+
+    assert cache._evict_task is None
+    assert any(sql.startswith("DELETE") for sql, _ in log)
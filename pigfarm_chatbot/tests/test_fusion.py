@@ -0,0 +1,131 @@
+import asyncio
+import random
+
+import pytest
+
+from app.rag import hybrid_search as hybrid_module
+from app.rag.hybrid_search import HybridSearch
+
+
+@pytest.fixture
+def hybrid() -> HybridSearch:
+    return HybridSearch(vector_k=10, bm25_k=10, rrf_k=60)
+
+
+def _ids(results: list[dict]) -> list[int]:
+    return [doc["id"] for doc in results]
+
+
+def _sql_order(vector: list[tuple[int, float]], bm25: list[tuple[int, float]], rrf_k: int, top_k: int) -> list[int]:
+    """Ranking of search_sql: first occurrence per list, then ORDER BY rrf_score DESC, vector_rank NULLS LAST, bm25_rank"""
+    def ranks(candidates):
+        ranked = {}
+        for doc_id, _ in candidates:
+            ranked.setdefault(doc_id, len(ranked) + 1)
+        return ranked
+
+    vector_rank, bm25_rank = ranks(vector), ranks(bm25)
+    ids = set(vector_rank) | set(bm25_rank)
+
+    def key(doc_id):
+        score = sum(1 / (rrf_k + r[doc_id]) for r in (vector_rank, bm25_rank) if doc_id in r)
+        return -score, vector_rank.get(doc_id, float("inf")), bm25_rank.get(doc_id, float("inf"))
+
+    return sorted(ids, key=key)[:top_k]
+
+
+def test_ties_keep_vector_order(hybrid):
+    # 1 and 2 both get 1/61 + 1/62
+    results = hybrid._reciprocal_rank_fusion([(1, 0.9), (2, 0.8)], [(2, 7.0), (1, 5.0)], top_k=10)
+
+    assert _ids(results) == [1, 2]
+    assert results[0]["rrf_score"] == results[1]["rrf_score"]
+
+
+def test_single_retriever_ties_put_vector_first(hybrid):
+    # 1 (vector only) and 3 (bm25 only) both get 1/61
+    results = hybrid._reciprocal_rank_fusion([(1, 0.9)], [(3, 4.0)], top_k=10)
+
+    assert _ids(results) == [1, 3]
+    assert [doc["source"] for doc in results] == ["vector", "bm25_vi"]
+
+
+def test_duplicates_rank_by_first_occurrence(hybrid):
+    # Per-variation lists are concatenated: 1 repeats in the second variation
+    vector = [(1, 0.9), (2, 0.8), (1, 0.95), (3, 0.7)]
+    results = hybrid._reciprocal_rank_fusion(vector, [], top_k=10)
+
+    assert _ids(results) == [1, 2, 3]
+    assert results[2]["rrf_score"] == pytest.approx(1 / 63)
+    # The score of the first occurrence is kept
+    assert results[0]["score"] == 0.9
+
+
+def test_fields(hybrid):
+    results = hybrid._reciprocal_rank_fusion([(1, 0.9)], [(1, 3.0), (2, 2.0)], top_k=10, lexical_source="bm25_memory")
+    first, second = results
+
+    assert first == {
+        "id": 1, "score": 0.9, "source": "vector", "rrf_score": pytest.approx(2 / 61),
+        "in_vector": True, "in_bm25": True
+    }
+    assert second["source"] == "bm25_memory"
+    assert (second["in_vector"], second["in_bm25"]) == (False, True)
+
+
+def test_top_k(hybrid):
+    results = hybrid._reciprocal_rank_fusion([(i, 1.0) for i in range(30)], [], top_k=5)
+
+    assert _ids(results) == [0, 1, 2, 3, 4]
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_matches_sql_order(hybrid, seed):
+    rng = random.Random(seed)
+    vector = [(rng.randint(1, 25), rng.random()) for _ in range(rng.randint(0, 30))]
+    bm25 = [(rng.randint(1, 25), rng.random()) for _ in range(rng.randint(0, 30))]
+
+    results = hybrid._reciprocal_rank_fusion(vector, bm25, top_k=20)
+
+    assert _ids(results) == _sql_order(vector, bm25, hybrid.rrf_k, 20)
+
+
+def _sql_mode(hybrid: HybridSearch, monkeypatch, search_sql) -> list:
+    retrieved = []
+
+    async def retrieve(queries, concurrent=True, options=None, deadline=None):
+        retrieved.append(queries)
+        return [(1, 0.9)], [(1, 3.0)]
+
+    async def hydrate(results):
+        return results
+
+    monkeypatch.setattr(hybrid_module.settings, "hybrid_search_mode", "sql")
+    monkeypatch.setattr(hybrid_module.settings, "vector_search_timeout_seconds", 0.05)
+    monkeypatch.setattr(hybrid_module.settings, "bm25_search_timeout_seconds", 0.05)
+    monkeypatch.setattr(hybrid, "sql_fusion_available", lambda options: True)
+    monkeypatch.setattr(hybrid, "search_sql", search_sql)
+    monkeypatch.setattr(hybrid, "retrieve", retrieve)
+    monkeypatch.setattr(hybrid_module, "hydrate_chunks", hydrate)
+    return retrieved
+
+
+def test_sql_fusion_timeout_does_not_fall_back(hybrid, monkeypatch):
+    async def slow_sql(queries, top_k, options):
+        await asyncio.sleep(1)
+
+    retrieved = _sql_mode(hybrid, monkeypatch, slow_sql)
+
+    assert asyncio.run(hybrid.search("heo sốt", use_query_transformation=False)) == []
+    assert retrieved == []
+
+
+def test_sql_fusion_error_falls_back_to_python_fusion(hybrid, monkeypatch):
+    async def broken_sql(queries, top_k, options):
+        raise RuntimeError("relation does not exist")
+
+    retrieved = _sql_mode(hybrid, monkeypatch, broken_sql)
+
+    results = asyncio.run(hybrid.search("heo sốt", use_query_transformation=False))
+    assert retrieved == [["heo sốt"]]
+    assert _ids(results) == [1]
@@ -0,0 +1,224 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from pypdf import PdfWriter
+
+from app.documents import ingest
+from app.documents import pdf_parser
+from app.documents.pdf_parser import PDFParser
+from app.documents.store import chunk_hash
+
+
+@pytest.fixture
+def pdf_path(tmp_path) -> str:
+    writer = PdfWriter()
+    for _ in range(45):
+        writer.add_blank_page(width=100, height=100)
+    path = tmp_path / "blank.pdf"
+    writer.write(path)
+    return str(path)
+
+
+@pytest.fixture
+def opened(monkeypatch) -> list:
+    opened = []
+    reader_class = pdf_parser.PdfReader
+    monkeypatch.setattr(pdf_parser, "PdfReader", lambda path: opened.append(path) or reader_class(path))
+    monkeypatch.setattr(pdf_parser, "_current", None)
+    return opened
+
+
+def test_page_windows_share_one_reader(pdf_path, opened):
+    windows = [PDFParser.parse_pages(pdf_path, start, start + 20) for start in (0, 20)]
+    assert PDFParser.get_metadata(pdf_path)["num_pages"] == 45
+    windows.append(PDFParser.parse_pages(pdf_path, 40, 60))
+
+    assert [window["metadata"]["num_pages"] for window in windows] == [45, 45, 45]
+    assert opened == [pdf_path]
+    # Dropped after the last window
+    assert pdf_parser._current is None
+
+
+def test_only_the_current_file_is_cached(pdf_path, tmp_path, opened):
+    other = tmp_path / "other.pdf"
+    writer = PdfWriter()
+    writer.add_blank_page(width=100, height=100)
+    writer.write(other)
+
+    PDFParser.parse_pages(pdf_path, 0, 20)
+    PDFParser.parse_pages(str(other), 0, 20)
+
+    assert pdf_parser._current is None
+    PDFParser.parse_pages(pdf_path, 20, 40)
+    assert pdf_parser._current[0][0] == pdf_path
+    assert opened == [pdf_path, str(other), pdf_path]
+
+
+def test_reader_dropped_on_error(pdf_path, opened, monkeypatch):
+    PDFParser.parse_pages(pdf_path, 0, 20)
+    reader = pdf_parser._current[1]
+    monkeypatch.setattr(type(reader.pages[20]), "extract_text", lambda page: 1 / 0)
+
+    with pytest.raises(ZeroDivisionError):
+        PDFParser.parse_pages(pdf_path, 20, 40)
+    assert pdf_parser._current is None
+
+
+def test_changed_file_gets_a_new_reader(pdf_path, opened):
+    PDFParser.parse_pages(pdf_path, 0, 20)
+
+    writer = PdfWriter()
+    writer.add_blank_page(width=100, height=100)
+    writer.write(pdf_path)
+
+    assert PDFParser.parse_pages(pdf_path, 0, 20)["metadata"]["num_pages"] == 1
+
+
+class FakeSession:
+    def __init__(self, events=None):
+        self.events = events if events is not None else []
+
+    async def __aenter__(self):
+        self.events.append("session")
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def commit(self):
+        self.events.append("commit")
+
+
+class FakeStream:
+    def feed_many(self, pages):
+        # Drop the "[Trang N]" header so contents are the page texts
+        return [{"content": page.split("\n", 1)[1], "chunk_index": 0, "metadata": {}} for page in pages]
+
+    def close(self):
+        return []
+
+
+class FakeChunker:
+    def __init__(self, **kwargs):
+        pass
+
+    def start_stream(self, metadata=None):
+        return FakeStream()
+
+
+class FailingEmbedder:
+    async def embed_chunks(self, chunks, on_progress=None):
+        # Parsing fills the queue meanwhile
+        await asyncio.sleep(0.05)
+        raise RuntimeError("embedding quota exceeded")
+
+
+class RecordingEmbedder:
+    def __init__(self, events):
+        self.events = events
+
+    async def embed_chunks(self, chunks, on_progress=None):
+        self.events.append(("embed", [chunk["content"] for chunk in chunks]))
+        for chunk in chunks:
+            chunk["embedding"] = [0.0]
+        return chunks
+
+
+def _windows(contents):
+    async def windows(path, window=None):
+        for number, content in enumerate(contents, start=1):
+            yield {"metadata": {}, "pages": [{"page_number": number, "content": content}]}
+    return windows
+
+
+def _fake_store(monkeypatch, events, committed_hashes):
+    """Stored chunks: `committed_hashes` is a list of (id, content) read by each get_chunk_hashes call"""
+    async def noop(*args, **kwargs):
+        return 1
+
+    async def get_chunk_hashes(session, document_id):
+        stored = committed_hashes.pop(0)
+        return [SimpleNamespace(id=i, content_hash=chunk_hash(c)) for i, c in stored]
+
+    async def copy_chunks(session, document_id, filename, chunks):
+        events.append(("copy", [chunk["content"] for chunk in chunks]))
+
+    async def update_chunk_positions(session, chunks):
+        events.append(("keep", [chunk_id for chunk_id, _ in chunks]))
+
+    async def delete_chunks(session, ids):
+        events.append(("delete", ids))
+        return len(ids)
+
+    async def lock_filename(session, filename):
+        events.append("lock")
+
+    for name in ("upsert_document", "find_document", "refresh_document_stats", "bump_corpus_version",
+                 "notify_document_changed"):
+        monkeypatch.setattr(ingest, name, noop)
+    monkeypatch.setattr(ingest, "get_chunk_hashes", get_chunk_hashes)
+    monkeypatch.setattr(ingest, "copy_chunks", copy_chunks)
+    monkeypatch.setattr(ingest, "update_chunk_positions", update_chunk_positions)
+    monkeypatch.setattr(ingest, "delete_chunks", delete_chunks)
+    monkeypatch.setattr(ingest, "lock_filename", lock_filename)
+    monkeypatch.setattr(ingest, "async_session_maker", lambda: FakeSession(events))
+    monkeypatch.setattr(ingest, "SemanticChunker", FakeChunker)
+    monkeypatch.setattr(ingest, "get_embedder", lambda: RecordingEmbedder(events))
+    monkeypatch.setattr(ingest.settings, "ingest_batch_chunks", 2)
+
+
+def test_consumer_failure_does_not_leak_the_producer(monkeypatch, tmp_path):
+    monkeypatch.setattr(ingest, "iter_pdf_pages", _windows(["heo"] * 49))
+    monkeypatch.setattr(ingest, "SemanticChunker", FakeChunker)
+    monkeypatch.setattr(ingest, "get_embedder", FailingEmbedder)
+    monkeypatch.setattr(ingest, "async_session_maker", FakeSession)
+    monkeypatch.setattr(ingest.settings, "ingest_batch_chunks", 1)
+    path = tmp_path / "so_tay.pdf"
+    path.write_bytes(b"%PDF")
+
+    async def main():
+        with pytest.raises(RuntimeError, match="quota"):
+            await asyncio.wait_for(ingest.ingest_file("so_tay.pdf", str(path)), timeout=5)
+        return [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+
+    assert asyncio.run(main()) == []
+    assert list(tmp_path.iterdir()) == [path]
+
+
+def test_embedding_happens_before_the_transaction(monkeypatch, tmp_path):
+    events = []
+    _fake_store(monkeypatch, events, [])
+    monkeypatch.setattr(ingest, "iter_pdf_pages", _windows(["a", "b", "c"]))
+    path = tmp_path / "so_tay.pdf"
+    path.write_bytes(b"%PDF")
+
+    stored = asyncio.run(ingest.ingest_file("so_tay.pdf", str(path)))
+
+    assert stored == 3
+    assert events == [
+        ("embed", ["a", "b"]), ("embed", ["c"]),
+        "session", "lock", ("copy", ["a", "b"]), ("keep", []), ("copy", ["c"]), ("keep", []),
+        ("delete", []), "commit"
+    ]
+    # Staged batches are removed
+    assert list(tmp_path.iterdir()) == [path]
+
+
+def test_update_diffs_again_under_the_lock(monkeypatch, tmp_path):
+    events = []
+    # Planned against version (1: a, 2: b); meanwhile another upload committed (3: b, 4: x)
+    _fake_store(monkeypatch, events, [[(1, "a"), (2, "b")], [(3, "b"), (4, "x")]])
+    monkeypatch.setattr(ingest, "iter_pdf_pages", _windows(["a", "b", "c"]))
+    path = tmp_path / "so_tay.pdf"
+    path.write_bytes(b"%PDF")
+
+    asyncio.run(ingest.ingest_file("so_tay.pdf", str(path), mode="update"))
+
+    transaction = events[events.index("lock"):]
+    assert events[:events.index("lock")] == ["session", ("embed", ["c"]), "session"]
+    # "a" was planned as reused but is gone: embedded in the transaction; "b" keeps the new id
+    assert transaction == [
+        "lock", ("embed", ["a"]), ("copy", ["a"]), ("keep", [3]), ("copy", ["c"]), ("keep", []),
+        ("delete", [4]), "commit"
+    ]
@@ -0,0 +1,86 @@
+import asyncio
+import io
+from types import SimpleNamespace
+
+import pytest
+
+from app.documents import jobs as jobs_module
+from app.documents.jobs import IngestJobManager, TERMINAL_STATUSES
+
+
+class FakeResult:
+    def __init__(self, value):
+        self.value = value
+
+    def scalar(self):
+        return self.value
+
+
+class FakeSession:
+    """Records statements; the job status refresh answers with `job_status`"""
+
+    def __init__(self, log, job_status):
+        self.log = log
+        self.job_status = job_status
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, statement, params=None):
+        self.log.append((str(statement), params))
+        return FakeResult(self.job_status)
+
+    async def commit(self):
+        pass
+
+
+@pytest.fixture
+def manager(monkeypatch, tmp_path):
+    monkeypatch.setattr(jobs_module.settings, "ingest_spool_dir", str(tmp_path))
+    manager = IngestJobManager(num_workers=1)
+
+    async def _get_job(job_id):
+        return {"id": job_id}
+
+    monkeypatch.setattr(manager, "get_job", _get_job)
+    return manager
+
+
+def _upload(name: str):
+    return SimpleNamespace(filename=name, file=io.BytesIO(b"%PDF-1.4"))
+
+
+def _use_session(monkeypatch, job_status):
+    log = []
+    monkeypatch.setattr(jobs_module, "async_session_maker", lambda: FakeSession(log, job_status))
+    return log
+
+
+def test_terminal_statuses_are_bound(manager, monkeypatch):
+    log = _use_session(monkeypatch, "queued")
+
+    asyncio.run(manager.create_job([_upload("a.pdf")]))
+
+    refresh = [(sql, params) for sql, params in log if "UPDATE chat_ingest_jobs" in sql]
+    sql, params = refresh[0]
+    assert "<> ALL(:terminal)" in sql and "NOT IN" not in sql
+    assert params["terminal"] == list(TERMINAL_STATUSES)
+
+
+def test_job_dir_kept_while_files_are_queued(manager, monkeypatch, tmp_path):
+    _use_session(monkeypatch, "queued")
+
+    job = asyncio.run(manager.create_job([_upload("a.pdf")]))
+
+    assert (tmp_path / str(job["id"])).is_dir()
+
+
+def test_job_dir_removed_when_nothing_queued(manager, monkeypatch, tmp_path):
+    _use_session(monkeypatch, "completed")
+
+    job = asyncio.run(manager.create_job([_upload("notes.txt"), _upload("sheet.xlsx")]))
+
+    assert not (tmp_path / str(job["id"])).exists()
@@ -0,0 +1,161 @@
+import asyncio
+import math
+import random
+from collections import Counter
+
+import pytest
+
+from app.rag import memory_bm25
+from app.rag.memory_bm25 import BM25Index, normalize_text, tokenize
+
+VOCABULARY = ["heo", "nái", "tiêm", "phòng", "dịch", "tả", "thức", "ăn", "chuồng", "trại", "sữa", "con", "bệnh", "sốt"]
+QUERIES = ["tiêm phòng heo", "bệnh sốt", "thức ăn cho heo nái", "Tiem Phong", "xyz"]
+
+
+def _rows(seed: int = 1, documents: int = 30) -> list[dict]:
+    rng = random.Random(seed)
+    rows = []
+    for document_id in range(documents):
+        for _ in range(rng.randint(1, 10)):
+            words = rng.choices(VOCABULARY, k=rng.randint(3, 40))
+            rows.append({"id": len(rows) + 1, "document_id": document_id, "content": " ".join(words)})
+    return rows
+
+
+def _brute_force(rows: list[dict], query: str, k1: float = 1.2, b: float = 0.75) -> dict[int, float]:
+    """Textbook BM25 over the rows (chunks sharing no term are left out)"""
+    counts = {row["id"]: Counter(tokenize(row["content"])) for row in rows}
+    n = len(rows)
+    average = sum(sum(c.values()) for c in counts.values()) / n
+    scores = {}
+    for doc_id, terms in counts.items():
+        length = sum(terms.values())
+        score = 0.0
+        for term in set(tokenize(query)):
+            if term in terms:
+                df = sum(1 for other in counts.values() if term in other)
+                idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+                score += idf * terms[term] * (k1 + 1) / (terms[term] + k1 * (1 - b + b * length / average))
+        if score > 0:
+            scores[doc_id] = score
+    return scores
+
+
+def _assert_matches(index: BM25Index, rows: list[dict], top_k: int = 10):
+    for query in QUERIES:
+        expected = _brute_force(rows, query)
+        results = index.search(query, top_k)
+
+        assert len(results) == min(top_k, len(expected))
+        for doc_id, score in results:
+            assert score == pytest.approx(expected[doc_id], rel=1e-5)
+        # Best first, and nothing left out scores higher than the last result
+        scores = [score for _, score in results]
+        assert scores == sorted(scores, reverse=True)
+        returned = {doc_id for doc_id, _ in results}
+        if results:
+            assert all(s <= scores[-1] * (1 + 1e-5) for doc_id, s in expected.items() if doc_id not in returned)
+
+
+def _build(rows: list[dict]) -> BM25Index:
+    index = BM25Index()
+    # One add per document, as uploads do: exercises segment merging
+    for document_id in sorted({row["document_id"] for row in rows}):
+        index.add([row for row in rows if row["document_id"] == document_id])
+    return index
+
+
+def test_tokenize():
+    assert normalize_text("Tiêm phòng Đàn HEO") == "tiem phong dan heo"
+    assert tokenize("Tiêm phòng dịch tả") == ["tiem", "phong", "dich", "ta", "tiem_phong", "phong_dich", "dich_ta"]
+
+
+def test_scores_match_brute_force():
+    rows = _rows()
+    index = _build(rows)
+
+    assert len(index) == len(rows)
+    _assert_matches(index, rows)
+
+
+def test_segments_stay_logarithmic():
+    rows = _rows(documents=64)
+    index = _build(rows)
+
+    assert len(index._segments) <= math.ceil(math.log2(len(rows))) + 1
+
+
+def test_removed_documents_are_not_scored():
+    rows = _rows()
+    index = _build(rows)
+
+    assert index.remove_document(3) == sum(1 for row in rows if row["document_id"] == 3)
+    assert index.remove_document(3) == 0
+    alive = [row for row in rows if row["document_id"] != 3]
+
+    assert len(index) == len(alive)
+    _assert_matches(index, alive)
+
+
+def test_compaction_keeps_scores(monkeypatch):
+    rows = _rows()
+    index = _build(rows)
+    alive = rows
+    compactions = []
+    compact = index._compact
+    monkeypatch.setattr(index, "_compact", lambda: compactions.append(1) or compact())
+
+    for document_id in range(0, 30, 2):
+        index.remove_document(document_id)
+        alive = [row for row in alive if row["document_id"] != document_id]
+        _assert_matches(index, alive)
+
+    assert compactions
+    # Tombstones are squeezed out below the compaction threshold
+    assert len(index._ids) - len(index) <= memory_bm25.COMPACT_DEAD_FRACTION * len(index._ids)
+    assert index.signature() == (len(alive), max(row["id"] for row in alive))
+
+    # Adding after compaction
+    added = [dict(row, id=row["id"] + 1000) for row in rows if row["document_id"] == 0]
+    index.add(added)
+    _assert_matches(index, alive + added)
+
+
+def test_empty_index():
+    index = BM25Index()
+
+    assert index.search("heo") == []
+    assert index.signature() == (0, 0)
+
+
+def test_corpus_events_apply_in_the_background(monkeypatch):
+    rows = _rows(seed=4, documents=3)
+    search = memory_bm25.MemoryBM25Search()
+    search._index = _build(rows)
+    fetched = []
+    changed = [{"id": 1000, "document_id": 0, "content": "heo nái sốt"}]
+
+    async def fetch_rows(document_id=None):
+        fetched.append(document_id)
+        await asyncio.sleep(0.01)
+        return changed
+
+    monkeypatch.setattr(search, "_fetch_rows", fetch_rows)
+
+    async def main():
+        await search._on_corpus_event("changed", 0)
+        # The notifying caller does not wait for the database read
+        assert fetched == []
+        await asyncio.sleep(0)
+        await search._on_corpus_event("changed", 0)
+        await search._on_corpus_event("changed", 0)
+        await search._on_corpus_event("deleted", 1)
+        await search._apply_task
+
+    asyncio.run(main())
+
+    # The two events that arrived while document 0 was applied coalesce into one more read
+    assert fetched == [0, 0]
+    remaining = [row for row in rows if row["document_id"] == 2] + changed
+    assert {doc_id for doc_id, _ in search.search("heo nái sốt", 100)} <= {row["id"] for row in remaining}
+    assert 1000 in {doc_id for doc_id, _ in search.search("heo nái sốt", 100)}
@@ -0,0 +1,154 @@
+import asyncio
+import os
+import time
+
+import numpy as np
+import pytest
+
+from app.rag import memory_vector
+from app.rag.memory_vector import EMBEDDING_DIM, MemoryVectorIndex
+
+
+def _loaded_index(tmp_path, dtype: str, vectors: np.ndarray, ids: list[int]) -> MemoryVectorIndex:
+    """Index mapping a snapshot written to tmp_path (no database)"""
+    index = MemoryVectorIndex(str(tmp_path), dtype=dtype)
+    signature = (len(ids), max(ids, default=0))
+    # Split into pages as _build_snapshot does
+    index._write_snapshot(signature, ids, [vectors[:50].copy(), vectors[50:].copy()])
+    index._ids, index._vectors = index._open_snapshot(signature)
+    index._signature = signature
+    return index
+
+
+def _brute_force(vectors: np.ndarray, ids: list[int], query: np.ndarray, k: int) -> list[tuple[int, float]]:
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    scores = normalized @ (query / np.linalg.norm(query))
+    order = np.argsort(-scores, kind="stable")[:k]
+    return [(ids[i], float(scores[i])) for i in order]
+
+
+@pytest.mark.parametrize("dtype, tolerance", [("float32", 1e-5), ("float16", 2e-3)])
+def test_top_k_matches_brute_force(tmp_path, dtype, tolerance):
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((300, EMBEDDING_DIM)).astype(np.float32)
+    ids = list(range(1000, 1300))
+    queries = rng.standard_normal((4, EMBEDDING_DIM)).astype(np.float32)
+    index = _loaded_index(tmp_path, dtype, vectors, ids)
+
+    assert index.ready and len(index) == 300
+    for query, results in zip(queries, asyncio.run(index.search(queries.tolist(), 10))):
+        expected = _brute_force(vectors, ids, query, 10)
+        assert [doc_id for doc_id, _ in results] == [doc_id for doc_id, _ in expected]
+        assert [score for _, score in results] == pytest.approx([score for _, score in expected], abs=tolerance)
+
+
+def test_top_k_larger_than_index(tmp_path):
+    rng = np.random.default_rng(1)
+    vectors = rng.standard_normal((60, EMBEDDING_DIM)).astype(np.float32)
+    index = _loaded_index(tmp_path, "float32", vectors, list(range(60)))
+
+    results = index.search_batch([vectors[7].tolist()], top_k=100)[0]
+
+    assert len(results) == 60
+    assert results[0][0] == 7
+    assert results[0][1] == pytest.approx(1.0, abs=1e-5)
+
+
+def test_not_loaded(tmp_path):
+    index = MemoryVectorIndex(str(tmp_path))
+
+    assert not index.ready
+    assert index.search_batch([[0.0] * EMBEDDING_DIM], 5) == [[]]
+
+
+def test_snapshot_keeps_the_previous_version(tmp_path):
+    rng = np.random.default_rng(2)
+    vectors = rng.standard_normal((60, EMBEDDING_DIM)).astype(np.float32)
+    index = _loaded_index(tmp_path, "float32", vectors, list(range(60)))
+    for path in tmp_path.iterdir():
+        # Written earlier than the versions below
+        os.utime(path, ns=(1, 1))
+    index._write_snapshot((59, 58), list(range(59)), [vectors[:59].copy()])
+
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        "59-58-float32.ids.npy", "59-58-float32.vectors.npy",
+        "60-59-float32.ids.npy", "60-59-float32.vectors.npy"
+    ]
+
+    index._write_snapshot((58, 57), list(range(58)), [vectors[:58].copy()])
+
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        "58-57-float32.ids.npy", "58-57-float32.vectors.npy",
+        "59-58-float32.ids.npy", "59-58-float32.vectors.npy"
+    ]
+
+
+def test_reload_rebuilds_a_pruned_snapshot(tmp_path, monkeypatch):
+    rng = np.random.default_rng(3)
+    vectors = rng.standard_normal((60, EMBEDDING_DIM)).astype(np.float32)
+    index = _loaded_index(tmp_path, "float32", vectors, list(range(60)))
+    built = []
+
+    async def signature():
+        return (60, 59)
+
+    async def build_snapshot():
+        built.append(True)
+        index._write_snapshot((60, 59), list(range(60)), [vectors.copy()])
+        return (60, 59)
+
+    open_snapshot = index._open_snapshot
+
+    def pruned_once(signature):
+        if not built:
+            raise FileNotFoundError("pruned by another process")
+        return open_snapshot(signature)
+
+    monkeypatch.setattr(memory_vector.corpus, "corpus_signature", signature)
+    monkeypatch.setattr(index, "_build_snapshot", build_snapshot)
+    monkeypatch.setattr(index, "_open_snapshot", pruned_once)
+
+    asyncio.run(index.reload())
+
+    assert built == [True] and index.ready and len(index) == 60
+
+
+def test_corpus_events_reload_in_the_background(tmp_path, monkeypatch):
+    vectors = np.ones((3, EMBEDDING_DIM), dtype=np.float32)
+    index = _loaded_index(tmp_path, "float32", vectors, [1, 2, 3])
+    opened = []
+    open_snapshot = index._open_snapshot
+
+    async def signature():
+        return (3, 3)
+
+    def slow_open(signature):
+        opened.append(signature)
+        time.sleep(0.2)
+        return open_snapshot(signature)
+
+    monkeypatch.setattr(memory_vector.corpus, "corpus_signature", signature)
+    monkeypatch.setattr(index, "_open_snapshot", slow_open)
+
+    async def main():
+        await index._on_corpus_event("changed", 1)
+        # The event returns before the reload ran; the index is not served meanwhile
+        assert opened == [] and not index.ready
+        await asyncio.sleep(0.05)
+        await index._on_corpus_event("changed", 2)
+        await index._on_corpus_event("deleted", 3)
+        await asyncio.sleep(0.25)
+        # The first reload finished, but it may not include the later events
+        assert len(opened) == 2 and not index.ready
+        await index._reload_task
+
+    asyncio.run(main())
+
+    # One reload for the first event, one more for the two that arrived during it
+    assert len(opened) == 2
+    assert index.ready
+
+
+def test_unknown_dtype(tmp_path):
+    with pytest.raises(ValueError):
+        MemoryVectorIndex(str(tmp_path), dtype="int8")
@@ -0,0 +1,51 @@
+import pytest
+
+from app.rag.query_transformer import parse_expansion, rewrite_skip_reason
+
+QUERY = "heo bị sốt phải làm gì"
+
+
+@pytest.mark.parametrize("query, reason", [
+    ("tiêm phòng heo nái", "keywords"),
+    ("PRRS", "exact_terms"),
+    ("lịch tiêm PCV2 cho heo con sau cai sữa", "exact_terms"),
+    ('liều "Amoxicillin" cho heo con sau cai sữa', "exact_terms"),
+    # Question words win over exact terms: the rewrite makes them searchable
+    ("heo bị PRRS thì làm gì", None),
+    ("heo con bị tiêu chảy phải làm sao", None),
+    ("quy trình vệ sinh chuồng trại trước khi nhập đàn heo mới", None),
+    (" ".join(["heo"] * 30), "long"),
+])
+def test_rewrite_skip_reason(query, reason):
+    assert rewrite_skip_reason(query) == reason
+
+
+@pytest.mark.parametrize("text", [
+    '{"rewritten": "xử lý heo sốt", "variations": ["heo sốt cao", "hạ sốt cho heo"]}',
+    '```json\n{"rewritten": "xử lý heo sốt", "variations": ["heo sốt cao", "hạ sốt cho heo"]}\n```',
+    'Kết quả: {"rewritten": "xử lý heo sốt", "variations": ["heo sốt cao", "hạ sốt cho heo"]} xong.',
+    '{"rewritten": "xử lý heo sốt", "variations": "heo sốt cao\\nhạ sốt cho heo"}',
+    '["xử lý heo sốt", "heo sốt cao", "hạ sốt cho heo"]',
+    "1. xử lý heo sốt\n2. heo sốt cao\n- \"hạ sốt cho heo\"",
+])
+def test_parse_expansion_formats(text):
+    assert parse_expansion(text, QUERY, 3) == ("xử lý heo sốt", ["heo sốt cao", "hạ sốt cho heo"])
+
+
+def test_parse_expansion_limits_and_cleans_variations():
+    text = '{"rewritten": "  xử lý heo sốt ", "variations": ["a", "", 3, " b ", "c", "d"]}'
+
+    assert parse_expansion(text, QUERY, 2) == ("xử lý heo sốt", ["a", "b"])
+    assert parse_expansion(text, QUERY, 0) == ("xử lý heo sốt", [])
+
+
+@pytest.mark.parametrize("text", [
+    "",
+    "{}",
+    '{"rewritten": "", "variations": null}',
+    '{"rewritten": 42}',
+    '{"rewritten": "xử lý heo sốt", "variations": [',  # truncated JSON
+    "[1, 2]",
+])
+def test_parse_expansion_falls_back_to_query(text):
+    assert parse_expansion(text, QUERY, 3) == (QUERY, [])
@@ -0,0 +1,89 @@
+import pytest
+
+from app.rag import rerank_policy
+from app.rag.rerank_policy import RerankPlan, plan_rerank, without_rerank
+
+RRF_K = 60
+
+
+def _doc(doc_id: int, vector_rank=None, bm25_rank=None) -> dict:
+    score = sum(1 / (RRF_K + rank) for rank in (vector_rank, bm25_rank) if rank is not None)
+    return {
+        "id": doc_id,
+        "rrf_score": score,
+        "in_vector": vector_rank is not None,
+        "in_bm25": bm25_rank is not None
+    }
+
+
+@pytest.fixture(autouse=True)
+def adaptive(monkeypatch):
+    monkeypatch.setattr(rerank_policy.settings, "rerank_policy", "adaptive")
+    monkeypatch.setattr(rerank_policy.settings, "rerank_budget_ratio", 0.8)
+    monkeypatch.setattr(rerank_policy.settings, "rerank_skip_enabled", True)
+    monkeypatch.setattr(rerank_policy.settings, "rerank_skip_margin", 0.6)
+
+
+def test_skips_unambiguous_head():
+    # Top 5 found by both retrievers, then single-retriever documents (about half the score)
+    results = [_doc(i, i, i) for i in range(1, 6)] + [_doc(i, vector_rank=i) for i in range(6, 20)]
+
+    assert plan_rerank(results, top_k=5) == RerankPlan(candidates=0, skip=True, reason="unambiguous")
+
+
+def test_budget_drops_uncompetitive_candidates():
+    # A close agreed runner-up (no skip), then single-retriever documents below 0.8 x the 5th score
+    results = [_doc(i, i, i) for i in range(1, 6)] + [_doc(6, 20, 20)]
+    results += [_doc(i, vector_rank=i) for i in range(7, 20)]
+
+    assert plan_rerank(results, top_k=5) == RerankPlan(candidates=6, skip=False, reason="budget")
+
+
+def test_flat_scores_rerank_everything():
+    results = [_doc(i, vector_rank=i) for i in range(1, 12)]
+
+    assert plan_rerank(results, top_k=5) == RerankPlan(candidates=11, skip=False, reason="all")
+
+
+def test_close_runner_up_prevents_skip():
+    # The 6th document is also agreed: the head is not clearly separated
+    results = [_doc(i, i, i) for i in range(1, 7)]
+
+    plan = plan_rerank(results, top_k=5)
+
+    assert not plan.skip
+    assert plan.candidates == 6
+
+
+def test_max_candidates():
+    results = [_doc(i, vector_rank=i) for i in range(1, 40)]
+
+    assert plan_rerank(results, top_k=5, max_candidates=20).candidates == 20
+
+
+def test_policy_all_and_empty(monkeypatch):
+    results = [_doc(i, i, i) for i in range(1, 8)]
+    monkeypatch.setattr(rerank_policy.settings, "rerank_policy", "all")
+
+    assert plan_rerank(results, top_k=5) == RerankPlan(candidates=7, skip=False, reason="all")
+    assert plan_rerank([], top_k=5) == RerankPlan(candidates=0, skip=False, reason="all")
+
+
+def test_skip_disabled(monkeypatch):
+    results = [_doc(i, i, i) for i in range(1, 6)] + [_doc(6, vector_rank=30)]
+    monkeypatch.setattr(rerank_policy.settings, "rerank_skip_enabled", False)
+
+    assert not plan_rerank(results, top_k=5).skip
+
+
+def test_without_rerank():
+    results = [_doc(1, 1, 1), _doc(2, vector_rank=2), _doc(3, bm25_rank=3)]
+
+    skipped = without_rerank(results, top_k=2, rrf_k=RRF_K)
+
+    assert [doc["id"] for doc in skipped] == [1, 2]
+    assert skipped[0]["rerank_score"] == pytest.approx(1.0)
+    assert skipped[1]["rerank_score"] == pytest.approx((1 / 62) / (2 / 61))
+    assert all(doc["rerank_source"] == "skipped" for doc in skipped)
+    # Input is not modified
+    assert "rerank_score" not in results[0]
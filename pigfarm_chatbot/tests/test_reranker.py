@@ -0,0 +1,101 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app.rag.local_ranker import get_local_ranker, lexical_scores
+from app.rag.reranker import CohereReranker
+
+QUERY = "tiêm phòng heo con"
+DOCUMENTS = [
+    {"id": 1, "content": "Lịch tiêm phòng heo con sau cai sữa"},
+    {"id": 2, "content": "Khẩu phần thức ăn cho heo nái"},
+    {"id": 3, "content": "Vệ sinh chuồng trại"},
+]
+
+
+class FakeCohere:
+    def __init__(self, scores: dict[int, float], fail: bool = False):
+        self.scores = scores
+        self.fail = fail
+        self.calls = []
+
+    async def rerank(self, model, query, documents, top_n, return_documents):
+        self.calls.append(documents)
+        if self.fail:
+            raise RuntimeError("Cohere down")
+        by_content = {doc["content"]: doc["id"] for doc in DOCUMENTS}
+        return SimpleNamespace(results=[
+            SimpleNamespace(index=i, relevance_score=self.scores[by_content[content]])
+            for i, content in enumerate(documents)
+        ])
+
+
+@pytest.fixture
+def reranker() -> CohereReranker:
+    return CohereReranker(top_k=3, fallback=lexical_scores)
+
+
+def test_lexical_scores():
+    scores = lexical_scores(QUERY, DOCUMENTS)
+
+    assert scores[0] == pytest.approx(1.0)
+    assert 0 < scores[1] < scores[0]
+    assert scores[2] == 0.0
+    assert lexical_scores("!!!", DOCUMENTS) == [0.0, 0.0, 0.0]
+
+
+def test_get_local_ranker():
+    assert get_local_ranker("lexical") is lexical_scores
+    assert get_local_ranker("none") is None
+    with pytest.raises(ValueError):
+        get_local_ranker("bert")
+
+
+def test_cached_scores_skip_the_api(reranker):
+    reranker.client = FakeCohere({1: 0.9, 2: 0.4, 3: 0.1})
+    first = asyncio.run(reranker.rerank(QUERY, DOCUMENTS, corpus_version=1))
+    second = asyncio.run(reranker.rerank(QUERY, DOCUMENTS, corpus_version=1))
+
+    assert [doc["id"] for doc in first] == [1, 2, 3]
+    assert [doc["rerank_source"] for doc in first] == ["cohere"] * 3
+    assert [doc["rerank_source"] for doc in second] == ["cached"] * 3
+    assert len(reranker.client.calls) == 1
+
+    # A new corpus version is scored again
+    asyncio.run(reranker.rerank(QUERY, DOCUMENTS, corpus_version=2))
+    assert len(reranker.client.calls) == 2
+
+
+def test_fallback_does_not_mix_cached_cohere_scores(reranker):
+    # Document 2 has a high cached Cohere score; documents 1 and 3 are unseen
+    reranker.client = FakeCohere({2: 0.95})
+    asyncio.run(reranker.rerank(QUERY, [DOCUMENTS[1]], corpus_version=1))
+    reranker.client = FakeCohere({}, fail=True)
+
+    results = asyncio.run(reranker.rerank(QUERY, DOCUMENTS, corpus_version=1))
+
+    local = lexical_scores(QUERY, DOCUMENTS)
+    assert [doc["id"] for doc in results] == [1, 2, 3]
+    assert [doc["rerank_score"] for doc in results] == [local[0], local[1], local[2]]
+    assert {doc["rerank_source"] for doc in results} == {"fallback"}
+
+
+def test_fallback_threshold(reranker, monkeypatch):
+    from app.rag import reranker as reranker_module
+
+    reranker.client = FakeCohere({}, fail=True)
+    local = lexical_scores(QUERY, DOCUMENTS)
+    monkeypatch.setattr(reranker_module.settings, "rerank_fallback_threshold", local[1] + 0.01)
+
+    results = asyncio.run(reranker.rerank_with_threshold(QUERY, DOCUMENTS, threshold=0.0, corpus_version=1))
+
+    assert [doc["id"] for doc in results] == [1]
+
+
+def test_no_fallback_raises():
+    reranker = CohereReranker(top_k=3, fallback=None)
+    reranker.client = FakeCohere({}, fail=True)
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(reranker.rerank(QUERY, DOCUMENTS, corpus_version=1))
@@ -0,0 +1,59 @@
+import asyncio
+
+import pytest
+
+from app.rag import hybrid_search as hybrid_module
+from app.rag.deadline import Deadline
+from app.rag.hybrid_search import HybridSearch
+
+
+@pytest.fixture
+def hybrid(monkeypatch) -> HybridSearch:
+    monkeypatch.setattr(hybrid_module.settings, "retrieval_concurrency", 2)
+    monkeypatch.setattr(hybrid_module.settings, "lexical_search_backend", "sql")
+    return HybridSearch()
+
+
+def _fake_retriever(active: list, peak: list, delay: float = 0.05, result=(1, 1.0)):
+    async def search_multi_query(queries, k, semaphore=None, options=None):
+        async def one(query):
+            async with semaphore:
+                active.append(1)
+                peak[0] = max(peak[0], len(active))
+                await asyncio.sleep(delay)
+                active.pop()
+                return [result]
+        return [c for results in await asyncio.gather(*(one(q) for q in queries)) for c in results]
+    return search_multi_query
+
+
+def test_fan_out_is_bounded_per_search(hybrid, monkeypatch):
+    active, peak = [], [0]
+    monkeypatch.setattr(hybrid.vector_search, "search_multi_query", _fake_retriever(active, peak))
+    monkeypatch.setattr(hybrid.bm25_search, "search_multi_query", _fake_retriever(active, peak))
+
+    async def main():
+        # One search: 2 retrievers x 3 variations under a bound of 2
+        await hybrid.retrieve(["a", "b", "c"])
+        single_peak = peak[0]
+        peak[0] = 0
+        # Concurrent searches do not queue behind one shared bound
+        await asyncio.gather(*(hybrid.retrieve(["a", "b", "c"]) for _ in range(4)))
+        return single_peak
+
+    assert asyncio.run(main()) == 2
+    assert peak[0] == 8
+
+
+def test_slow_retriever_times_out_alone(hybrid, monkeypatch):
+    monkeypatch.setattr(hybrid_module.settings, "vector_search_timeout_seconds", 0.05)
+    monkeypatch.setattr(
+        hybrid.vector_search, "search_multi_query", _fake_retriever([], [0], delay=1.0, result=(1, 0.9))
+    )
+    monkeypatch.setattr(hybrid.bm25_search, "search_multi_query", _fake_retriever([], [0], result=(2, 3.0)))
+    deadline = Deadline(5.0)
+
+    vector, bm25 = asyncio.run(hybrid.retrieve(["a"], deadline=deadline))
+
+    assert (vector, bm25) == ([], [(2, 3.0)])
+    assert [(d["stage"], d["action"]) for d in deadline.degradations] == [("vector", "timeout")]
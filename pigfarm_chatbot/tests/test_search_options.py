@@ -0,0 +1,98 @@
+import asyncio
+
+import pytest
+
+from app.rag import vector_search as vector_module
+from app.rag.search_options import SearchOptions, filter_params, filter_sql
+from app.rag.vector_search import VectorSearch
+
+
+class FakeResult:
+    def __init__(self, value):
+        self.value = value
+
+    def scalar(self):
+        return self.value
+
+
+class FakeSession:
+    """Records statements; answers the pgvector version query"""
+
+    def __init__(self, pgvector_version: str):
+        self.pgvector_version = pgvector_version
+        self.statements = []
+
+    async def execute(self, statement, params=None):
+        self.statements.append((str(statement), params or {}))
+        return FakeResult(self.pgvector_version)
+
+
+def _hnsw_settings(session: FakeSession) -> dict:
+    return {
+        key: value
+        for statement, params in session.statements if "set_config" in statement
+        for key, value in params.items()
+    }
+
+
+@pytest.fixture
+def searcher(monkeypatch) -> VectorSearch:
+    monkeypatch.setattr(vector_module.settings, "filtered_iterative_scan", "relaxed_order")
+    monkeypatch.setattr(vector_module.settings, "filtered_ef_search", 200)
+    return VectorSearch(top_k=10, storage_mode="full", backend="pgvector")
+
+
+def test_filters_sql():
+    options = SearchOptions(filename="so_tay.pdf", metadata={"chuong": "2"})
+
+    sql = filter_sql(options, alias="d")
+    assert "d.document_id = (SELECT id FROM chat_document_catalog" in sql
+    assert "d.metadata @> CAST(:filter_metadata AS jsonb)" in sql
+    assert filter_params(options) == {"filter_filename": "so_tay.pdf", "filter_metadata": '{"chuong": "2"}'}
+    assert filter_sql(None) == "" and filter_params(SearchOptions()) == {}
+
+
+def test_unknown_iterative_scan():
+    with pytest.raises(ValueError):
+        SearchOptions(iterative_scan="fast")
+
+
+def test_filtered_search_uses_iterative_scan(searcher):
+    session = FakeSession("0.8.0")
+    options = SearchOptions(filename="so_tay.pdf")
+
+    params = asyncio.run(searcher.prepare_candidates(session, 10, options))
+
+    assert _hnsw_settings(session) == {"iterative_scan": "relaxed_order"}
+    assert params["filter_filename"] == "so_tay.pdf"
+    assert searcher.iterative_scan(options) == "relaxed_order"
+
+
+def test_filtered_search_raises_ef_search_on_old_pgvector(searcher):
+    session = FakeSession("0.7.4")
+    options = SearchOptions(filename="so_tay.pdf")
+
+    asyncio.run(searcher.prepare_candidates(session, 10, options))
+
+    assert _hnsw_settings(session) == {"ef_search": "200"}
+    assert searcher.iterative_scan(options) is None
+
+
+def test_explicit_options_win(searcher):
+    session = FakeSession("0.8.0")
+    options = SearchOptions(filename="so_tay.pdf", iterative_scan="strict_order", ef_search=80)
+
+    asyncio.run(searcher.prepare_candidates(session, 10, options))
+
+    assert _hnsw_settings(session) == {"ef_search": "80", "iterative_scan": "strict_order"}
+
+
+def test_unfiltered_search_keeps_server_settings(searcher):
+    session = FakeSession("0.8.0")
+
+    asyncio.run(searcher.prepare_candidates(session, 10, SearchOptions()))
+    asyncio.run(searcher.prepare_candidates(session, 10, None))
+
+    assert _hnsw_settings(session) == {}
+    # The version is read once
+    assert sum("pg_extension" in statement for statement, _ in session.statements) == 1